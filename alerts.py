@@ -0,0 +1,260 @@
+"""Alert rules evaluated on each reading, with notifications off the hot path.
+
+Rules come from a JSON file (ALERTS_PATH in realtime.py, --alerts for either
+script):
+
+    {"rules": [
+        {"name": "Freezing", "field": "tempf", "below": 32, "clear": 34, "for": 600},
+        {"name": "Pressure falling fast", "field": "pressure_rate", "below": -0.06,
+         "clear": -0.03, "cooldown": 10800},
+        {"name": "Temperature jump", "field": "tempf", "rate": 1800, "above": 8},
+        {"name": "Gusty", "field": "windgustmph", "above": 35, "clear": 25}
+     ],
+     "notify": {"bell": true,
+                "command": ["notify-send", "Weather alert"],
+                "webhook": "http://127.0.0.1:8765/alerts"}}
+
+A rule fires when its field goes above `above` (or below `below`) and stays
+there for `for` seconds, and clears once it's back past `clear` (the
+threshold itself by default), so a value hovering at the threshold doesn't
+flap. With `rate`, the rule looks at the field's change per hour over the
+last `rate` seconds instead of its value. `pressure_rate` is the barometer
+trend in inHg per hour. A rule notifies at most once per `cooldown` seconds
+(default 3600); clearing is only notified with "notify_clear": true.
+
+Commands get the alert in ALERT_* environment variables and webhooks get it
+as a JSON POST. Either way delivery happens on the notifier's own task, so a
+slow command or a webhook that's down never holds up ingest or rendering.
+"""
+import asyncio
+import curses
+import json
+import os
+from collections import deque
+from lazy import LazyModule
+from metrics import METRICS
+from screen import line
+
+aiohttp = LazyModule('aiohttp')
+
+# Fields computed from a station's state rather than taken from the reading
+DERIVED_FIELDS = ('pressure_rate',)
+
+
+def derived_values(fields, pressure_analyzer):
+    """The DERIVED_FIELDS some rule uses, for AlertEngine.update()"""
+    if 'pressure_rate' not in fields:
+        return None
+    trend, rate = pressure_analyzer.get_trend()
+    return None if trend == "INSUFFICIENT_DATA" else {'pressure_rate': rate}
+
+
+class Rule:
+    """One compiled rule; the thresholds, with state kept per station in AlertEngine"""
+
+    def __init__(self, name, field, above=None, below=None, clear=None, duration=0,
+                 rate=None, cooldown=3600, notify_clear=False):
+        if (above is None) == (below is None):
+            raise ValueError(f"alert rule {name!r} needs exactly one of 'above' and 'below'")
+        self.name = name
+        self.field = field
+        self.rising = above is not None
+        self.threshold = above if self.rising else below
+        self.clear = self.threshold if clear is None else clear
+        if (self.clear > self.threshold) if self.rising else (self.clear < self.threshold):
+            raise ValueError(f"alert rule {name!r}: 'clear' must be on the safe side of the threshold")
+        self.duration = duration
+        self.rate = rate
+        self.cooldown = cooldown
+        self.notify_clear = notify_clear
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['name'], config['field'], config.get('above'), config.get('below'),
+                   config.get('clear'), config.get('for', 0), config.get('rate'),
+                   config.get('cooldown', 3600), config.get('notify_clear', False))
+
+    def breached(self, value):
+        return value > self.threshold if self.rising else value < self.threshold
+
+    def cleared(self, value):
+        return value < self.clear if self.rising else value > self.clear
+
+
+class RuleState:
+    __slots__ = ('active', 'announced', 'since', 'notified', 'value', 'samples')
+
+    def __init__(self, rule):
+        self.active = False
+        self.announced = False  # Whether this breach was notified (not in cooldown)
+        self.since = None  # When the current breach started
+        self.notified = None  # When this rule last notified
+        self.value = None
+        # (timestamp, value) over the rate window, oldest first
+        self.samples = deque() if rule.rate else None
+
+
+def load_rules(path):
+    """Compile the rules in a JSON file; returns (rules, notify options)"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    return [Rule.from_config(rule) for rule in config.get('rules', [])], config.get('notify', {})
+
+
+class AlertEngine:
+    """Evaluates rules against one station's readings as they arrive.
+
+    Rules are grouped by field, so a reading costs one lookup per field some
+    rule watches however many fields it carries, and each rule keeps just
+    enough state (when the breach started, when it last notified, a window of
+    samples for rate rules) to decide from the new value alone.
+    """
+
+    def __init__(self, rules, notifier=None, station=''):
+        self.notifier = notifier
+        self.station = station
+        self.by_field = {}
+        for rule in rules:
+            self.by_field.setdefault(rule.field, []).append((rule, RuleState(rule)))
+        self.fields = frozenset(self.by_field)
+
+    def active(self):
+        """(rule, value) for every rule currently firing"""
+        return [(rule, state.value) for rules in self.by_field.values()
+                for rule, state in rules if state.active]
+
+    def _rate(self, rule, state, timestamp, value):
+        samples = state.samples
+        samples.append((timestamp, value))
+        while len(samples) > 1 and samples[0][0] < timestamp - rule.rate:
+            samples.popleft()
+        first_time, first_value = samples[0]
+        if timestamp - first_time < rule.rate / 2:
+            return None  # Not enough of the window to say yet
+        return (value - first_value) / (timestamp - first_time) * 3600
+
+    @METRICS.timed('alerts')
+    def update(self, timestamp, reading, derived=None):
+        """Evaluate each watched field the reading (or `derived`) has a number for at `timestamp`"""
+        for field, rules in self.by_field.items():
+            value = reading.get(field)
+            if value is None and derived is not None:
+                value = derived.get(field)
+            if not isinstance(value, (int, float)):
+                continue
+            for rule, state in rules:
+                self._evaluate(rule, state, timestamp, value)
+
+    def _evaluate(self, rule, state, timestamp, value):
+        if rule.rate:
+            value = self._rate(rule, state, timestamp, value)
+            if value is None:
+                return
+        state.value = value
+        if state.active:
+            if rule.cleared(value):
+                state.active = False
+                state.since = None
+                if rule.notify_clear and state.announced:
+                    self._notify(rule, 'cleared', timestamp, value)
+            return
+        if not rule.breached(value):
+            state.since = None
+            return
+        if state.since is None:
+            state.since = timestamp
+        if timestamp - state.since >= rule.duration:
+            state.active = True
+            state.announced = state.notified is None or timestamp - state.notified >= rule.cooldown
+            if state.announced:
+                state.notified = timestamp
+                self._notify(rule, 'fired', timestamp, value)
+
+    def _notify(self, rule, status, timestamp, value):
+        METRICS.incr('alerts_' + status)
+        if self.notifier is not None:
+            self.notifier.submit({
+                'rule': rule.name,
+                'station': self.station,
+                'status': status,
+                'field': rule.field,
+                'value': round(value, 4),
+                'timestamp': timestamp,
+                'message': f"{self.station}: {rule.name} ({rule.field} {value:.4g})"
+                           + (" cleared" if status == 'cleared' else ""),
+            })
+
+
+class Notifier:
+    """Delivers alerts from a queue on its own task.
+
+    submit() never blocks: alerts beyond `max_queue` waiting are dropped and
+    counted in the alerts_dropped metric. `bell` is called for each alert
+    (e.g. curses.beep); commands and webhooks time out after `timeout`.
+    """
+
+    def __init__(self, command=None, webhook=None, bell=None, max_queue=100, timeout=10):
+        self.command = command
+        self.webhook = webhook
+        self.bell = bell
+        self.timeout = timeout
+        self.queue = asyncio.Queue(max_queue)
+        self.session = None
+
+    @classmethod
+    def from_config(cls, config, bell=None):
+        return cls(config.get('command'), config.get('webhook'),
+                   bell if config.get('bell') else None)
+
+    def submit(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            METRICS.incr('alerts_dropped')
+
+    async def _run_command(self, alert):
+        env = dict(os.environ, **{f'ALERT_{key.upper()}': str(value) for key, value in alert.items()})
+        process = await asyncio.create_subprocess_exec(
+            *self.command, env=env, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            await asyncio.wait_for(process.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+
+    async def _post(self, alert):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self.session.post(self.webhook, json=alert) as response:
+            response.raise_for_status()
+
+    async def deliver(self, alert):
+        if self.bell is not None:
+            self.bell()
+        for target, send in ((self.command, self._run_command), (self.webhook, self._post)):
+            if not target:
+                continue
+            try:
+                await send(alert)
+                METRICS.incr('alerts_sent')
+            except Exception:
+                METRICS.incr('alert_errors')
+
+    async def run(self):
+        try:
+            while True:
+                await self.deliver(await self.queue.get())
+        finally:
+            if self.session is not None:
+                await self.session.close()
+
+
+def alert_lines(engine):
+    """An Alerts row naming every rule that's firing, or nothing if none are"""
+    active = engine.active()
+    if not active:
+        return []
+    names = ', '.join(rule.name for rule, _ in active)
+    return [line("Alerts      | ", (names, curses.color_pair(4) | curses.A_BOLD))]
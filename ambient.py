@@ -1,135 +1,236 @@
-import requests
 import curses
 import time
-import math
-from collections import deque
-from datetime import datetime, timedelta
-import numpy as np
+import signal
+import argparse
+import asyncio
+from contextlib import aclosing
+from layout import Layout, load_layout
+from lazy import LazyModule
+from backfill import API_URL, HistoryFetcher, backfill
+from screen import LineRenderer, barometer_line, line
+from metrics import METRICS
+from sources import RestSource
+from wind import wind_lines
+from extremes import stats_lines
+from charts import chart_lines
+from export import FORMATS, ExportSink, export_fields, export_record
+from alerts import AlertEngine, Notifier, alert_lines, load_rules
+from station import StationState
+from profiling import Profiler
 
-class PressureTrendAnalyzer:
-    def __init__(self, window_hours=3, min_samples=6):
-        self.window_hours = window_hours
-        self.min_samples = min_samples
-        self.pressure_history = deque(maxlen=500)  # Store (timestamp, pressure) tuples
-        
-    def add_reading(self, pressure):
-        self.pressure_history.append((datetime.now(), pressure))
-        
-    def get_trend(self):
-        # Remove readings older than window_hours
-        cutoff_time = datetime.now() - timedelta(hours=self.window_hours)
-        while self.pressure_history and self.pressure_history[0][0] < cutoff_time:
-            self.pressure_history.popleft()
-        
-        if len(self.pressure_history) < self.min_samples:
-            return "INSUFFICIENT_DATA", 0
-        
-        # Convert to numpy arrays for analysis
-        times = np.array([(t - cutoff_time).total_seconds() / 3600 
-                         for t, _ in self.pressure_history])
-        pressures = np.array([p for _, p in self.pressure_history])
-        
-        # Calculate linear regression
-        slope, _ = np.polyfit(times, pressures, 1)
-        
-        # Convert slope to change per hour
-        change_per_hour = slope
-        
-        # Categorize the trend
-        if abs(change_per_hour) < 0.02:
-            return "STEADY", change_per_hour
-        elif change_per_hour > 0:
-            return "RISING", change_per_hour
-        else:
-            return "FALLING", change_per_hour
+requests = LazyModule('requests')
 
-def display_data(window, data, pressure_analyzer):
-    curses.start_color()
-    curses.init_pair(1, curses.COLOR_CYAN, curses.COLOR_BLACK)
-    curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
-    curses.init_pair(3, curses.COLOR_YELLOW, curses.COLOR_BLACK)
-    curses.init_pair(4, curses.COLOR_RED, curses.COLOR_BLACK)
-    
-    window.clear()
-    window.addstr(0, 0, "Ambient Weather Station ", curses.A_BOLD)
-    window.addstr(1, 0, "-" * curses.COLS)
-    window.addstr(f"Temperature | {data['lastData']['tempf']}° F\n")
-    window.addstr(f"Humidity    | {data['lastData']['humidity']} %\n")
-    window.addstr(f"Feels Like  | {data['lastData']['feelsLike']}° F\n")
-    window.addstr(f"Dew Point   | {data['lastData']['dewPoint']}° F\n")
-    window.addstr(f"UV Index    | {data['lastData']['uv']}\n")
-    window.addstr(f"Solar Rad   | {data['lastData']['solarradiation']} W/m²\n")
-    window.addstr(f"Downstairs  | {data['lastData']['tempinf']}° / {data['lastData']['humidityin']} %\n")
-    window.addstr(f"Upstairs    | {data['lastData']['temp2f']}° / {data['lastData']['humidity2']} %\n")
-    
-    # Enhanced barometer display
-    current_pressure = data['lastData']['baromrelin']
-    trend, change_rate = pressure_analyzer.get_trend()
-    window.addstr(f"Barometer   | {current_pressure:.3f} inHg ")
-    
-    if trend == "INSUFFICIENT_DATA":
-        window.addstr("(collecting data...)\n", curses.color_pair(3))
-    else:
-        # Display trend arrow
-        if trend == "RISING":
-            if abs(change_rate) > 0.06:
-                window.addstr("▲▲", curses.color_pair(2))  # Fast rise
-            else:
-                window.addstr("▲", curses.color_pair(2))   # Slow rise
-        elif trend == "FALLING":
-            if abs(change_rate) > 0.06:
-                window.addstr("▼▼", curses.color_pair(4))  # Fast fall
-            else:
-                window.addstr("▼", curses.color_pair(4))   # Slow fall
-        else:
-            window.addstr("▷", curses.color_pair(3))      # Steady
-            
-        # Display numeric trend
-        window.addstr(f" ({change_rate:+.3f}/hr)\n", curses.color_pair(1))
-    
-    window.addstr(f"Wind Speed  | {data['lastData']['windspeedmph']} mph")
-    window.addstr(f", gust {data['lastData']['windgustmph']}")
-    window.addstr(f", max {data['lastData']['maxdailygust']}\n")
-    window.addstr(f"Wind Dir    | {wind_direction(data['lastData']['winddir'])}")
-    window.addstr(f", average {wind_direction(data['lastData']['winddir_avg10m'])}\n")
-    window.addstr(f"Daily Rain  | {data['lastData']['dailyrainin']} in\n")
-    window.addstr(f"Battery     |")
-    if data['lastData']['battout'] == 1:
-        window.addstr(f" Good\n", curses.color_pair(2))
-    else:
-        window.addstr(f" Low\n", curses.color_pair(4))
-    window.addstr(f"Last Update | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
-    window.refresh()
+@METRICS.timed('display_data')
+def display_data(renderer, layout, record, pressure_analyzer, wind=None, stats=None, charts=None,
+                 alerts=None):
+    groups = {}
+    if alerts is not None:
+        groups['alerts'] = alert_lines(alerts)
+    if record.get('baromrelin') is not None:
+        groups['barometer'] = [barometer_line(record.baromrelin, pressure_analyzer)]
+    if wind is not None:
+        groups['wind'] = wind_lines(wind.get_stats(), wind.window_seconds)
+    if stats is not None:
+        groups['stats'] = stats_lines(stats)
+    if charts is not None:
+        cache, span = charts
+        # Beside the 13 character gutter, and never narrower than a column
+        groups['charts'] = chart_lines(cache, span, max(curses.COLS - 14, 2))
+    lines = [
+        line(("Ambient Weather Station ", curses.A_BOLD)),
+        line("-" * curses.COLS),
+    ]
+    lines.extend(layout.lines(record, **groups))
+    lines.append(line(f"Last Update | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}"))
+
+    # Only rows that changed since the last poll are rewritten
+    renderer.render(lines)
+    renderer.window.noutrefresh()
+    curses.doupdate()
 
-def wind_direction(degrees):
-    directions = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE', 
-                 'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
-    index = math.floor((degrees + 11.25) / 22.5)
-    return directions[index % 16]
+async def main(window, api_url=API_URL, sink=None, layout_path=None, alerts=None, profiler=None,
+               poll=None):
+    """Poll and display readings; with window None, only archive them to sink.
 
-def main(window):
+    layout_path is a JSON file choosing the fields shown (see layout.py),
+    alerts the (rules, notify options) from alerts.load_rules() and profiler
+    an optional profiling.Profiler counting 'readings' as its events. poll
+    overrides RestPoller's options, e.g. a shorter interval for a replay
+    server that updates faster than Ambient does.
+    """
     api_key = ''
     app_key = ''
-    url = f'https://rt.ambientweather.net/v1/devices?apiKey={api_key}&applicationKey={app_key}&limit=1'
+    # readings are kept here across restarts; set to None to disable
+    history_path = 'weather_history.bin'
+    # hours of readings to fetch at startup; 0 to skip
+    backfill_hours = 3
+    # serve hot-path timings at http://127.0.0.1:<port>/metrics; None to disable
+    metrics_port = None
+    # show the timings row on screen
+    show_diagnostics = False
+    # show the last hour's wind statistics and wind rose
+    show_wind = False
+    # show today's highs/lows and rolling 1h/24h/7d statistics
+    show_stats = False
+    # pressure, temperature and wind charts over '3h', '24h' or '7d'; None to hide
+    chart_span = None
+    # highs and lows reset at midnight here
+    timezone = 'America/Chicago'
     
-    pressure_analyzer = PressureTrendAnalyzer(window_hours=3, min_samples=6)
+    if window is None:
+        show_wind = show_stats = show_diagnostics = False
+        chart_span = None
+    else:
+        curses.start_color()
+        curses.init_pair(1, curses.COLOR_CYAN, curses.COLOR_BLACK)
+        curses.init_pair(2, curses.COLOR_GREEN, curses.COLOR_BLACK)
+        curses.init_pair(3, curses.COLOR_YELLOW, curses.COLOR_BLACK)
+        curses.init_pair(4, curses.COLOR_RED, curses.COLOR_BLACK)
+        renderer = LineRenderer(window)
+    if metrics_port:
+        METRICS.serve(metrics_port)
     
-    while True:
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()[0]
-            
-            current_pressure = data['lastData']['baromrelin']
-            pressure_analyzer.add_reading(current_pressure)
-            display_data(window, data, pressure_analyzer)
-            
-            time.sleep(30)
-        except (IndexError, KeyError, requests.exceptions.RequestException, 
-                requests.exceptions.HTTPError) as e:
-            window.addstr("\nLast request failed; retrying shortly.\n")
+    layout = load_layout(layout_path) if layout_path else Layout()
+    rules, notify = alerts or ([], {})
+    notifier = engine = None
+    if rules:
+        notifier = Notifier.from_config(notify, curses.beep if window is not None else None)
+        engine = AlertEngine(rules, notifier, 'Ambient Weather Station')
+    # Only the first station is shown, and its MAC address is only known
+    # once a reading arrives; statistics and tiers only if they're shown
+    station = StationState(None, history_path=history_path, timezone=timezone, alerts=engine,
+                           stats=show_stats, tiers=bool(chart_span))
+    pressure_analyzer = station.pressure_analyzer
+    wind = station.wind if show_wind else None
+    charts = (station.charts, chart_span) if chart_span else None
+
+    if backfill_hours:
+        if window is not None:
+            window.addstr(0, 0, "Loading recent history...")
             window.refresh()
-            time.sleep(10)
-        continue
+        fetcher = HistoryFetcher(api_key, app_key, api_url)
+        try:
+            await asyncio.to_thread(backfill, fetcher, station.history, pressure_analyzer,
+                                    backfill_hours)
+        except (IndexError, KeyError, ValueError, requests.exceptions.RequestException):
+            pass  # Polling fills in history without it
+        finally:
+            fetcher.close()
+        station.warm()
+
+    def show_failure(error=None):
+        METRICS.incr('request_failures')
+        if window is None:
+            return
+        failed = line("Last request failed; retrying shortly.")
+        if failed not in renderer.lines:
+            renderer.render(renderer.lines + [line(""), failed])
+        window.noutrefresh()
+        curses.doupdate()
+
+    async def show_readings(source):
+        # Only the first station is shown. The source only yields when
+        # dateutc moves on, so an unchanged reading is never redrawn.
+        async with aclosing(source.events()) as events:
+            async for event, reading in events:
+                if event == 'error':
+                    show_failure(reading)
+                    continue
+                if event != 'data':
+                    continue
+                if station.mac_address is None:
+                    station.mac_address = station.name = reading['macAddress']
+                elif reading['macAddress'] != station.mac_address:
+                    continue
+                try:
+                    record = layout.parse(reading) if window is not None else None
+                except (KeyError, TypeError, ValueError):
+                    record = None
+                # Repeats (e.g. a poll that raced the next upload) aren't exported twice
+                if station.add_reading(reading, record):
+                    METRICS.incr('readings')
+                    if sink is not None:
+                        sink.submit(export_record(reading, pressure_analyzer))
+                if window is None:
+                    continue
+                if record is None:
+                    show_failure()
+                    continue
+                try:
+                    display_data(renderer, layout, record, pressure_analyzer,
+                                 wind, station.stats, charts, engine)
+                except (KeyError, TypeError, ValueError):
+                    show_failure()
+                    continue
+                if show_diagnostics:
+                    diagnostics = line((f"Diag        | {METRICS.summary()}", curses.color_pair(1)))
+                    renderer.render(renderer.lines + [line(""), diagnostics])
+                    window.noutrefresh()
+                    curses.doupdate()
+
+    task = asyncio.create_task(show_readings(RestSource(api_key, app_key, api_url, **(poll or {}))))
+    sink_task = asyncio.create_task(sink.run()) if sink is not None else None
+    notify_task = asyncio.create_task(notifier.run()) if notifier is not None else None
+    profile_task = asyncio.create_task(profiler.run()) if profiler is not None else None
+    try:
+        if window is None:
+            await task
+        else:
+            # Input stays live between polls; press q to quit
+            window.nodelay(True)
+            while not task.done():
+                if window.getch() in (ord('q'), ord('Q')):
+                    break
+                await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if notify_task is not None:
+            notify_task.cancel()
+        if profile_task is not None:
+            profile_task.cancel()
+            await asyncio.gather(profile_task, return_exceptions=True)
+        if sink_task is not None:
+            sink.close()
+            await sink_task
+        station.close()
+
+async def headless(sink, alerts=None, profiler=None):
+    # systemd stops services with SIGTERM; finish writing before exiting
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        await main(None, sink=sink, alerts=alerts, profiler=profiler)
+    except asyncio.CancelledError:
+        pass
+
+def run():
+    parser = argparse.ArgumentParser(description="Ambient Weather REST display")
+    parser.add_argument('--export', metavar='PATTERN',
+                        help="archive readings to strftime-named files instead of displaying them; "
+                             "CSV and Parquet columns are the history fields plus any other "
+                             "--layout field (see export.py)")
+    parser.add_argument('--format', choices=FORMATS,
+                        help="export format; taken from the file extension by default")
+    parser.add_argument('--layout', metavar='FILE',
+                        help="JSON file choosing the fields shown; see layout.py")
+    parser.add_argument('--alerts', metavar='FILE', help="JSON file of alert rules; see alerts.py")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="write CPU profiles and memory snapshots here; see profiling.py")
+    parser.add_argument('--profile-interval', metavar='SECONDS', type=float, default=600)
+    args = parser.parse_args()
+    alerts = load_rules(args.alerts) if args.alerts else None
+    profiler = Profiler(args.profile, args.profile_interval, events='readings') if args.profile else None
+
+    if args.export:
+        try:
+            fields = export_fields(load_layout(args.layout) if args.layout else None)
+            asyncio.run(headless(ExportSink(args.export, args.format, fields=fields), alerts, profiler))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    curses.wrapper(lambda w: asyncio.run(main(w, layout_path=args.layout, alerts=alerts,
+                                              profiler=profiler)))
 
-curses.wrapper(main)
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,108 @@
+import time
+from lazy import LazyModule
+
+requests = LazyModule('requests')
+
+API_URL = 'https://rt.ambientweather.net/v1'
+
+# The device data endpoint returns at most this many readings per request
+PAGE_LIMIT = 288
+
+
+class RateLimiter:
+    """Spaces out requests; Ambient allows one request per second per API key"""
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._last = None
+
+    def wait(self):
+        if self._last is not None:
+            delay = self.min_interval - (time.monotonic() - self._last)
+            if delay > 0:
+                time.sleep(delay)
+        self._last = time.monotonic()
+
+
+class HistoryFetcher:
+    def __init__(self, api_key, app_key, base_url=API_URL, session=None,
+                 rate_limiter=None, timeout=10, retries=3):
+        self.api_key = api_key
+        self.app_key = app_key
+        self.base_url = base_url.rstrip('/')
+        # A pooled keep-alive session avoids a TLS handshake per page
+        self.session = session or requests.Session()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.timeout = timeout
+        self.retries = retries
+
+    def _get(self, path, **params):
+        params.update(apiKey=self.api_key, applicationKey=self.app_key)
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            response = self.session.get(f'{self.base_url}{path}', params=params,
+                                        timeout=self.timeout)
+            if response.status_code == 429 and attempt < self.retries:
+                # Rate limited; back off before trying the same page again
+                time.sleep(2 ** attempt)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def devices(self):
+        return self._get('/devices')
+
+    def readings(self, mac_address, since):
+        """Return readings newer than `since` (epoch seconds), oldest first"""
+        readings = []
+        end_date = None
+        while True:
+            params = {'limit': PAGE_LIMIT}
+            if end_date is not None:
+                params['endDate'] = end_date
+            page = self._get(f'/devices/{mac_address}', **params)
+            # Pages come back newest first
+            page = [r for r in page if isinstance(r.get('dateutc'), (int, float))]
+            newer = [r for r in page if r['dateutc'] / 1000 > since]
+            readings.extend(newer)
+            if len(newer) < len(page) or len(page) < PAGE_LIMIT:
+                break
+            oldest = min(r['dateutc'] for r in page)
+            if end_date is not None and oldest >= end_date:
+                break  # The API stopped going further back
+            end_date = oldest
+
+        # Page boundaries may repeat a reading; HistoryBuffer drops repeats
+        readings.sort(key=lambda r: r['dateutc'])
+        return readings
+
+    def close(self):
+        self.session.close()
+
+
+def backfill(fetcher, history, pressure_analyzer, hours=3, mac_address=None):
+    """Load the last `hours` of readings into the history and pressure trend.
+
+    Only readings newer than what history already holds are requested, so
+    this is cheap after a restart with a persisted history file. Uses the
+    first device on the key unless a MAC address is given. Returns the
+    readings that were added, oldest first.
+    """
+    if mac_address is None:
+        devices = fetcher.devices()
+        if not devices:
+            return []
+        mac_address = devices[0]['macAddress']
+
+    since = time.time() - hours * 3600
+    last = history.last_timestamp()
+    if last is not None:
+        since = max(since, last)
+
+    added = []
+    for reading in fetcher.readings(mac_address, since):
+        if history.append(reading):
+            added.append(reading)
+            if 'baromrelin' in reading:
+                pressure_analyzer.add_reading(reading['baromrelin'], reading['dateutc'] / 1000)
+    return added
@@ -0,0 +1,545 @@
+"""Headless benchmarks for the display hot paths.
+
+Runs itself inside a pseudo-terminal so the real curses code draws to a
+virtual screen, then reports:
+
+  * per-call cost of get_trend, get_almanac_data and both display_data paths
+  * end-to-end numbers against a local replay server: events per second
+    ingested, event-to-ingest and event-to-screen latency percentiles, frames
+    drawn and bytes written to the terminal
+  * the same for ambient.py run headless: its backfill, then polls every
+    0.1 s exported to a file, with event-to-export latency percentiles
+
+    python bench.py --rate 1000 --seconds 10
+
+With --startup it measures cold starts instead, each in a fresh interpreter:
+how long importing realtime.py and ambient.py takes, and how long realtime.py
+takes from exec to its first frame and to its first frame showing a reading,
+with and without the almanac. It also lists which heavy dependencies had
+been loaded by then.
+
+    python bench.py --startup --repeat 10
+
+With --soak it feeds that many synthetic readings, 5 simulated seconds
+apart, straight into a WeatherStation with every panel, the almanac and a few
+alert rules on, drawing a frame every --frame-every readings, and reports
+traced memory and time per event at checkpoints along the way. After the
+first 10 simulated days, once the 7 day windows are full, memory should stay
+flat; it reports the growth per 1000 events from there on and the
+allocation sites that grew.
+
+    python bench.py --soak 1000000
+"""
+import argparse
+import asyncio
+import curses
+import fcntl
+import json
+import os
+import pty
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import termios
+import time
+
+from pressure_trend import PressureTrendAnalyzer
+
+ROWS, COLS = 50, 120
+
+# Readings before the soak's memory should level off: the 7 day history and
+# rolling statistics fill after 7 simulated days of 5 second readings, and
+# their deques settle over the next couple
+SOAK_WARMUP = 10 * 86400 // 5
+
+# Dependencies startup should only load once a feature needs them
+HEAVY_MODULES = ('numpy', 'ephem', 'socketio', 'aiohttp', 'requests')
+
+
+def summarize(samples):
+    """Return count and p50/p90/p99/max of a list of durations, in milliseconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'p50_ms': round(pick(0.50), 4),
+        'p90_ms': round(pick(0.90), 4),
+        'p99_ms': round(pick(0.99), 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+    }
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_trend(samples=2160, repeat=2000):
+    # Three hours of 5 second readings
+    analyzer = PressureTrendAnalyzer(window_hours=3)
+    now = time.time()
+    for i in range(samples):
+        analyzer.add_reading(29.9 + i * 1e-5, now - (samples - i) * 5)
+    return time_calls(analyzer.get_trend, repeat)
+
+
+def bench_almanac(repeat=200):
+    import realtime
+    warm = realtime.AlmanacCalculator(35.772846, -86.46821)
+    results = {'warm': time_calls(warm.get_almanac_data, repeat)}
+    results['cold'] = time_calls(
+        lambda: realtime.AlmanacCalculator(35.772846, -86.46821).get_almanac_data(),
+        max(repeat // 10, 1))
+    return results
+
+
+def bench_realtime_display(screen, payloads, repeat=500):
+    import realtime
+    station = realtime.WeatherStation([], '', 35.772846, -86.46821, backfill_hours=0)
+    station.init_display(screen)
+    state = station.get_station('bench')
+    station.almanac_snapshots[state.coords] = station.almanacs[state.coords].get_almanac_data()
+    i = 0
+
+    def frame():
+        nonlocal i
+        state.current = station.layout.parse(payloads[i % len(payloads)])
+        i += 1
+        station.display_data()
+
+    return time_calls(frame, repeat)
+
+
+def bench_ambient_display(screen, payloads, repeat=500):
+    import ambient
+    from layout import Layout
+    from screen import LineRenderer
+    renderer = LineRenderer(screen)
+    layout = Layout()
+    analyzer = PressureTrendAnalyzer()
+    i = 0
+
+    def frame():
+        nonlocal i
+        ambient.display_data(renderer, layout, layout.parse(payloads[i % len(payloads)]), analyzer)
+        i += 1
+
+    return time_calls(frame, repeat)
+
+
+async def bench_end_to_end(screen, payloads, rate, seconds, port):
+    import realtime
+    from replay import ReplayServer
+    emitted = {}
+    ingest = []
+    render = []
+    frames = 0
+
+    server = ReplayServer(payloads, rate, port=port,
+                          on_emit=lambda dateutc: emitted.__setitem__(dateutc, time.perf_counter()))
+    await server.start()
+
+    station = realtime.WeatherStation(['bench'], 'bench', 35.772846, -86.46821,
+                                      backfill_hours=0,
+                                      upstream_url=server.url + '/?api=1&applicationKey={app_key}',
+                                      rest_url=server.url + '/v1')
+    handle_data = station.on_data
+
+    async def on_data(data):
+        start = emitted.get(data.get('dateutc'))
+        if start is not None:
+            ingest.append(time.perf_counter() - start)
+        await handle_data(data)
+
+    station.on_data = on_data
+    refresh_display = station.refresh_display
+
+    def timed_refresh():
+        nonlocal frames
+        refresh_display()
+        frames += 1
+        selected = station.selected_station()
+        if selected and selected.current:
+            start = emitted.pop(selected.current.dateutc, None)
+            if start is not None:
+                render.append(time.perf_counter() - start)
+
+    station.refresh_display = timed_refresh
+
+    task = asyncio.create_task(station.run(screen))
+    await asyncio.sleep(seconds)
+    station.running = False
+    await task
+    await server.stop()
+
+    return {
+        'rate_requested': rate,
+        'events_sent': server.sent,
+        'events_ingested': len(ingest),
+        'events_per_second': round(len(ingest) / seconds, 1),
+        'frames': frames,
+        'event_to_ingest': summarize(ingest),
+        'event_to_screen': summarize(render),
+    }
+
+
+async def bench_ambient_end_to_end(payloads, rate, seconds, port, poll_interval=0.1):
+    """ambient.py headless against a replay server: backfill, then polling into an export sink"""
+    import ambient
+    from export import ExportSink
+    from metrics import METRICS
+    from replay import ReplayServer
+    emitted = {}
+    export = []
+
+    server = ReplayServer(payloads, rate, port=port,
+                          on_emit=lambda dateutc: emitted.__setitem__(dateutc, time.perf_counter()))
+    await server.start()
+    # Enough history for the startup backfill to page through
+    await asyncio.sleep(1)
+
+    # ambient.py keeps its history file in the working directory
+    cwd = os.getcwd()
+    directory = tempfile.TemporaryDirectory()
+    os.chdir(directory.name)
+    path = os.path.join(directory.name, 'readings.ndjson')
+    sink = ExportSink(path)
+    submit = sink.submit
+
+    def timed_submit(record):
+        start = emitted.pop(record.get('dateutc'), None)
+        if start is not None:
+            export.append(time.perf_counter() - start)
+        submit(record)
+
+    sink.submit = timed_submit
+    polls, failures = METRICS.count('poll'), METRICS.count('request_failures')
+    # Poll as often as the replay server's readings allow, not once a minute
+    task = asyncio.create_task(ambient.main(None, api_url=server.url + '/v1', sink=sink,
+                                            poll={'interval': poll_interval, 'lag': 0,
+                                                  'min_delay': poll_interval}))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await server.stop()
+        os.chdir(cwd)
+    if not task.cancelled() and task.exception() is not None:
+        directory.cleanup()
+        return {'error': repr(task.exception())}
+    written = 0
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            written = sum(1 for _ in f)
+    directory.cleanup()
+
+    return {
+        'rate_requested': rate,
+        'poll_interval_s': poll_interval,
+        'polls': METRICS.count('poll') - polls,
+        'poll_failures': METRICS.count('request_failures') - failures,
+        'readings_written': written,
+        'readings_per_second': round(written / seconds, 1),
+        'event_to_export': summarize(export),
+    }
+
+
+def child_main(screen, args, results_path):
+    from replay import load_payloads, synthetic_payloads
+    payloads = load_payloads(args.recording) if args.recording else synthetic_payloads()
+    curses.curs_set(0)
+    results = {
+        'get_trend': bench_trend(),
+        'get_almanac_data': bench_almanac(),
+        'realtime_display_data': bench_realtime_display(screen, payloads),
+        'ambient_display_data': bench_ambient_display(screen, payloads),
+    }
+    screen.erase()
+    results['end_to_end'] = asyncio.run(
+        bench_end_to_end(screen, payloads, args.rate, args.seconds, args.port))
+    results['ambient_end_to_end'] = asyncio.run(
+        bench_ambient_end_to_end(payloads, args.rate, args.seconds, args.port))
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f)
+
+
+def loaded_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def startup_child(screen, args, results_path, started):
+    """Runs in a fresh interpreter: import realtime and time its first frames"""
+    import realtime
+    marks = {'imported': time.time()}
+    loaded = {'imported': loaded_modules()}
+    server = f'http://127.0.0.1:{args.port}'
+    station = realtime.WeatherStation(['bench'], 'bench', 35.772846, -86.46821,
+                                      backfill_hours=0, almanac=not args.no_almanac,
+                                      upstream_url=server + '/?api=1&applicationKey={app_key}',
+                                      rest_url=server + '/v1')
+    refresh_display = station.refresh_display
+
+    def timed_refresh():
+        refresh_display()
+        now = time.time()
+        selected = station.selected_station()
+        for name, reached in (('first_frame', True),
+                              ('first_reading', selected and selected.current),
+                              ('almanac', station.almanac_snapshots)):
+            if reached and name not in marks:
+                marks[name] = now
+                loaded[name] = loaded_modules()
+        if 'first_reading' in marks and ('almanac' in marks or not station.almanac):
+            station.running = False
+
+    station.refresh_display = timed_refresh
+
+    async def main():
+        try:
+            await asyncio.wait_for(station.run(screen), args.seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(main())
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump({'ms': {name: (mark - started) * 1000 for name, mark in marks.items()},
+                   'loaded': loaded}, f)
+
+
+def soak_child(screen, args, results_path):
+    """Feed synthetic readings to a WeatherStation, measuring memory and time as it goes"""
+    import gc
+    import tracemalloc
+    from types import MappingProxyType
+    import realtime
+    from alerts import Rule
+    from profiling import allocation_sites, compare, growth_per_event, resident_kib
+    from replay import synthetic_payloads
+    tracemalloc.start()
+    payloads = synthetic_payloads()
+    rules = [Rule('Cold', 'tempf', below=50, clear=52),
+             Rule('Gusty', 'windgustmph', above=12, clear=8, duration=60),
+             Rule('Warming fast', 'tempf', above=8, rate=1800),
+             Rule('Pressure falling', 'pressure_rate', below=-0.02, clear=-0.01)]
+    station = realtime.WeatherStation([], '', 35.772846, -86.46821, backfill_hours=0,
+                                      show_wind=True, show_stats=True, chart_span='24h',
+                                      alert_rules=rules)
+    station.init_display(screen)
+    state = station.get_station('soak')
+    almanac = station.almanacs[state.coords]
+    start = time.time()
+    every = max(args.soak // args.checkpoints, 1)
+    checkpoints = []
+    baseline = None
+
+    async def feed(first, last):
+        for i in range(first, last):
+            reading = dict(payloads[i % len(payloads)], macAddress='soak',
+                           dateutc=int((start + i * 5) * 1000))
+            await station.on_data(reading)
+            # As often as almanac_loop() would: every 10 seconds, i.e. two readings
+            if i % 2 == 0:
+                station.almanac_snapshots[state.coords] = MappingProxyType(almanac.get_almanac_data())
+            if i % args.frame_every == 0:
+                station.display_data()
+
+    for first in range(0, args.soak, every):
+        last = min(first + every, args.soak)
+        began = time.perf_counter()
+        asyncio.run(feed(first, last))
+        elapsed = time.perf_counter() - began
+        gc.collect()
+        checkpoints.append({
+            'events': last,
+            'simulated_days': round(last * 5 / 86400, 1),
+            'traced_kib': round(tracemalloc.get_traced_memory()[0] / 1024, 1),
+            'rss_kib': resident_kib(),
+            # tracemalloc's own tables, which are in rss_kib but not traced_kib
+            'tracemalloc_kib': round(tracemalloc.get_tracemalloc_memory() / 1024, 1),
+            'us_per_event': round(elapsed / (last - first) * 1e6, 1),
+        })
+        if baseline is None and last >= SOAK_WARMUP:
+            baseline = allocation_sites(tracemalloc.take_snapshot())
+            # Taking it leaves some garbage of its own, so the fit starts at the next checkpoint
+            settled_from = len(checkpoints)
+
+    slope = growth_per_event(checkpoints[settled_from:]) if baseline is not None else None
+    results = {
+        'events': args.soak,
+        'checkpoints': checkpoints,
+        'growth_b_per_1k_events_after_warmup': None if slope is None else round(slope * 1000, 1),
+    }
+    if baseline is not None:
+        results['growth_after_warmup'] = compare(baseline, allocation_sites(tracemalloc.take_snapshot()), 10)
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f)
+
+
+def in_pty(child):
+    """Run child() in a forked process on a ROWS x COLS pseudo-terminal.
+
+    Returns the number of bytes the child wrote to the terminal.
+    """
+    pid, master = pty.fork()
+    if pid == 0:
+        fcntl.ioctl(sys.stdout.fileno(), termios.TIOCSWINSZ, struct.pack('HHHH', ROWS, COLS, 0, 0))
+        os.environ['TERM'] = 'xterm-256color'
+        try:
+            child()
+        finally:
+            os._exit(0)
+
+    # Drain the virtual terminal so the child never blocks on output
+    terminal_bytes = 0
+    while True:
+        try:
+            chunk = os.read(master, 65536)
+        except OSError:
+            break
+        if not chunk:
+            break
+        terminal_bytes += len(chunk)
+    os.waitpid(pid, 0)
+    os.close(master)
+    return terminal_bytes
+
+
+def bench_imports(module, repeat):
+    """Cold import time of a module, each in a fresh interpreter"""
+    code = ('import json, sys, time\n'
+            't = time.perf_counter()\n'
+            f'import {module}\n'
+            'print(json.dumps([time.perf_counter() - t,'
+            f' [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))')
+    samples = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds, loaded = json.loads(output.stdout)
+        samples.append(seconds)
+    return dict(summarize(samples), loaded=loaded)
+
+
+def bench_first_frame(args, almanac):
+    """Exec-to-first-frame milestones for realtime.py, each in a fresh interpreter"""
+    milestones = {}
+    loaded = {}
+    for _ in range(args.repeat):
+        fd, results_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        argv = [sys.executable, os.path.abspath(__file__), '--startup-child', results_path,
+                '--port', str(args.port), '--seconds', str(args.seconds)]
+        if not almanac:
+            argv.append('--no-almanac')
+
+        def child():
+            os.environ['BENCH_STARTED'] = repr(time.time())
+            os.execv(sys.executable, argv)
+
+        in_pty(child)
+        with open(results_path, encoding='utf-8') as f:
+            results = json.load(f) if os.path.getsize(results_path) else {}
+        os.unlink(results_path)
+        if 'error' in results:
+            return results
+        for name, ms in results.get('ms', {}).items():
+            milestones.setdefault(name, []).append(ms / 1000)
+        loaded = results.get('loaded', loaded)
+    return {name: dict(summarize(samples), loaded=loaded.get(name))
+            for name, samples in milestones.items()}
+
+
+def bench_startup(args):
+    # The first frames need something to connect to, so replay in a process
+    # of our own rather than in the interpreter being measured
+    replay = subprocess.Popen([sys.executable, 'replay.py', '--rate', '20', '--port', str(args.port)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+                break
+            except OSError:
+                if replay.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("replay server didn't start")
+                time.sleep(0.1)
+        return {
+            'import_realtime': bench_imports('realtime', args.repeat),
+            'import_ambient': bench_imports('ambient', args.repeat),
+            'realtime_startup': bench_first_frame(args, almanac=True),
+            'realtime_startup_no_almanac': bench_first_frame(args, almanac=False),
+        }
+    finally:
+        replay.terminate()
+        replay.wait()
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the display hot paths headlessly")
+    parser.add_argument('recording', nargs='?',
+                        help="NDJSON file of lastData payloads; synthetic data if omitted")
+    parser.add_argument('--rate', type=float, default=200, help="replayed events per second")
+    parser.add_argument('--seconds', type=float, default=5,
+                        help="length of the end-to-end run, or the limit on each startup run")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--startup', action='store_true',
+                        help="measure import time and time to first frame instead")
+    parser.add_argument('--repeat', type=int, default=5, help="cold starts per --startup measurement")
+    parser.add_argument('--soak', type=int, metavar='EVENTS',
+                        help="feed this many synthetic readings and check memory stays flat")
+    parser.add_argument('--checkpoints', type=int, default=20, help="measurements during --soak")
+    parser.add_argument('--frame-every', type=int, default=60,
+                        help="readings per frame drawn during --soak; frames cost ~10x a reading")
+    parser.add_argument('--startup-child', metavar='RESULTS', help=argparse.SUPPRESS)
+    parser.add_argument('--no-almanac', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child:
+        started = float(os.environ['BENCH_STARTED'])
+        try:
+            curses.wrapper(startup_child, args, args.startup_child, started)
+        except BaseException as e:
+            with open(args.startup_child, 'w', encoding='utf-8') as f:
+                json.dump({'error': repr(e)}, f)
+        return
+
+    if args.startup:
+        print(json.dumps(bench_startup(args), indent=2))
+        return
+
+    fd, results_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+
+    def child():
+        try:
+            curses.wrapper(soak_child if args.soak else child_main, args, results_path)
+        except BaseException as e:
+            with open(results_path, 'w', encoding='utf-8') as f:
+                json.dump({'error': repr(e)}, f)
+
+    terminal_bytes = in_pty(child)
+
+    with open(results_path, encoding='utf-8') as f:
+        results = json.load(f)
+    os.unlink(results_path)
+    results['terminal_bytes'] = terminal_bytes
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    run()
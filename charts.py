@@ -0,0 +1,142 @@
+import math
+import curses
+from lazy import LazyModule
+from metrics import METRICS
+from screen import line
+
+np = LazyModule('numpy')
+
+# Selectable chart spans, in seconds
+SPANS = (('3h', 3 * 3600), ('24h', 24 * 3600), ('7d', 7 * 24 * 3600))
+
+# Charted fields: label, unit and decimal places
+CHARTS = (
+    ('baromrelin', 'Pressure', 'inHg', 3),
+    ('tempf', 'Temperature', '°F', 1),
+    ('windspeedmph', 'Wind', 'mph', 1),
+)
+
+# Braille dot bits by (row, column) within a character cell
+DOTS = ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80))
+
+
+class ChartCache:
+    """Min/max/mean per chart column, for each (field, span, width) drawn.
+
+    Columns sit on a fixed time grid (span / width seconds each), so when a
+    reading arrives the cached columns shift along and only the newest ones
+    are recomputed. The data comes from a TieredHistory at the coarsest tier
+    that still resolves a column, so even a week-long chart touches a few
+    hundred hourly buckets rather than every raw reading.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self._entries = {}
+
+    def _compute(self, field, seconds, first, last):
+        """Return (lows, highs, means) for columns first..last on the grid"""
+        count = last - first + 1
+        lows = np.full(count, np.nan)
+        highs = np.full(count, np.nan)
+        means = np.full(count, np.nan)
+        timestamps, mean, low, high, samples = self.tiers.query(
+            field, first * seconds, (last + 1) * seconds, resolution=seconds)
+        if len(timestamps) == 0:
+            return lows, highs, means
+        columns = np.floor(timestamps / seconds).astype(np.int64) - first
+        inside = (columns >= 0) & (columns < count)
+        columns, mean, low, high, samples = (a[inside] for a in (columns, mean, low, high, samples))
+        if len(columns) == 0:
+            return lows, highs, means
+        # Buckets arrive in time order, so each column's buckets are a run
+        starts = np.flatnonzero(np.r_[True, np.diff(columns) != 0])
+        used = columns[starts]
+        lows[used] = np.minimum.reduceat(low, starts)
+        highs[used] = np.maximum.reduceat(high, starts)
+        weights = samples.astype(np.float64)
+        means[used] = np.add.reduceat(mean * weights, starts) / np.add.reduceat(weights, starts)
+        return lows, highs, means
+
+    @METRICS.timed('chart_columns')
+    def columns(self, field, span, width, end=None):
+        """Return (lows, highs, means), oldest first, for `width` columns ending at `end`"""
+        newest = self.tiers.last_timestamp
+        if newest is None:
+            empty = np.full(width, np.nan)
+            return empty, empty, empty
+        seconds = span / width
+        last = math.floor((newest if end is None else end) / seconds)
+        key = (field, span, width)
+        entry = self._entries.get(key)
+
+        if entry is not None and entry['last'] <= last < entry['last'] + width:
+            # Keep the columns that are still on screen. Columns from the one
+            # holding the start of the previous newest reading's bucket (at
+            # most one coarsest bucket back) may have gained readings since.
+            coarsest = self.tiers.tiers[-1].resolution
+            redo = min(entry['last'], math.floor((entry['newest'] - coarsest) / seconds))
+            redo = max(redo, last - width + 1)
+            shift = last - entry['last']
+            keep = redo - (entry['last'] - width + 1) - shift
+            arrays = []
+            for old, new in zip(entry['arrays'], self._compute(field, seconds, redo, last)):
+                shifted = np.empty(width)
+                shifted[:keep] = old[shift:shift + keep]
+                shifted[keep:] = new
+                arrays.append(shifted)
+        else:
+            arrays = list(self._compute(field, seconds, last - width + 1, last))
+
+        self._entries[key] = {'last': last, 'newest': newest, 'arrays': arrays}
+        return tuple(arrays)
+
+
+def braille(lows, highs, height, bottom, top):
+    """Plot each column's low-high range as a vertical stroke of braille dots.
+
+    Two columns share a character cell and each cell is four dots tall, so
+    `height` rows show 4 * height levels. Returns one string per row.
+    """
+    width = len(lows)
+    if width % 2:
+        lows, highs = np.append(lows, np.nan), np.append(highs, np.nan)
+        width += 1
+    levels = 4 * height
+    scale = (levels - 1) / (top - bottom) if top > bottom else 0.0
+    present = ~(np.isnan(lows) | np.isnan(highs))
+    # Dot rows counted from the top of the chart
+    upper = np.where(present, levels - 1 - np.round((np.nan_to_num(highs) - bottom) * scale), levels)
+    lower = np.where(present, levels - 1 - np.round((np.nan_to_num(lows) - bottom) * scale), -1)
+    rows = np.arange(levels)[:, None]
+    dots = (rows >= upper[None, :]) & (rows <= lower[None, :])
+
+    cells = dots.reshape(height, 4, width // 2, 2)
+    codes = (cells * np.array(DOTS)[None, :, None, :]).sum(axis=(1, 3))
+    return [''.join(chr(0x2800 + code) for code in row) for row in codes.tolist()]
+
+
+def chart_lines(cache, span_name, width, height=4, end=None):
+    """Chart rows for every field in CHARTS over one span, `width` characters wide"""
+    span = dict(SPANS)[span_name]
+    columns = 2 * width
+    lines = []
+    for field, label, unit, decimals in CHARTS:
+        lows, highs, means = cache.columns(field, span, columns, end)
+        if np.isnan(lows).all():
+            lines.append(line(f"{label:<12}| no data in the last {span_name}"))
+            continue
+        bottom, top = float(np.nanmin(lows)), float(np.nanmax(highs))
+        latest = means[~np.isnan(means)][-1]
+        lines.append(line((f"{label:<12}", curses.A_BOLD),
+                          f"| {span_name}: {bottom:.{decimals}f} to {top:.{decimals}f} {unit}"
+                          f", latest {latest:.{decimals}f}"))
+        for i, row in enumerate(braille(lows, highs, height, bottom, top)):
+            if i == 0:
+                gutter = f"{top:>11.{decimals}f} "
+            elif i == height - 1:
+                gutter = f"{bottom:>11.{decimals}f} "
+            else:
+                gutter = " " * 12
+            lines.append(line(gutter + "|", (row, curses.color_pair(1))))
+    return lines
@@ -0,0 +1,222 @@
+"""Streams readings to archive files without a terminal.
+
+    python realtime.py --export 'weather-%Y-%m-%d.ndjson'
+    python ambient.py --export 'weather-%Y-%m-%d.csv'
+
+The path is a strftime pattern filled in from each reading's UTC time, so
+the pattern above starts a new file every day. The format follows the
+extension (.ndjson, .csv or .parquet) unless given with --format. Parquet
+needs pyarrow.
+
+NDJSON keeps every field of every reading. CSV and Parquet have fixed
+columns: dateutc, macAddress, the history fields (HISTORY_FIELDS), any other
+field the --layout shows, then the pressure trend and rate.
+"""
+import asyncio
+import csv
+import json
+import os
+import time
+from history import HISTORY_FIELDS, reading_timestamp
+from metrics import METRICS
+
+FORMATS = ('ndjson', 'csv', 'parquet')
+
+# Columns for the tabular formats, after the reading's own fields
+DERIVED_FIELDS = ('pressure_trend', 'pressure_rate')
+
+
+def export_fields(layout=None):
+    """ExportSink fields: HISTORY_FIELDS, then the rest of what a layout.Layout shows"""
+    if layout is None:
+        return HISTORY_FIELDS
+    return HISTORY_FIELDS + tuple(field for field in layout.used
+                                  if field not in HISTORY_FIELDS and field != 'dateutc')
+
+
+def export_record(reading, pressure_analyzer=None):
+    """A lastData dict plus the derived values worth archiving with it"""
+    record = dict(reading)
+    if pressure_analyzer is not None:
+        trend, rate = pressure_analyzer.get_trend()
+        record['pressure_trend'] = trend
+        record['pressure_rate'] = round(rate, 4)
+    return record
+
+
+class NdjsonWriter:
+    def __init__(self, path, columns):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class CsvWriter:
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, 'a', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(columns)
+
+    def write(self, records):
+        self.writer.writerows([record.get(column) for column in self.columns]
+                              for record in records)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+class ParquetWriter:
+    """One row group per batch. Parquet can't be appended to, so an existing
+    file gets a numbered sibling, and a file is only readable once closed."""
+
+    def __init__(self, path, columns):
+        pyarrow = self.pyarrow = require_pyarrow()
+        root, ext = os.path.splitext(path)
+        n = 1
+        while os.path.exists(path):
+            path = f"{root}.{n}{ext}"
+            n += 1
+        self.columns = columns
+        strings = {'macAddress', 'pressure_trend'}
+        self.schema = pyarrow.schema(
+            [(column, pyarrow.string() if column in strings
+              else pyarrow.int64() if column == 'dateutc' else pyarrow.float64())
+             for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, records):
+        def value(record, column):
+            value = record.get(column)
+            if column in ('macAddress', 'pressure_trend'):
+                return value if isinstance(value, str) else None
+            return value if isinstance(value, (int, float)) else None
+
+        arrays = {column: [value(record, column) for record in records] for column in self.columns}
+        self.writer.write_table(self.pyarrow.table(arrays, schema=self.schema))
+
+    def sync(self):
+        pass  # Row groups are only complete files after close()
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'ndjson': NdjsonWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+
+class ExportSink:
+    """Buffers records in memory and writes them in batches off the event loop.
+
+    submit() only appends to a list, so ingest never waits on the disk. Every
+    `flush_interval` seconds run() hands the batch to a worker thread, which
+    writes it and fsyncs at most every `fsync_interval` seconds. If the disk
+    falls so far behind that `max_buffer` records are waiting, the oldest are
+    dropped and counted in the export_dropped metric. `fields` are the tabular
+    formats' columns between dateutc/macAddress and DERIVED_FIELDS.
+    """
+
+    def __init__(self, pattern, format=None, flush_interval=5, fsync_interval=30,
+                 max_buffer=100_000, fields=HISTORY_FIELDS):
+        if format is None:
+            format = os.path.splitext(pattern)[1].lstrip('.').lower()
+            format = 'ndjson' if format in ('json', 'jsonl') else format
+        if format not in FORMATS:
+            raise ValueError(f"unknown export format {format!r}; use one of {', '.join(FORMATS)}")
+        if format == 'parquet':
+            require_pyarrow()  # Fail at startup rather than on the first write
+        self.pattern = pattern
+        self.format = format
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_buffer = max_buffer
+        self.columns = tuple(dict.fromkeys(('dateutc', 'macAddress') + tuple(fields) + DERIVED_FIELDS))
+        self.pending = []
+        self.writers = {}  # path -> open writer
+        self.last_sync = time.monotonic()
+        self._closing = asyncio.Event()
+
+    def submit(self, record):
+        self.pending.append(record)
+        if len(self.pending) > self.max_buffer:
+            dropped = len(self.pending) - self.max_buffer
+            del self.pending[:dropped]
+            METRICS.incr('export_dropped', dropped)
+
+    def _path(self, record):
+        return time.strftime(self.pattern, time.gmtime(reading_timestamp(record)))
+
+    @METRICS.timed('export_write')
+    def _write(self, records):
+        batches = {}
+        for record in records:
+            batches.setdefault(self._path(record), []).append(record)
+        for path, batch in batches.items():
+            writer = self.writers.get(path)
+            if writer is None:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                writer = self.writers[path] = WRITERS[self.format](path, self.columns)
+            writer.write(batch)
+        # Files the pattern has moved on from are finished with
+        newest = self._path(records[-1])
+        for path in [path for path in self.writers if path != newest]:
+            self.writers.pop(path).close()
+        if time.monotonic() - self.last_sync >= self.fsync_interval:
+            for writer in self.writers.values():
+                writer.sync()
+            self.last_sync = time.monotonic()
+        METRICS.incr('exported', len(records))
+
+    async def flush(self):
+        if self.pending:
+            records, self.pending = self.pending, []
+            try:
+                await asyncio.to_thread(self._write, records)
+            except OSError:
+                # e.g. a full disk; keep ingesting and try the next batch
+                METRICS.incr('export_errors')
+
+    async def run(self):
+        """Flush every flush_interval until close(), then write the rest and close the files"""
+        # Flushes at least once, even if close() came before run() started
+        while True:
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if self._closing.is_set():
+                break
+        for writer in self.writers.values():
+            await asyncio.to_thread(writer.close)
+        self.writers = {}
+
+    def close(self):
+        """Ask run() to finish; await its task to know everything is on disk"""
+        self._closing.set()
@@ -0,0 +1,266 @@
+import operator
+import time
+from collections import deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from lazy import LazyModule
+from screen import line
+
+np = LazyModule('numpy')
+
+# Fields with daily and rolling statistics: label and decimal places
+STATS_FIELDS = {
+    'tempf': ('Temperature', 1),
+    'humidity': ('Humidity', 0),
+    'baromrelin': ('Barometer', 3),
+    'windspeedmph': ('Wind Speed', 1),
+    'windgustmph': ('Wind Gust', 1),
+    'solarradiation': ('Solar Rad', 1),
+}
+
+# Rolling windows in seconds, each with the bucket size it's kept at
+WINDOWS = ((3600, 0), (24 * 3600, 60), (7 * 24 * 3600, 600))
+
+
+class RollingStats:
+    """Min, max and mean of one series over a trailing window.
+
+    Samples are grouped into `resolution` second buckets (0 keeps every
+    sample) holding a count and sum, and min/max are tracked with monotonic
+    deques holding at most one entry per bucket. Adding a sample is amortized
+    O(1) and memory is bounded by seconds / resolution whatever the sample
+    rate. Buckets expire whole, so a bucketed window can reach up to one
+    bucket further back than `seconds`.
+    """
+
+    def __init__(self, seconds, resolution=0):
+        self.seconds = seconds
+        self.resolution = resolution
+        self._buckets = deque()  # [start, count, total], oldest first
+        self._count = 0
+        self._total = 0.0
+        self._min = deque()  # (start, value), values increasing
+        self._max = deque()  # (start, value), values decreasing
+        self._last = None  # Newest timestamp added
+
+    def _start(self, timestamp):
+        if self.resolution:
+            return timestamp - timestamp % self.resolution
+        return timestamp
+
+    @staticmethod
+    def _push(extremes, start, value, dominates):
+        # Anything the new value dominates can never be the extreme again
+        while extremes and dominates(value, extremes[-1][1]):
+            extremes.pop()
+        # A better value from the same bucket expires along with this one
+        if not extremes or extremes[-1][0] != start:
+            extremes.append((start, value))
+
+    def _expire(self, timestamp):
+        cutoff = timestamp - self.seconds
+        buckets = self._buckets
+        while buckets and buckets[0][0] + self.resolution <= cutoff:
+            _, count, total = buckets.popleft()
+            self._count -= count
+            self._total -= total
+        for extremes in (self._min, self._max):
+            while extremes and extremes[0][0] + self.resolution <= cutoff:
+                extremes.popleft()
+        if not buckets:
+            self._total = 0.0  # Don't let float error accumulate across gaps
+
+    def _add_bucket(self, start, count, total, low, high):
+        if self._buckets and self._buckets[-1][0] == start:
+            bucket = self._buckets[-1]
+            bucket[1] += count
+            bucket[2] += total
+        else:
+            self._buckets.append([start, count, total])
+        self._count += count
+        self._total += total
+        self._push(self._min, start, low, operator.le)
+        self._push(self._max, start, high, operator.ge)
+
+    def add(self, timestamp, value):
+        """Add one sample; timestamps must increase (HistoryBuffer.append checks)"""
+        self._add_bucket(self._start(timestamp), 1, value, value, value)
+        self._last = timestamp
+        self._expire(timestamp)
+
+    def extend(self, timestamps, values):
+        """Bulk-add samples from arrays, one Python step per bucket rather than per sample.
+
+        Samples no newer than the last one added are skipped, so this can be
+        called again after a backfill lands more history.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        keep = np.isfinite(values)
+        if self._last is not None:
+            keep &= timestamps > self._last
+        timestamps, values = timestamps[keep], values[keep]
+        if timestamps.size == 0:
+            return
+        keep = timestamps > timestamps[-1] - self.seconds - self.resolution
+        timestamps, values = timestamps[keep], values[keep]
+
+        starts = timestamps - timestamps % self.resolution if self.resolution else timestamps
+        first = np.flatnonzero(np.r_[True, np.diff(starts) != 0])
+        counts = np.diff(np.r_[first, starts.size])
+        totals = np.add.reduceat(values, first)
+        lows = np.minimum.reduceat(values, first)
+        highs = np.maximum.reduceat(values, first)
+        for bucket in zip(starts[first].tolist(), counts.tolist(), totals.tolist(),
+                          lows.tolist(), highs.tolist()):
+            self._add_bucket(*bucket)
+        self._last = float(timestamps[-1])
+        self._expire(self._last)
+
+    def expire(self, now):
+        """Drop what has aged out by `now`; add() only expires as samples arrive"""
+        self._expire(now)
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    @property
+    def mean(self):
+        return self._total / self._count if self._count else None
+
+
+class DailyExtremes:
+    """High and low of each field, with the local time they happened, since local midnight"""
+
+    def __init__(self, fields=tuple(STATS_FIELDS), timezone='America/Chicago'):
+        self.fields = tuple(fields)
+        self.timezone = ZoneInfo(timezone) if isinstance(timezone, str) else timezone
+        self.date = None
+        self.high = {}  # field -> (value, local datetime)
+        self.low = {}
+
+    def _roll_over(self, local):
+        # Only ever forward: a late reading mustn't take the day back
+        if self.date is None or local.date() > self.date:
+            self.date = local.date()
+            self.high = {}
+            self.low = {}
+
+    def roll_over(self, now):
+        """Start a new day if `now` is past midnight, whether or not readings have come since"""
+        self._roll_over(datetime.fromtimestamp(now, self.timezone))
+
+    def add(self, timestamp, reading):
+        local = datetime.fromtimestamp(timestamp, self.timezone)
+        self._roll_over(local)
+        if local.date() < self.date:
+            return  # From a day that's already over
+        for field in self.fields:
+            value = reading.get(field)
+            if not isinstance(value, (int, float)):
+                continue
+            if field not in self.high or value > self.high[field][0]:
+                self.high[field] = (value, local)
+            if field not in self.low or value < self.low[field][0]:
+                self.low[field] = (value, local)
+
+    def extend(self, timestamps, columns):
+        """Bulk-load from arrays; columns maps field to values aligned with timestamps"""
+        if len(timestamps) == 0:
+            return
+        local = datetime.fromtimestamp(float(timestamps[-1]), self.timezone)
+        if self.date is not None and local.date() < self.date:
+            return  # All from a day that's already over
+        self._roll_over(local)
+        midnight = local.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        first = int(np.searchsorted(timestamps, midnight, side='left'))
+        today = timestamps[first:]
+        for field in self.fields:
+            values = columns[field][first:]
+            finite = np.isfinite(values)
+            if not finite.any():
+                continue
+            for extremes, pick, better in ((self.high, np.nanargmax, operator.gt),
+                                           (self.low, np.nanargmin, operator.lt)):
+                i = int(pick(values))
+                value = float(values[i])
+                if field not in extremes or better(value, extremes[field][0]):
+                    extremes[field] = (value, datetime.fromtimestamp(float(today[i]), self.timezone))
+
+
+class ReadingStats:
+    """Daily highs/lows plus rolling 1h/24h/7d min/max/mean for one station"""
+
+    def __init__(self, fields=tuple(STATS_FIELDS), timezone='America/Chicago', windows=WINDOWS):
+        self.fields = tuple(fields)
+        self.daily = DailyExtremes(self.fields, timezone)
+        self.rolling = {field: [RollingStats(seconds, resolution) for seconds, resolution in windows]
+                        for field in self.fields}
+
+    def add(self, timestamp, reading):
+        self.daily.add(timestamp, reading)
+        for field, windows in self.rolling.items():
+            value = reading.get(field)
+            if isinstance(value, (int, float)):
+                for window in windows:
+                    window.add(timestamp, value)
+
+    def refresh(self, now=None):
+        """Bring the day and the windows up to `now`, in case the feed has stalled"""
+        if now is None:
+            now = time.time()
+        self.daily.roll_over(now)
+        for windows in self.rolling.values():
+            for window in windows:
+                window.expire(now)
+
+    def warm(self, history):
+        """Load what's already in a HistoryBuffer, e.g. after a restart"""
+        timestamps = history.timestamps
+        columns = {field: history.column(field) for field in self.fields}
+        self.daily.extend(timestamps, columns)
+        for field, windows in self.rolling.items():
+            for window in windows:
+                window.extend(timestamps, columns[field])
+
+
+def _window_label(seconds):
+    if seconds > 24 * 3600 and seconds % (24 * 3600) == 0:
+        return f"{seconds // (24 * 3600)}d"
+    return f"{seconds // 3600}h"
+
+
+def stats_lines(stats, now=None):
+    """The highs/lows and rolling statistics rows for a ReadingStats, as of `now`"""
+    def fmt(value, decimals):
+        return '-' if value is None else f"{value:.{decimals}f}"
+
+    # Readings only roll the day over and expire the windows as they arrive
+    stats.refresh(now)
+
+    lines = [line("Today       | High               Low")]
+    for field in stats.fields:
+        label, decimals = STATS_FIELDS.get(field, (field, 1))
+        cells = []
+        for extremes in (stats.daily.high, stats.daily.low):
+            if field in extremes:
+                value, when = extremes[field]
+                cells.append(f"{fmt(value, decimals)} at {when.strftime('%H:%M')}".ljust(19))
+            else:
+                cells.append('-'.ljust(19))
+        lines.append(line(f"{label:<12}| {''.join(cells).rstrip()}"))
+
+    windows = next(iter(stats.rolling.values()), [])
+    header = ''.join(f"{_window_label(w.seconds)} min/avg/max".ljust(22) for w in windows)
+    lines.append(line(f"Rolling     | {header.rstrip()}"))
+    for field, field_windows in stats.rolling.items():
+        label, decimals = STATS_FIELDS.get(field, (field, 1))
+        cells = ''.join('/'.join(fmt(value, decimals) for value in (w.min, w.mean, w.max)).ljust(22)
+                        for w in field_windows)
+        lines.append(line(f"{label:<12}| {cells.rstrip()}"))
+    return lines
@@ -0,0 +1,288 @@
+import json
+import os
+import time
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+
+# Numeric lastData fields kept in history, one column each
+HISTORY_FIELDS = (
+    'tempf', 'humidity', 'dewPoint', 'feelsLike',
+    'baromrelin', 'windspeedmph', 'windgustmph', 'winddir', 'winddir_avg10m',
+    'uv', 'solarradiation', 'hourlyrainin', 'dailyrainin',
+    'tempinf', 'humidityin', 'temp2f', 'humidity2',
+)
+
+# A week of readings at the realtime feed's 5 second rate
+DEFAULT_CAPACITY = 7 * 24 * 3600 // 5
+
+
+def reading_timestamp(reading):
+    """Return the epoch seconds of a lastData reading, falling back to now"""
+    dateutc = reading.get('dateutc')
+    if isinstance(dateutc, (int, float)):
+        return dateutc / 1000  # Ambient reports milliseconds
+    return time.time()
+
+
+class HistoryBuffer:
+    """Preallocated columnar history of numeric readings.
+
+    Values are float32 with one column per field (NaN where a reading lacks
+    the field) alongside a float64 epoch-seconds timestamp column. Rows are
+    appended into a block with 25% slack; when the slack is used up the newest
+    `capacity` rows are shifted back to the start. That keeps the live rows
+    contiguous, so every window is a zero-copy view, at an amortized cost of
+    a few row copies per append. A week of 5 second data takes about 11 MB
+    including the slack.
+    """
+
+    def __init__(self, fields=HISTORY_FIELDS, capacity=DEFAULT_CAPACITY, store=None):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._index = {field: i for i, field in enumerate(self.fields)}
+        size = capacity + max(capacity // 4, 1)
+        # np.empty leaves pages untouched until rows are actually written
+        self._timestamps = np.empty(size, dtype=np.float64)
+        self._values = np.empty((size, len(self.fields)), dtype=np.float32)
+        self._start = 0
+        self._end = 0
+        # Optional HistoryFile that every appended reading is persisted to
+        self.store = store
+        if store is not None:
+            if store.fields != self.fields:
+                raise ValueError("history store fields do not match the buffer")
+            self.extend(*store.load())
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def timestamps(self):
+        return self._timestamps[self._start:self._end]
+
+    @property
+    def values(self):
+        return self._values[self._start:self._end]
+
+    def column(self, field):
+        return self.values[:, self._index[field]]
+
+    def last_timestamp(self):
+        if self._end == self._start:
+            return None
+        return float(self._timestamps[self._end - 1])
+
+    def _compact(self):
+        # Move the live rows back to the start of the block
+        count = len(self)
+        src = self._end - count
+        self._timestamps[:count] = self._timestamps[src:self._end]
+        self._values[:count] = self._values[src:self._end]
+        self._start = 0
+        self._end = count
+
+    def append(self, reading, timestamp=None):
+        """Store a lastData dict; returns False for duplicate or out-of-order readings"""
+        if timestamp is None:
+            timestamp = reading_timestamp(reading)
+        last = self.last_timestamp()
+        if last is not None and timestamp <= last:
+            return False
+
+        if len(self) >= self.capacity:
+            self._start += 1
+        if self._end == len(self._timestamps):
+            self._compact()
+
+        row = self._values[self._end]
+        row.fill(np.nan)
+        for field, i in self._index.items():
+            value = reading.get(field)
+            if isinstance(value, (int, float)):
+                row[i] = value
+        self._timestamps[self._end] = timestamp
+        self._end += 1
+        if self.store is not None:
+            self.store.append(timestamp, row)
+        return True
+
+    def extend(self, timestamps, values):
+        """Bulk-load rows in our field order, oldest first, without persisting them"""
+        last = self.last_timestamp()
+        if last is not None:
+            newer = timestamps > last
+            timestamps, values = timestamps[newer], values[newer]
+        timestamps = timestamps[-self.capacity:]
+        values = values[-self.capacity:]
+        count = len(timestamps)
+        if count == 0:
+            return 0
+
+        overflow = len(self) + count - self.capacity
+        if overflow > 0:
+            self._start += overflow
+        if self._end + count > len(self._timestamps):
+            self._compact()
+        self._timestamps[self._end:self._end + count] = timestamps
+        self._values[self._end:self._end + count] = values
+        self._end += count
+        return count
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+    def window(self, seconds=None, since=None):
+        """Return (timestamps, values) views for readings newer than a cutoff"""
+        if since is None and seconds is not None:
+            last = self.last_timestamp()
+            since = (last if last is not None else time.time()) - seconds
+        timestamps = self.timestamps
+        first = 0 if since is None else int(np.searchsorted(timestamps, since, side='left'))
+        return timestamps[first:], self.values[first:]
+
+    def series(self, field, seconds=None, since=None):
+        """Return (timestamps, values) views of one field"""
+        timestamps, values = self.window(seconds, since)
+        return timestamps, values[:, self._index[field]]
+
+
+HISTORY_MAGIC = b'AWHIST1\n'
+
+
+class HistoryFile:
+    """Append-only on-disk history of fixed-size binary records.
+
+    The file is a small header (magic plus the JSON list of field names)
+    followed by packed (float64 timestamp, float32 values...) records, so it
+    can be memory-mapped straight into NumPy at startup with no parsing.
+    Each record goes out in a single write() on an O_APPEND descriptor; a
+    torn record left by a crash is truncated away on the next open. When the
+    file reaches max_bytes it is rotated to `<path>.1`, replacing any older
+    rotation, so at most twice max_bytes is kept on disk.
+    """
+
+    def __init__(self, path, fields=HISTORY_FIELDS, max_bytes=64 * 1024 * 1024,
+                 fsync_interval=30):
+        self.path = path
+        self.fields = tuple(fields)
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.dtype = np.dtype([('t', '<f8'), ('v', '<f4', (len(self.fields),))])
+        self._fd = None
+        self._size = 0
+        self._last_fsync = time.monotonic()
+
+    @staticmethod
+    def _read_header(f):
+        if f.read(len(HISTORY_MAGIC)) != HISTORY_MAGIC:
+            return None, 0
+        length = int.from_bytes(f.read(4), 'little')
+        fields = json.loads(f.read(length).decode('utf-8'))
+        return tuple(fields), len(HISTORY_MAGIC) + 4 + length
+
+    def _header(self):
+        names = json.dumps(list(self.fields)).encode('utf-8')
+        # Pad so records start on an 8 byte boundary
+        names += b' ' * (-(len(HISTORY_MAGIC) + 4 + len(names)) % 8)
+        return HISTORY_MAGIC + len(names).to_bytes(4, 'little') + names
+
+    def _map(self, path):
+        """Memory-map one history file, returning (timestamps, values) in our field order"""
+        try:
+            with open(path, 'rb') as f:
+                fields, offset = self._read_header(f)
+        except (OSError, ValueError):
+            return None
+        if fields is None:
+            return None
+
+        dtype = np.dtype([('t', '<f8'), ('v', '<f4', (len(fields),))])
+        count = (os.path.getsize(path) - offset) // dtype.itemsize
+        if count <= 0:
+            return None
+        records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+        if fields == self.fields:
+            return records['t'], records['v']
+        # Written with a different field list; line the columns up by name
+        values = np.full((count, len(self.fields)), np.nan, dtype=np.float32)
+        for i, field in enumerate(self.fields):
+            if field in fields:
+                values[:, i] = records['v'][:, fields.index(field)]
+        return records['t'], values
+
+    def load(self):
+        """Return (timestamps, values) for all stored readings, oldest first"""
+        parts = [part for part in (self._map(self.path + '.1'), self._map(self.path)) if part]
+        if not parts:
+            return (np.empty(0, dtype=np.float64),
+                    np.empty((0, len(self.fields)), dtype=np.float32))
+        if len(parts) == 1:
+            return parts[0]
+        return (np.concatenate([p[0] for p in parts]),
+                np.concatenate([p[1] for p in parts]))
+
+    def _create(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._header())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def open(self):
+        try:
+            with open(self.path, 'rb') as f:
+                fields, offset = self._read_header(f)
+        except FileNotFoundError:
+            fields, offset = None, 0
+        except (OSError, ValueError):
+            fields = None
+
+        if fields != self.fields:
+            # Missing, corrupt, or written with another field list: keep the
+            # old file as the rotation so its readings still load, then start fresh
+            if os.path.exists(self.path) and fields is not None:
+                os.replace(self.path, self.path + '.1')
+            self._create()
+        else:
+            # Drop a partially written trailing record left by a crash
+            size = os.path.getsize(self.path)
+            whole = offset + (size - offset) // self.dtype.itemsize * self.dtype.itemsize
+            if whole != size:
+                os.truncate(self.path, whole)
+
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self._size = os.fstat(self._fd).st_size
+
+    def _rotate(self):
+        self.close()
+        os.replace(self.path, self.path + '.1')
+        self._create()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self._size = os.fstat(self._fd).st_size
+
+    def append(self, timestamp, values):
+        if self._fd is None:
+            self.open()
+        record = np.zeros(1, dtype=self.dtype)
+        record['t'] = timestamp
+        record['v'] = values
+        data = record.tobytes()
+        if self._size + len(data) > self.max_bytes:
+            self._rotate()
+        os.write(self._fd, data)
+        self._size += len(data)
+
+        now = time.monotonic()
+        if now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._fd)
+            self._last_fsync = now
+
+    def close(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,205 @@
+"""Which reading fields are displayed, and how, for both scripts.
+
+FIELDS is the schema: each field's unit, format and whether it's required.
+LAYOUT lists the rows in display order. Both are compiled once by Layout,
+which parses each payload into a small record holding only the fields the
+rows use and turns records into display rows without any per-frame parsing.
+
+A different sensor set needs no code changes: pass a JSON file with --layout,
+
+    {"fields": {"temp3f": ["° F", "", false]},
+     "rows": [["Temperature", "{tempf}"], ["Greenhouse", "{temp3f}"], "barometer"]}
+
+where "fields" adds to or overrides FIELDS and "rows", if given, replaces
+LAYOUT.
+"""
+import curses
+import json
+import string
+from screen import line, wind_direction
+
+# name: (unit, format, required). The format is a format spec, or one of
+# FORMATTERS. A missing required field shows as '--'; a missing optional
+# field hides its part of the row. Fields not listed are optional, unformatted
+# and unitless.
+FIELDS = {
+    'tempf': ('° F', '', True),
+    'humidity': (' %', '', True),
+    'feelsLike': ('° F', '', False),
+    'dewPoint': ('° F', '', False),
+    'baromrelin': (' inHg', '.3f', False),
+    'uv': ('', '', False),
+    'solarradiation': (' W/m²', '', False),
+    'tempinf': ('° F', '', False),
+    'humidityin': (' %', '', False),
+    'temp2f': ('° F', '', False),
+    'humidity2': (' %', '', False),
+    'windspeedmph': (' mph', '', False),
+    'windgustmph': (' mph', '', False),
+    'maxdailygust': (' mph', '', False),
+    'winddir': ('', 'compass', False),
+    'winddir_avg10m': ('', 'compass', False),
+    'dailyrainin': (' in', '', False),
+    'battout': ('', 'battery', False),
+}
+
+# Rows in display order. A tuple is a label and one or more parts of text
+# with {field} placeholders; a part is left out when an optional field in it
+# is missing, and the row when its first part is. A bare name is a group of
+# rows the caller supplies, e.g. the barometer with its trend arrow or the
+# alerts that are firing, and is skipped when the caller has nothing for it.
+LAYOUT = (
+    'alerts',
+    ('Temperature', '{tempf}'),
+    ('Humidity', '{humidity}'),
+    ('Feels Like', '{feelsLike}'),
+    ('Dew Point', '{dewPoint}'),
+    'barometer',
+    ('UV Index', '{uv}'),
+    ('Solar Rad', '{solarradiation}'),
+    ('Downstairs', '{tempinf} / {humidityin}'),
+    ('Upstairs', '{temp2f} / {humidity2}'),
+    ('Wind Speed', '{windspeedmph}', ', gust {windgustmph}', ', max {maxdailygust}'),
+    ('Wind Dir', '{winddir}', ', average {winddir_avg10m}'),
+    'wind',
+    ('Daily Rain', '{dailyrainin}'),
+    ('Battery', '{battout}'),
+    'stats',
+    'charts',
+)
+
+# Fields the caller-supplied groups read from the record
+GROUP_FIELDS = {'barometer': ('baromrelin',)}
+
+
+def _battery(value):
+    if value == 1:
+        return ("Good", curses.color_pair(2))
+    return ("Low", curses.color_pair(4))
+
+
+# Formats that aren't format specs; each returns text or a (text, attr) pair
+FORMATTERS = {
+    'compass': wind_direction,
+    'battery': _battery,
+}
+
+
+class Reading:
+    """Base for the records Layout.parse() returns; subclasses set __slots__"""
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, payload):
+        record = cls()
+        for name in cls.__slots__:
+            value = payload.get(name)
+            # Numbers only; anything else counts as missing
+            setattr(record, name, value if isinstance(value, (int, float)) else None)
+        return record
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+
+class Layout:
+    def __init__(self, fields=None, rows=LAYOUT):
+        self.fields = dict(FIELDS, **(fields or {}))
+        self.rows = [self._compile(row) for row in rows]
+        used = {'dateutc'}
+        for row in rows:
+            if isinstance(row, str):
+                used.update(GROUP_FIELDS.get(row, ()))
+            else:
+                used.update(name for part in row[1:]
+                            for _, name, _, _ in string.Formatter().parse(part) if name)
+        # Every payload field the rows read, e.g. for export columns
+        self.used = tuple(sorted(used))
+        self.record_type = type('Reading', (Reading,), {'__slots__': self.used})
+
+    def _compile(self, row):
+        if isinstance(row, str):
+            return row
+        label, *parts = row
+        compiled = []
+        for part in parts:
+            pieces = []
+            for literal, name, spec, _ in string.Formatter().parse(part):
+                field = None
+                if name:
+                    unit, format_spec, required = self.fields.get(name, ('', '', False))
+                    field = (name, unit, spec or format_spec, required)
+                pieces.append((literal, field))
+            compiled.append(pieces)
+        return (f"{label:<12}| ", compiled)
+
+    def parse(self, payload):
+        """A record of just the fields the rows use, from a lastData dict"""
+        return self.record_type.parse(payload)
+
+    @staticmethod
+    def _format(value, unit, spec):
+        formatter = FORMATTERS.get(spec)
+        if formatter is not None:
+            return formatter(value)
+        return format(value, spec) + unit
+
+    def _part(self, record, pieces):
+        """A part's text and (text, attr) pieces, or None if an optional field is missing"""
+        rendered = []
+        for literal, field in pieces:
+            if literal:
+                rendered.append(literal)
+            if field is None:
+                continue
+            name, unit, spec, required = field
+            value = getattr(record, name)
+            if value is not None:
+                rendered.append(self._format(value, unit, spec))
+            elif required:
+                rendered.append('--')
+            else:
+                return None
+        return rendered
+
+    def lines(self, record, **groups):
+        """Display rows for a record; groups maps names in the layout to lists of rows"""
+        lines = []
+        for row in self.rows:
+            if isinstance(row, str):
+                lines.extend(groups.get(row) or ())
+                continue
+            label, parts = row
+            first = self._part(record, parts[0])
+            if first is None:
+                continue
+            pieces = [label] + first
+            for part in parts[1:]:
+                pieces.extend(self._part(record, part) or ())
+            # Run plain text together; (text, attr) pairs keep their own segment
+            segments = []
+            text = ''
+            for piece in pieces:
+                if isinstance(piece, tuple):
+                    if text:
+                        segments.append(text)
+                        text = ''
+                    segments.append(piece)
+                else:
+                    text += piece
+            if text:
+                segments.append(text)
+            lines.append(line(*segments))
+        return lines
+
+
+def load_layout(path):
+    """A Layout from a JSON file of {"fields": {...}, "rows": [...]}"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    fields = {name: tuple(spec) for name, spec in config.get('fields', {}).items()}
+    rows = LAYOUT
+    if 'rows' in config:
+        rows = [row if isinstance(row, str) else tuple(row) for row in config['rows']]
+    return Layout(fields, rows)
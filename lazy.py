@@ -0,0 +1,36 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """Stands in for a module and imports it when an attribute is first used.
+
+        np = LazyModule('numpy')
+
+    Heavy dependencies (numpy, ephem, socketio, aiohttp, requests) then cost
+    nothing at startup, and a feature that's switched off never loads them.
+    Attributes are copied onto the stand-in as they're looked up, so later
+    lookups are as cheap as on the module itself.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # importlib's own import lock makes this safe from any thread; ours
+        # only keeps two threads from timing the same import
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module {self._name!r} ({state})>"
@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds for the Prometheus histogram buckets
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    """Cumulative bucket counts for Prometheus plus the most recent samples
+    for rolling percentiles on the diagnostics line"""
+
+    def __init__(self, recent=1024):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=recent)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def percentile(self, fraction):
+        samples = sorted(self.recent)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def incr(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count(self, name):
+        """How many times a timed call or a counter has happened so far"""
+        histogram = self.histograms.get(name)
+        if histogram is not None:
+            return histogram.count
+        return self.counters.get(name, 0)
+
+    def timed(self, name):
+        """Decorator recording how long each call takes"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(name, time.perf_counter() - start)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    async def watch_loop_lag(self, interval=0.5):
+        """Record how late the event loop wakes us, i.e. how long it was blocked"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe('event_loop_lag', max(0.0, time.perf_counter() - start - interval))
+
+    def summary(self, names=None):
+        """One-line rolling p50/p99 summary for the on-screen diagnostics row"""
+        parts = []
+        for name in names or sorted(self.histograms):
+            histogram = self.histograms.get(name)
+            if histogram is None or not histogram.recent:
+                continue
+            p50 = histogram.percentile(0.5) * 1000
+            p99 = histogram.percentile(0.99) * 1000
+            parts.append(f"{name} {p50:.2f}/{p99:.2f}ms")
+        for name, value in sorted(self.counters.items()):
+            parts.append(f"{name} {value}")
+        return ' '.join(parts)
+
+    def prometheus(self):
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"ambient_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS, list(histogram.counts)):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum {histogram.sum}")
+            lines.append(f"{metric}_count {histogram.count}")
+        for name, value in sorted(self.counters.items()):
+            metric = f"ambient_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Expose /metrics in Prometheus text format from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Don't scribble on the curses screen
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Shared by everything in the process
+METRICS = Metrics()
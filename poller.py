@@ -0,0 +1,87 @@
+import asyncio
+import random
+import time
+from backfill import API_URL
+from lazy import LazyModule
+from metrics import METRICS
+
+aiohttp = LazyModule('aiohttp')
+
+
+class RestPoller:
+    """Polls /v1/devices over one keep-alive aiohttp session.
+
+    Polls are scheduled from the station's own dateutc: the REST data only
+    moves on every `interval` seconds, so the next request goes out `lag`
+    seconds after the next reading is due instead of on a fixed timer. Late
+    readings are retried at a growing delay, up to `interval`. Failures back
+    off exponentially with jitter, up to `max_backoff`.
+    """
+
+    def __init__(self, api_key, app_key, api_url=API_URL, interval=60, lag=5,
+                 min_delay=5, max_backoff=300, timeout=10):
+        self.api_key = api_key
+        self.app_key = app_key
+        self.api_url = api_url.rstrip('/')
+        self.interval = interval
+        self.lag = lag
+        self.min_delay = min_delay
+        self.max_backoff = max_backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.failures = 0
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    @METRICS.timed('poll')
+    async def fetch(self):
+        params = {'apiKey': self.api_key, 'applicationKey': self.app_key, 'limit': 1}
+        async with self.session.get(f'{self.api_url}/devices', params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    def next_delay(self, dateutc, now=None):
+        """Seconds to wait before polling again, given the newest reading's dateutc (ms)"""
+        if now is None:
+            now = time.time()
+        due = dateutc / 1000 + self.interval + self.lag
+        if due <= now:
+            # Overdue: retry at a growing delay, so a late upload is picked up
+            # quickly but a station that's offline is only polled every interval
+            return min(self.interval, max(self.min_delay, now - due))
+        return max(self.min_delay, due - now)
+
+    def backoff(self):
+        # Exponential with "equal jitter": between half and all of the step
+        step = min(self.max_backoff, self.min_delay * 2 ** self.failures)
+        return step / 2 + random.uniform(0, step / 2)
+
+    async def poll(self, on_failure=None):
+        """Yield each device (macAddress, info, lastData) whenever its dateutc changes"""
+        last_dateutc = {}
+        while True:
+            try:
+                devices = await self.fetch()
+                updated = [device for device in devices
+                           if device['lastData']['dateutc'] != last_dateutc.get(device['macAddress'])]
+                # Poll again when the soonest station is next due
+                delay = min(self.next_delay(device['lastData']['dateutc']) for device in devices)
+            except (KeyError, TypeError, ValueError,
+                    aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if on_failure:
+                    on_failure(e)
+                delay = self.backoff()
+                self.failures += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.failures = 0
+            for device in updated:
+                last_dateutc[device['macAddress']] = device['lastData']['dateutc']
+                yield device
+            await asyncio.sleep(delay)
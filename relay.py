@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+from contextlib import aclosing
+from sources import REALTIME_URL, RealtimeSource
+
+
+class Subscriber:
+    def __init__(self, writer, max_queue):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.task = None
+
+
+class Relay:
+    """Shares one upstream Ambient connection with local displays.
+
+    Subscribers connect to a Unix socket and receive each upstream event as a
+    line of JSON, {"event": ..., "data": ...}, using the same event names as
+    the realtime API plus "connect"/"disconnect" for the upstream state. New
+    subscribers are sent the current state first, so they draw immediately.
+    Each subscriber has a bounded queue; one that falls max_queue events behind
+    is disconnected rather than holding up the others. A reading no newer
+    than the last one relayed for its station, such as the one the realtime
+    API resends on reconnect, isn't relayed again.
+
+    `source` replaces the realtime API with any source from sources.py, e.g.
+    a FailoverSource, or a stub upstream for testing.
+    """
+
+    def __init__(self, api_keys, app_key, path, max_queue=256, upstream_url=REALTIME_URL,
+                 source=None):
+        self.api_keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
+        self.app_key = app_key
+        self.path = path
+        self.max_queue = max_queue
+        self.upstream_url = upstream_url
+        self.subscribers = set()
+        self.connected = False
+        self.subscribed = None
+        self.latest = {}  # Last data event per MAC address
+        self.server = None
+        self.clients = set()  # handle_client() tasks, awaited on stop()
+        self.source = source or RealtimeSource(self.api_keys, app_key, upstream_url)
+
+    def on_connect(self):
+        self.connected = True
+        self.broadcast('connect')
+
+    def on_disconnect(self):
+        self.connected = False
+        self.broadcast('disconnect')
+
+    def on_subscribed(self, data):
+        self.subscribed = data
+        self.broadcast('subscribed', data)
+
+    def on_data(self, data):
+        mac_address = data.get('macAddress', '')
+        previous = self.latest.get(mac_address)
+        if (previous is not None and 'dateutc' in data and 'dateutc' in previous
+                and data['dateutc'] <= previous['dateutc']):
+            return
+        self.latest[mac_address] = data
+        self.broadcast('data', data)
+
+    @staticmethod
+    def _encode(event, data=None):
+        message = {'event': event}
+        if data is not None:
+            message['data'] = data
+        return (json.dumps(message) + '\n').encode('utf-8')
+
+    def broadcast(self, event, data=None):
+        # Encode once, however many subscribers there are
+        message = self._encode(event, data)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.drop(subscriber)
+
+    def drop(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if subscriber.task:
+            subscriber.task.cancel()
+        subscriber.writer.close()
+
+    async def _send(self, subscriber):
+        try:
+            while True:
+                message = await subscriber.queue.get()
+                subscriber.writer.write(message)
+                await subscriber.writer.drain()
+        except (ConnectionError, OSError):
+            self.drop(subscriber)
+
+    async def handle_client(self, reader, writer):
+        subscriber = Subscriber(writer, self.max_queue)
+        # Catch the newcomer up before it joins the broadcast
+        if self.connected:
+            subscriber.queue.put_nowait(self._encode('connect'))
+        if self.subscribed is not None:
+            subscriber.queue.put_nowait(self._encode('subscribed', self.subscribed))
+        for data in list(self.latest.values())[-(self.max_queue - 2):]:
+            subscriber.queue.put_nowait(self._encode('data', data))
+        subscriber.task = asyncio.create_task(self._send(subscriber))
+        self.subscribers.add(subscriber)
+        client = asyncio.current_task()
+        self.clients.add(client)
+
+        # Subscribers don't send anything; EOF means they've gone. stop()
+        # closes them, and cancels whatever is left
+        try:
+            await reader.read()
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            self.drop(subscriber)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Stale socket from a previous run
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        senders = [subscriber.task for subscriber in self.subscribers if subscriber.task]
+        for subscriber in list(self.subscribers):
+            self.drop(subscriber)
+        for client in self.clients:
+            client.cancel()
+        await asyncio.gather(*senders, *self.clients, return_exceptions=True)
+        if self.server:
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def run(self):
+        await self.start()
+        try:
+            # The source reconnects to the upstream on its own
+            async with aclosing(self.source.events()) as events:
+                async for event, data in events:
+                    if event == 'connect':
+                        self.on_connect()
+                    elif event == 'disconnect':
+                        self.on_disconnect()
+                    elif event == 'subscribed':
+                        self.on_subscribed(data)
+                    elif event == 'data':
+                        self.on_data(data)
+        finally:
+            await self.stop()
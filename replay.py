@@ -0,0 +1,212 @@
+"""Local stand-in for Ambient's realtime and REST APIs.
+
+Replays recorded lastData payloads (one JSON object per line) or synthetic
+ones over socket.io and the /v1/devices REST endpoints, so the displays can
+be exercised without credentials:
+
+    python replay.py recording.ndjson --rate 1000
+
+WeatherStation takes upstream_url and rest_url, and ambient.main() takes
+api_url, for pointing them at it. bench.py drives it in-process.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import deque
+import socketio
+from aiohttp import web
+
+MAC_ADDRESS = '00:00:00:00:00:01'
+
+
+def synthetic_payloads(count=720, seed=1):
+    """Generate a plausible day-ish sequence of lastData payloads"""
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        phase = 2 * math.pi * i / count
+        wind = max(0.0, 5 + 4 * math.sin(phase * 3) + rng.gauss(0, 1.5))
+        payloads.append({
+            'tempf': round(60 + 15 * math.sin(phase) + rng.gauss(0, 0.3), 1),
+            'humidity': int(55 - 20 * math.sin(phase) + rng.gauss(0, 2)),
+            'feelsLike': round(60 + 15 * math.sin(phase), 1),
+            'dewPoint': round(45 + 2 * math.sin(phase), 1),
+            'baromrelin': round(29.92 + 0.15 * math.sin(phase / 2) + rng.gauss(0, 0.002), 3),
+            'baromabsin': round(29.12 + 0.15 * math.sin(phase / 2), 3),
+            'windspeedmph': round(wind, 1),
+            'windgustmph': round(wind * 1.4, 1),
+            'maxdailygust': 18.3,
+            'winddir': int(225 + 40 * math.sin(phase * 5) + rng.gauss(0, 15)) % 360,
+            'winddir_avg10m': int(225 + 40 * math.sin(phase * 5)) % 360,
+            'uv': max(0, int(6 * math.sin(phase))),
+            'solarradiation': round(max(0.0, 800 * math.sin(phase)), 1),
+            'hourlyrainin': 0.0,
+            'dailyrainin': 0.02,
+            'tempinf': round(70 + rng.gauss(0, 0.1), 1),
+            'humidityin': 40,
+            'temp2f': round(68 + rng.gauss(0, 0.1), 1),
+            'humidity2': 42,
+            'battout': 1,
+        })
+    return payloads
+
+
+def load_payloads(path):
+    payloads = []
+    with open(path, encoding='utf-8') as f:
+        for raw in f:
+            raw = raw.strip()
+            if raw:
+                payloads.append(json.loads(raw))
+    return payloads
+
+
+class ReplayServer:
+    """Serves payloads round-robin at `rate` readings per second.
+
+    Readings are made on the server's own clock from start(), whether or not
+    anyone is listening: socket.io subscribers get each one as a data event,
+    and the REST endpoints serve the latest and page back through the last
+    `history_limit`. Each gets a fresh, strictly increasing dateutc (ms) and
+    the stand-in MAC address. `on_emit(dateutc)` is called just before each
+    is sent, which the benchmark uses to time event-to-screen latency.
+    """
+
+    def __init__(self, payloads, rate=1.0, host='127.0.0.1', port=8765,
+                 mac_address=MAC_ADDRESS, on_emit=None, history_limit=10000):
+        self.payloads = payloads
+        self.rate = rate
+        self.host = host
+        self.port = port
+        self.mac_address = mac_address
+        self.on_emit = on_emit
+        self.sent = 0
+        self.history = deque(maxlen=history_limit)  # Oldest first, for the REST endpoints
+        self.alerts = []  # Bodies POSTed to /alerts, the stand-in alert webhook
+        self.on_alert = None
+        self._last_dateutc = 0
+        self._subscribers = set()
+        self._clock = None
+        self.runner = None
+
+        self.sio = socketio.AsyncServer(async_mode='aiohttp')
+        self.app = web.Application()
+        self.sio.attach(self.app)
+        self.sio.on('subscribe', self.on_subscribe)
+        self.sio.on('disconnect', self.on_disconnect)
+        self.app.router.add_get('/v1/devices', self.devices)
+        self.app.router.add_get('/v1/devices/{mac}', self.device_data)
+        self.app.router.add_post('/alerts', self.alert)
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def _device(self):
+        return {
+            'macAddress': self.mac_address,
+            'info': {'name': 'Replay'},
+            'lastData': self.history[-1],
+        }
+
+    def next_payload(self):
+        # Millisecond dateutc, bumped when events are sent faster than that
+        dateutc = max(int(time.time() * 1000), self._last_dateutc + 1)
+        self._last_dateutc = dateutc
+        payload = dict(self.payloads[self.sent % len(self.payloads)],
+                       macAddress=self.mac_address, dateutc=dateutc)
+        self.sent += 1
+        self.history.append(payload)
+        if self.on_emit:
+            self.on_emit(dateutc)
+        return payload
+
+    async def on_subscribe(self, sid, data):
+        await self.sio.emit('subscribed', {'devices': [self._device()]}, to=sid)
+        self._subscribers.add(sid)
+
+    async def on_disconnect(self, sid, *args):
+        self._subscribers.discard(sid)
+
+    async def clock(self):
+        # Made in per-tick batches so high rates aren't bound by sleep resolution;
+        # start() made the first
+        tick = max(1 / self.rate, 0.01)
+        start = time.perf_counter()
+        made = 0
+        while True:
+            await asyncio.sleep(tick)
+            due = int((time.perf_counter() - start) * self.rate)
+            while made < due:
+                payload = self.next_payload()
+                for sid in list(self._subscribers):
+                    await self.sio.emit('data', payload, to=sid)
+                made += 1
+
+    async def devices(self, request):
+        return web.json_response([self._device()])
+
+    async def device_data(self, request):
+        limit = min(int(request.query.get('limit', 288)), 288)
+        end_date = int(request.query.get('endDate', 2 ** 62))
+        readings = (r for r in reversed(self.history) if r['dateutc'] <= end_date)
+        return web.json_response(list(itertools.islice(readings, limit)))
+
+    async def alert(self, request):
+        alert = await request.json()
+        self.alerts.append(alert)
+        if self.on_alert:
+            self.on_alert(alert)
+        return web.json_response({'ok': True})
+
+    async def start(self):
+        # A reading is ready before the first request can ask for one
+        self.next_payload()
+        self._clock = asyncio.create_task(self.clock())
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._clock:
+            self._clock.cancel()
+            await asyncio.gather(self._clock, return_exceptions=True)
+        if self.runner:
+            await self.runner.cleanup()
+
+
+async def serve(args):
+    payloads = load_payloads(args.recording) if args.recording else synthetic_payloads()
+    server = ReplayServer(payloads, args.rate, args.host, args.port)
+    await server.start()
+    print(f"Replaying {len(payloads)} payloads at {args.rate}/s on {server.url}")
+    print(f"  realtime: upstream_url='{server.url}/?api=1&applicationKey={{app_key}}'")
+    print(f"  REST:     {server.url}/v1")
+    print(f"  alerts:   webhook '{server.url}/alerts'")
+    server.on_alert = lambda alert: print(f"Alert: {alert.get('message', alert)}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Replay recorded Ambient payloads locally")
+    parser.add_argument('recording', nargs='?',
+                        help="NDJSON file of lastData payloads; synthetic data if omitted")
+    parser.add_argument('--rate', type=float, default=1.0, help="events per second")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,82 @@
+import curses
+import math
+
+DIRECTIONS = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+              'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
+
+
+def line(*segments):
+    """Build a display row from plain strings and (text, attr) pairs"""
+    return tuple(seg if isinstance(seg, tuple) else (seg, 0) for seg in segments)
+
+
+def wind_direction(degrees):
+    index = math.floor((degrees + 11.25) / 22.5)
+    return DIRECTIONS[index % 16]
+
+
+def barometer_line(pressure, pressure_analyzer):
+    """The barometer row: reading, trend arrow and rate of change"""
+    trend, change_rate = pressure_analyzer.get_trend()
+    barometer = [f"Barometer   | {pressure:.3f} inHg "]
+
+    if trend == "INSUFFICIENT_DATA":
+        barometer.append(("(collecting data...)", curses.color_pair(3)))
+        return line(*barometer)
+
+    # Two arrows for a fast change
+    if trend == "RISING":
+        arrow = "▲▲" if abs(change_rate) > 0.06 else "▲"
+        barometer.append((arrow, curses.color_pair(2)))
+    elif trend == "FALLING":
+        arrow = "▼▼" if abs(change_rate) > 0.06 else "▼"
+        barometer.append((arrow, curses.color_pair(4)))
+    else:
+        barometer.append(("▷", curses.color_pair(3)))      # Steady
+    barometer.append((f" ({change_rate:+.3f}/hr)", curses.color_pair(1)))
+    return line(*barometer)
+
+
+class LineRenderer:
+    """Draws a list of rows into a window, rewriting only rows that changed.
+
+    The previous frame's rows (text and attributes) are kept, so an update
+    that only changes a couple of values touches a couple of rows instead of
+    clearing and repainting the whole window. Call invalidate() after anything
+    else draws over the window to force a full repaint.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lines = []
+
+    def invalidate(self):
+        self.lines = []
+        self.window.erase()
+
+    def _draw(self, y, row, width):
+        self.window.move(y, 0)
+        self.window.clrtoeol()
+        x = 0
+        for text, attr in row:
+            if x >= width:
+                break
+            text = text[:width - x]
+            try:
+                self.window.addstr(y, x, text, attr)
+            except curses.error:
+                pass  # Writing the bottom-right cell moves the cursor off screen
+            x += len(text)
+
+    def render(self, lines):
+        height, width = self.window.getmaxyx()
+        previous = self.lines
+        for y, row in enumerate(lines[:height]):
+            if y < len(previous) and previous[y] == row:
+                continue
+            self._draw(y, row, width)
+        # Blank out rows left over from a longer previous frame
+        for y in range(len(lines), min(len(previous), height)):
+            self.window.move(y, 0)
+            self.window.clrtoeol()
+        self.lines = list(lines[:height])
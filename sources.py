@@ -0,0 +1,213 @@
+"""Reading sources shared by the displays and the relay.
+
+Every source has an async generator `events()` yielding (event, data) pairs
+using the realtime API's event names:
+
+    ('connect', None) / ('disconnect', None)   upstream state
+    ('subscribed', {'devices': [...]})          device list and info
+    ('data', lastData)                          one reading, with macAddress
+
+plus ('error', exception) for a failed REST poll and, from FailoverSource,
+('source', 'realtime' | 'rest') whenever it switches between the two.
+Close the generator (e.g. with contextlib.aclosing) to shut a source down.
+"""
+import asyncio
+import json
+import time
+from contextlib import AsyncExitStack, aclosing
+from backfill import API_URL
+from lazy import LazyModule
+from metrics import METRICS
+from poller import RestPoller
+
+socketio = LazyModule('socketio')
+
+REALTIME_URL = 'https://rt2.ambientweather.net/?api=1&applicationKey={app_key}'
+
+
+class RealtimeSource:
+    """Ambient's socket.io realtime API, subscribing every key on one connection"""
+
+    def __init__(self, api_keys, app_key, url=REALTIME_URL, retry_delay=5):
+        self.api_keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
+        self.app_key = app_key
+        self.url = url
+        self.retry_delay = retry_delay
+
+    async def _connect(self, sio, queue):
+        # After the first connection socketio handles reconnects itself
+        while True:
+            try:
+                await sio.connect(self.url.format(app_key=self.app_key),
+                                  transports=['websocket'])
+                return
+            except socketio.exceptions.ConnectionError:
+                queue.put_nowait(('disconnect', None))
+                await asyncio.sleep(self.retry_delay)
+
+    async def events(self):
+        queue = asyncio.Queue()
+        sio = socketio.AsyncClient()
+
+        async def on_connect():
+            queue.put_nowait(('connect', None))
+            await sio.emit('subscribe', {'apiKeys': self.api_keys})
+
+        def on_disconnect(*args):
+            queue.put_nowait(('disconnect', None))
+
+        sio.on('connect', on_connect)
+        sio.on('disconnect', on_disconnect)
+        sio.on('subscribed', lambda data: queue.put_nowait(('subscribed', data)))
+        sio.on('data', lambda data: queue.put_nowait(('data', data)))
+
+        connector = asyncio.create_task(self._connect(sio, queue))
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            connector.cancel()
+            if sio.connected:
+                await sio.disconnect()
+
+
+class RestSource:
+    """The REST API polled with RestPoller, one poller per key"""
+
+    def __init__(self, api_keys, app_key, api_url=API_URL, **poller_options):
+        self.api_keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
+        self.app_key = app_key
+        self.api_url = api_url
+        self.poller_options = poller_options
+
+    async def _pump(self, poller, queue):
+        seen = set()
+        async for device in poller.poll(lambda e: queue.put_nowait(('error', e))):
+            mac_address = device['macAddress']
+            if mac_address not in seen:
+                seen.add(mac_address)
+                queue.put_nowait(('subscribed', {'devices': [device]}))
+            queue.put_nowait(('data', dict(device['lastData'], macAddress=mac_address)))
+
+    async def events(self):
+        queue = asyncio.Queue()
+        async with AsyncExitStack() as stack:
+            tasks = []
+            for api_key in self.api_keys:
+                poller = await stack.enter_async_context(
+                    RestPoller(api_key, self.app_key, self.api_url, **self.poller_options))
+                tasks.append(asyncio.create_task(self._pump(poller, queue)))
+            try:
+                while True:
+                    yield await queue.get()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class RelaySource:
+    """Events re-broadcast by a local relay (see relay.py) on a Unix socket"""
+
+    def __init__(self, path, retry_delay=1):
+        self.path = path
+        self.retry_delay = retry_delay
+
+    async def events(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 20)
+            except OSError:
+                await asyncio.sleep(self.retry_delay)
+                continue
+            try:
+                while True:
+                    raw = await reader.readline()
+                    if not raw:
+                        break
+                    message = json.loads(raw)
+                    yield message.get('event'), message.get('data')
+            except (OSError, ValueError):
+                pass
+            finally:
+                writer.close()
+            yield 'disconnect', None
+            await asyncio.sleep(self.retry_delay)
+
+
+class FailoverSource:
+    """Streams from `primary`, falling back to `fallback` while it's down.
+
+    The fallback starts as soon as the primary reports a disconnect, or after
+    stale_after seconds without a reading from it, which bounds how stale the
+    screen can get. It stops once the primary delivers a reading again.
+    Readings from both are deduplicated by (macAddress, dateutc), so the
+    overlap never shows.
+    """
+
+    def __init__(self, primary, fallback, stale_after=90):
+        self.primary = primary
+        self.fallback = fallback
+        self.stale_after = stale_after
+
+    @staticmethod
+    async def _pump(origin, source, queue):
+        async with aclosing(source.events()) as events:
+            async for event, data in events:
+                queue.put_nowait((origin, event, data))
+
+    async def events(self):
+        queue = asyncio.Queue()
+        primary = asyncio.create_task(self._pump('realtime', self.primary, queue))
+        fallback = None
+        connected = None  # Unknown until the primary says otherwise
+        last_reading = time.monotonic()
+        latest = {}
+        mode = None
+        try:
+            while True:
+                try:
+                    origin, event, data = await asyncio.wait_for(queue.get(), timeout=1)
+                except asyncio.TimeoutError:
+                    origin = event = data = None
+                now = time.monotonic()
+
+                if origin == 'realtime':
+                    if event == 'connect':
+                        connected = True
+                    elif event == 'disconnect':
+                        connected = False
+                    elif event == 'data':
+                        last_reading = now
+
+                healthy = connected is not False and now - last_reading < self.stale_after
+                if not healthy and fallback is None:
+                    METRICS.incr('failovers')
+                    fallback = asyncio.create_task(self._pump('rest', self.fallback, queue))
+                elif healthy and fallback is not None and origin == 'realtime' and event == 'data':
+                    fallback.cancel()
+                    fallback = None
+
+                current = 'realtime' if fallback is None else 'rest'
+                if current != mode:
+                    mode = current
+                    yield 'source', mode
+
+                if event is None:
+                    continue
+                if event == 'data':
+                    key = data.get('macAddress', '')
+                    dateutc = data.get('dateutc')
+                    if dateutc is not None:
+                        if key in latest and dateutc <= latest[key]:
+                            continue  # Already seen from the other source
+                        latest[key] = dateutc
+                elif event in ('connect', 'disconnect') and origin != 'realtime':
+                    continue  # Connection state means the realtime link
+                yield event, data
+        finally:
+            primary.cancel()
+            if fallback is not None:
+                fallback.cancel()
+            await asyncio.gather(primary, *([fallback] if fallback else []),
+                                 return_exceptions=True)
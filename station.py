@@ -0,0 +1,72 @@
+from alerts import derived_values
+from charts import ChartCache
+from extremes import ReadingStats
+from history import HistoryBuffer, HistoryFile, reading_timestamp
+from pressure_trend import PressureTrendAnalyzer
+from tiers import TieredHistory
+from wind import WindAnalyzer
+
+
+class StationState:
+    """Latest reading, history and trend for one device, keyed by MAC address.
+
+    Both displays ingest through add_reading(), so history, trend, statistics,
+    tiers and alerts are fed the same way. `stats` and `tiers` can be turned
+    off where nothing will show them; those attributes are then None.
+    """
+
+    def __init__(self, mac_address, coords=None, name=None, history_path=None,
+                 timezone='America/Chicago', alerts=None, stats=True, tiers=True):
+        self.mac_address = mac_address
+        self.coords = coords
+        self.name = name or mac_address
+        # Latest reading as a layout.Reading record; the payload itself isn't kept
+        self.current = None
+        self.pressure_analyzer = PressureTrendAnalyzer(window_hours=3, min_samples=6)
+        self.history = HistoryBuffer(store=HistoryFile(history_path) if history_path else None)
+        # Warm the trend from stored history so restarts don't start cold
+        self.pressure_analyzer.add_readings(*self.history.series('baromrelin'))
+        self.wind = WindAnalyzer(self.history)
+        # Highs and lows reset at local midnight in the almanac's timezone
+        self.stats = ReadingStats(timezone=timezone) if stats else None
+        # Weeks to years of min/max/mean aggregates beside the raw history
+        self.tiers = None
+        self.charts = None
+        if tiers:
+            self.tiers = TieredHistory(path=history_path + '.tiers' if history_path else None)
+            self.charts = ChartCache(self.tiers)
+        self.warm()
+        # Optional alerts.AlertEngine, fed every new reading
+        self.alerts = alerts
+
+    def warm(self):
+        """Bring statistics and tiers up to the history, e.g. after a backfill"""
+        if self.stats is not None:
+            self.stats.warm(self.history)
+        if self.tiers is not None:
+            self.tiers.warm(self.history)
+
+    def add_reading(self, data, record):
+        """Show a reading, and record it unless it repeats one already had; returns
+        whether it was new (sources resend the latest reading on reconnect)"""
+        self.current = record
+        new = self.history.append(data)
+        if not new:
+            return False
+        timestamp = self.history.last_timestamp()
+        if self.stats is not None:
+            self.stats.add(timestamp, data)
+        if self.tiers is not None:
+            self.tiers.append(data, timestamp)
+        if 'baromrelin' in data:
+            # On the reading's own clock, like the history it's seeded from
+            self.pressure_analyzer.add_reading(data['baromrelin'], reading_timestamp(data))
+        if self.alerts is not None:
+            self.alerts.update(timestamp, data,
+                               derived_values(self.alerts.fields, self.pressure_analyzer))
+        return True
+
+    def close(self):
+        self.history.close()
+        if self.tiers is not None:
+            self.tiers.close()
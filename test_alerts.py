@@ -0,0 +1,92 @@
+from alerts import AlertEngine, Notifier, Rule
+from metrics import METRICS
+
+
+class Recorder:
+    """A notifier that keeps what it's given"""
+
+    def __init__(self):
+        self.alerts = []
+
+    def submit(self, alert):
+        self.alerts.append(alert)
+
+    def statuses(self):
+        return [(alert['rule'], alert['status'], alert['timestamp']) for alert in self.alerts]
+
+
+def engine(*rules):
+    notifier = Recorder()
+    return AlertEngine(rules, notifier, station='Home'), notifier
+
+
+def feed(engine, field, values, interval=60):
+    for i, value in enumerate(values):
+        engine.update(i * interval, {field: value})
+
+
+def test_clears_only_past_the_clear_level():
+    alerts, notifier = engine(Rule('Gusty', 'windgustmph', above=35, clear=25))
+    # Hovering between the clear level and the threshold doesn't flap
+    feed(alerts, 'windgustmph', [30, 36, 30, 36, 26, 36, 24, 30])
+    assert notifier.statuses() == [('Gusty', 'fired', 60)]
+    assert alerts.active() == []
+    alerts.update(600, {'windgustmph': 40})
+    assert [rule.name for rule, value in alerts.active()] == ['Gusty']
+
+
+def test_fires_once_breached_for_the_duration():
+    alerts, notifier = engine(Rule('Freezing', 'tempf', below=32, clear=34, duration=600))
+    # Breached at 0, back above at 300 (resetting the clock), breached again from 420
+    for timestamp, value in [(0, 31), (240, 30), (300, 33), (420, 31), (900, 30), (1020, 29)]:
+        alerts.update(timestamp, {'tempf': value})
+    assert notifier.statuses() == [('Freezing', 'fired', 1020)]
+
+
+def test_cooldown_suppresses_then_fires_again():
+    alerts, notifier = engine(Rule('Gusty', 'windgustmph', above=35, cooldown=3600))
+    for timestamp, value in [(0, 40), (60, 30), (120, 40), (180, 30), (3600, 40)]:
+        alerts.update(timestamp, {'windgustmph': value})
+    # The breach at 120 was within the cooldown; the one at 3600 isn't
+    assert notifier.statuses() == [('Gusty', 'fired', 0), ('Gusty', 'fired', 3600)]
+
+
+def test_notify_clear():
+    alerts, notifier = engine(Rule('Gusty', 'windgustmph', above=35, notify_clear=True),
+                              Rule('Windy', 'windgustmph', above=30))
+    for timestamp, value in [(0, 40), (60, 20), (120, 40), (180, 20)]:
+        alerts.update(timestamp, {'windgustmph': value})
+    # A breach that wasn't announced (in cooldown) doesn't announce clearing either
+    assert notifier.statuses() == [('Gusty', 'fired', 0), ('Windy', 'fired', 0),
+                                   ('Gusty', 'cleared', 60)]
+    assert notifier.alerts[2]['message'] == "Home: Gusty (windgustmph 20) cleared"
+
+
+def test_rate_rule_uses_change_per_hour_over_the_window():
+    alerts, notifier = engine(Rule('Temperature jump', 'tempf', rate=1800, above=8))
+    # A jump within the first half of the window says nothing yet
+    feed(alerts, 'tempf', [50, 60, 50, 50, 55], interval=300)
+    assert notifier.statuses() == [('Temperature jump', 'fired', 1200)]
+    # 5°F over the 1200s since the first sample
+    assert notifier.alerts[0]['value'] == 15.0
+    # Samples older than the window drop out: 55 -> 55 over 1800s
+    alerts.update(3000, {'tempf': 55})
+    assert alerts.active() == []
+
+
+def test_derived_fields():
+    alerts, notifier = engine(Rule('Pressure falling fast', 'pressure_rate', below=-0.06))
+    alerts.update(0, {'tempf': 50}, {'pressure_rate': -0.07})
+    alerts.update(60, {'tempf': 50}, None)
+    assert notifier.statuses() == [('Pressure falling fast', 'fired', 0)]
+    assert alerts.fields == {'pressure_rate'}
+
+
+def test_submit_drops_alerts_when_the_queue_is_full():
+    notifier = Notifier(max_queue=2)
+    dropped = METRICS.count('alerts_dropped')
+    for i in range(5):
+        notifier.submit({'rule': str(i)})
+    assert notifier.queue.qsize() == 2
+    assert [notifier.queue.get_nowait()['rule'] for _ in range(2)] == ['0', '1']
+    assert METRICS.count('alerts_dropped') - dropped == 3
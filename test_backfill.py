@@ -0,0 +1,223 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import backfill as backfill_module
+from backfill import PAGE_LIMIT, HistoryFetcher, RateLimiter, backfill
+from history import HistoryBuffer
+from pressure_trend import PressureTrendAnalyzer
+from replay import synthetic_payloads
+
+MAC = '00:0E:C6:20:0F:7B'
+
+
+def recording(hours, end=None, interval=60):
+    """A minute-by-minute run of lastData payloads ending at `end`, oldest first"""
+    end = end or time.time()
+    count = int(hours * 3600 / interval)
+    payloads = synthetic_payloads(count)
+    return [dict(payload, dateutc=int((end - (count - i) * interval) * 1000))
+            for i, payload in enumerate(payloads)]
+
+
+class StandIn:
+    """Serves a recording the way the REST API pages it: newest first, `limit` at
+    a time, each page ending at `endDate` inclusive, so page boundaries repeat
+    a reading. The first `rate_limited` requests get a 429."""
+
+    def __init__(self, readings, rate_limited=0):
+        self.readings = sorted(readings, key=lambda r: r['dateutc'], reverse=True)
+        self.rate_limited = rate_limited
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                stand_in.requests.append((url.path, params))
+                if stand_in.rate_limited:
+                    stand_in.rate_limited -= 1
+                    self.send_error(429)
+                    return
+                if url.path == '/v1/devices':
+                    body = [{'macAddress': MAC, 'info': {'name': 'Backyard'}}]
+                elif url.path == f'/v1/devices/{MAC}':
+                    body = stand_in.page(int(params['limit']), params.get('endDate'))
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def page(self, limit, end_date=None):
+        readings = self.readings
+        if end_date is not None:
+            readings = [r for r in readings if r['dateutc'] <= int(end_date)]
+        return readings[:limit]
+
+    def device_requests(self):
+        return [params for path, params in self.requests if path != '/v1/devices']
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(readings, rate_limited=0):
+        servers.append(StandIn(readings, rate_limited))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def fetcher_for(server):
+    # No spacing between requests; the stand-in has no rate limit of its own
+    return HistoryFetcher('api', 'app', server.url, rate_limiter=RateLimiter(0))
+
+
+def test_readings_follow_end_date_back_across_pages(serve):
+    # Twelve hours of minute readings is 720, i.e. three pages of 288
+    readings = recording(12)
+    server = serve(readings)
+    fetcher = fetcher_for(server)
+    fetched = fetcher.readings(MAC, since=0)
+    fetcher.close()
+
+    requests = server.device_requests()
+    assert len(requests) == 3
+    assert 'endDate' not in requests[0]
+    for previous, request in zip(requests, requests[1:]):
+        page = server.page(PAGE_LIMIT, previous.get('endDate'))
+        assert int(request['endDate']) == min(r['dateutc'] for r in page)
+    assert all(request['apiKey'] == 'api' and request['applicationKey'] == 'app'
+               for request in requests)
+
+    timestamps = [r['dateutc'] for r in fetched]
+    assert timestamps == sorted(timestamps)
+    assert set(timestamps) == {r['dateutc'] for r in readings}
+
+
+def test_page_boundary_repeats_are_stored_once(serve):
+    readings = recording(12)
+    server = serve(readings)
+    fetcher = fetcher_for(server)
+    fetched = fetcher.readings(MAC, since=0)
+    # Each page starts with the reading the previous one ended on
+    assert len(fetched) == len(readings) + 2
+
+    history = HistoryBuffer(capacity=10000)
+    added = backfill(fetcher, history, PressureTrendAnalyzer(), hours=24, mac_address=MAC)
+    fetcher.close()
+    assert [r['dateutc'] for r in added] == [r['dateutc'] for r in readings]
+    assert len(history) == len(readings)
+
+
+def test_stops_at_since(serve):
+    end = time.time()
+    readings = recording(12, end)
+    server = serve(readings)
+    fetcher = fetcher_for(server)
+    since = end - 5 * 3600 - 30
+    fetched = fetcher.readings(MAC, since)
+    fetcher.close()
+
+    # Nothing at or before `since`, and everything after it
+    assert sorted({r['dateutc'] for r in fetched}) == [r['dateutc'] for r in readings
+                                                       if r['dateutc'] / 1000 > since]
+    # Five hours is 300 readings: the second page crosses `since`, so no third
+    assert len(server.device_requests()) == 2
+
+
+def test_stops_when_the_api_stops_going_back(serve):
+    readings = recording(12)
+    server = serve(readings)
+    # Every page is the newest one, whatever endDate asks for
+    server.page = lambda limit, end_date=None: server.readings[:limit]
+    fetcher = fetcher_for(server)
+    fetched = fetcher.readings(MAC, since=0)
+    fetcher.close()
+    assert len(server.device_requests()) == 2
+    assert len({r['dateutc'] for r in fetched}) == PAGE_LIMIT
+
+
+def test_retries_after_429(serve, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(backfill_module.time, 'sleep', sleeps.append)
+    readings = recording(2)
+    server = serve(readings, rate_limited=2)
+    fetcher = fetcher_for(server)
+    fetched = fetcher.readings(MAC, since=0)
+    fetcher.close()
+
+    assert len(fetched) == len(readings)
+    assert len(server.requests) == 3
+    assert server.requests[0] == server.requests[2]  # The same page again
+    assert sleeps == [1, 2]  # Backing off between attempts
+
+
+def test_gives_up_after_retries(serve, monkeypatch):
+    monkeypatch.setattr(backfill_module.time, 'sleep', lambda seconds: None)
+    server = serve(recording(1), rate_limited=10)
+    fetcher = HistoryFetcher('api', 'app', server.url, rate_limiter=RateLimiter(0), retries=2)
+    with pytest.raises(backfill_module.requests.exceptions.HTTPError):
+        fetcher.readings(MAC, since=0)
+    fetcher.close()
+    assert len(server.requests) == 3
+
+
+def test_backfill_feeds_history_and_trend(serve):
+    end = time.time()
+    readings = recording(6, end)
+    server = serve(readings)
+    fetcher = fetcher_for(server)
+    history = HistoryBuffer(capacity=10000)
+    analyzer = PressureTrendAnalyzer(window_hours=3)
+    added = backfill(fetcher, history, analyzer, hours=3)
+    fetcher.close()
+
+    # The first device on the key, and only the last three hours
+    assert server.requests[0][0] == '/v1/devices'
+    wanted = [r for r in readings if r['dateutc'] / 1000 > end - 3 * 3600]
+    assert added == wanted
+    assert len(history) == len(wanted)
+    assert history.last_timestamp() == wanted[-1]['dateutc'] / 1000
+    assert list(analyzer.pressure_history) == [(r['dateutc'] / 1000, r['baromrelin']) for r in wanted]
+    assert analyzer.get_trend()[0] != "INSUFFICIENT_DATA"
+
+
+def test_backfill_only_asks_for_what_history_lacks(serve):
+    end = time.time()
+    readings = recording(3, end)
+    server = serve(readings)
+    history = HistoryBuffer(capacity=10000)
+    for reading in readings[:-30]:
+        history.append(reading)
+
+    fetcher = fetcher_for(server)
+    added = backfill(fetcher, history, PressureTrendAnalyzer(), hours=3, mac_address=MAC)
+    fetcher.close()
+    assert added == readings[-30:]
+    assert len(history) == len(readings)
+    assert len(server.device_requests()) == 1
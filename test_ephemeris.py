@@ -0,0 +1,20 @@
+from ephemeris import check
+
+# realtime.py's default location
+LATITUDE, LONGITUDE = 35.772846, -86.46821
+
+
+def test_solar_position_matches_pyephem():
+    errors = check(LATITUDE, LONGITUDE, samples=500)
+    assert errors['max_elevation_error_deg'] < 0.02
+    assert errors['max_apparent_error_deg'] < 0.02
+    assert errors['max_azimuth_error_deg'] < 0.05
+
+
+def test_elevation_matches_pyephem_anywhere():
+    # Azimuth is ill-conditioned near the zenith, so only elevation is held
+    # to the same bound from the equator to the poles
+    for lat, lon in ((0, 0), (-45, 170), (70, -150)):
+        errors = check(lat, lon, samples=200, seed=1)
+        assert errors['max_elevation_error_deg'] < 0.02
+        assert errors['max_apparent_error_deg'] < 0.02
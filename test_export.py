@@ -0,0 +1,41 @@
+import asyncio
+import csv
+
+from export import ExportSink, export_fields
+from history import HISTORY_FIELDS
+from layout import LAYOUT, Layout
+from replay import synthetic_payloads
+
+
+def export(path, payloads, **kwargs):
+    async def run():
+        sink = ExportSink(str(path), **kwargs)
+        task = asyncio.create_task(sink.run())
+        for payload in payloads:
+            sink.submit(payload)
+        # Closed before run() has had a turn; the batch must still be written
+        sink.close()
+        await task
+
+    asyncio.run(run())
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_csv_columns_include_the_layouts_fields(tmp_path):
+    layout = Layout({'soiltemp1f': ('°F', '.1f', False)}, list(LAYOUT) + [('Soil', '{soiltemp1f}')])
+    fields = export_fields(layout)
+    assert fields[:len(HISTORY_FIELDS)] == HISTORY_FIELDS and 'soiltemp1f' in fields
+    payloads = [dict(payload, dateutc=i * 60000, soiltemp1f=61.5)
+                for i, payload in enumerate(synthetic_payloads(3), 1)]
+    rows = export(tmp_path / 'weather.csv', payloads, fields=fields)
+    assert [row['dateutc'] for row in rows] == ['60000', '120000', '180000']
+    assert all(row['soiltemp1f'] == '61.5' for row in rows)
+    assert list(rows[0])[-2:] == ['pressure_trend', 'pressure_rate']
+
+
+def test_default_columns_are_the_history_fields(tmp_path):
+    payloads = [dict(payload, dateutc=60000, soiltemp1f=61.5) for payload in synthetic_payloads(1)]
+    rows = export(tmp_path / 'weather.csv', payloads)
+    assert list(rows[0]) == ['dateutc', 'macAddress', *HISTORY_FIELDS, 'pressure_trend',
+                             'pressure_rate']
@@ -0,0 +1,57 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from extremes import ReadingStats, stats_lines
+
+TIMEZONE = ZoneInfo('America/Chicago')
+
+
+def at(*args):
+    return datetime(*args, tzinfo=TIMEZONE).timestamp()
+
+
+def text(lines):
+    return '\n'.join(''.join(segment for segment, _ in row) for row in lines)
+
+
+def fed(start, count, interval=60):
+    stats = ReadingStats(timezone=TIMEZONE)
+    for i in range(count):
+        stats.add(start + i * interval, {'tempf': 50.0 + i % 10, 'humidity': 60})
+    return stats
+
+
+def test_today_rolls_over_when_the_feed_stalls_past_midnight():
+    # Readings until 23:00, then nothing
+    stats = fed(at(2026, 3, 10, 21), 120)
+    assert 'Temperature | 59.0 at' in text(stats_lines(stats, at(2026, 3, 10, 23, 30)))
+    lines = text(stats_lines(stats, at(2026, 3, 11, 0, 5)))
+    assert 'Temperature | -' in lines
+    assert stats.daily.date == datetime(2026, 3, 11).date()
+
+
+def test_rolling_windows_expire_when_the_feed_stalls():
+    stats = fed(at(2026, 3, 10, 21), 120)
+    hour, day, week = stats.rolling['tempf']
+    stats_lines(stats, at(2026, 3, 10, 23) + 2 * 3600)
+    assert (hour.min, hour.mean, hour.max) == (None, None, None)
+    assert day.max == 59.0 and week.max == 59.0
+    stats_lines(stats, at(2026, 3, 12, 0))
+    assert day.mean is None and week.mean is not None
+
+
+def test_refresh_behind_the_readings_changes_nothing():
+    # A wall clock behind the station's must not drop today or the windows
+    stats = fed(at(2026, 3, 10, 23), 120)
+    stats.refresh(at(2026, 3, 10, 23, 30))
+    assert stats.daily.date == datetime(2026, 3, 11).date()
+    assert stats.daily.high['tempf'][0] == 59.0
+    assert stats.rolling['tempf'][0].max == 59.0
+
+
+def test_late_reading_from_yesterday_is_ignored_after_rollover():
+    stats = fed(at(2026, 3, 10, 21), 120)
+    stats.refresh(at(2026, 3, 11, 0, 5))
+    stats.daily.add(at(2026, 3, 10, 23, 59), {'tempf': 70.0})
+    assert stats.daily.date == datetime(2026, 3, 11).date()
+    assert 'tempf' not in stats.daily.high
@@ -0,0 +1,96 @@
+import random
+import time
+
+import numpy as np
+import pytest
+
+from pressure_trend import PressureTrendAnalyzer
+
+TOLERANCE = 1e-9  # inHg/hr, as promised in PressureTrendAnalyzer's docstring
+
+
+def jittered(count, start, interval=5, seed=0):
+    """(timestamp, pressure) pairs every ~interval seconds with a slow trend and noise"""
+    rng = random.Random(seed)
+    readings = []
+    timestamp = start
+    for i in range(count):
+        timestamp += interval + rng.uniform(-1, 1)
+        readings.append((timestamp, 29.92 - 0.03 * (timestamp - start) / 3600 + rng.gauss(0, 0.002)))
+    return readings
+
+
+def polyfit_slope(samples):
+    times = np.array([timestamp for timestamp, _ in samples]) / 3600
+    pressures = np.array([pressure for _, pressure in samples])
+    return np.polyfit(times, pressures, 1)[0]
+
+
+def test_slope_matches_polyfit():
+    analyzer = PressureTrendAnalyzer(window_hours=3)
+    readings = jittered(2000, time.time() - 2000 * 5)
+    for timestamp, pressure in readings:
+        analyzer.add_reading(pressure, timestamp)
+    assert len(analyzer.pressure_history) == 2000
+    assert analyzer.get_slope() == pytest.approx(polyfit_slope(readings), abs=TOLERANCE)
+
+
+def test_slope_matches_polyfit_as_readings_expire():
+    # Ten hours through a three hour window: readings age out continually and
+    # the sums are rebased on a newer first sample more than once
+    analyzer = PressureTrendAnalyzer(window_hours=3)
+    readings = jittered(7200, 1.7e9)
+    rebased = set()
+    for i, (timestamp, pressure) in enumerate(readings):
+        analyzer.add_reading(pressure, timestamp)
+        rebased.add(analyzer._t0)
+        if i % 500 == 499:
+            window = [(t, p) for t, p in readings[:i + 1] if t >= timestamp - 3 * 3600]
+            assert list(analyzer.pressure_history) == window
+            assert analyzer.get_slope() == pytest.approx(polyfit_slope(window), abs=TOLERANCE)
+    assert len(rebased) > 2
+
+
+def test_max_samples_evicts_oldest():
+    analyzer = PressureTrendAnalyzer(window_hours=3, max_samples=100)
+    readings = jittered(1000, 1.7e9)
+    for timestamp, pressure in readings:
+        analyzer.add_reading(pressure, timestamp)
+    assert list(analyzer.pressure_history) == readings[-100:]
+    assert analyzer.get_slope() == pytest.approx(polyfit_slope(readings[-100:]), abs=TOLERANCE)
+
+
+def test_window_is_not_capped_by_default():
+    # Three days of 5 second readings all stay in a 72 hour window
+    analyzer = PressureTrendAnalyzer(window_hours=72)
+    readings = jittered(3 * 17280 - 100, time.time() - 3 * 86400)
+    for timestamp, pressure in readings:
+        analyzer.add_reading(pressure, timestamp)
+    assert len(analyzer.pressure_history) == len(readings)
+    assert analyzer.get_slope() == pytest.approx(polyfit_slope(readings), abs=TOLERANCE)
+
+
+def test_expiring_everything_resets():
+    analyzer = PressureTrendAnalyzer(window_hours=1)
+    for timestamp, pressure in jittered(100, 1.7e9):
+        analyzer.add_reading(pressure, timestamp)
+    analyzer._expire(1.7e9 + 10 * 3600)
+    assert not analyzer.pressure_history
+    assert analyzer.get_slope() is None
+    analyzer.add_reading(29.9, 1.7e9 + 10 * 3600)
+    analyzer.add_reading(30.0, 1.7e9 + 11 * 3600)
+    assert analyzer.get_slope() == pytest.approx(0.1, abs=TOLERANCE)
+
+
+def test_trend_categories():
+    now = time.time()
+    falling = PressureTrendAnalyzer()
+    steady = PressureTrendAnalyzer()
+    for i in range(36):
+        timestamp = now - (36 - i) * 300
+        falling.add_reading(30.0 - 0.05 * i * 300 / 3600, timestamp)
+        steady.add_reading(30.0, timestamp)
+    trend, rate = falling.get_trend()
+    assert trend == "FALLING" and rate == pytest.approx(-0.05)
+    assert steady.get_trend()[0] == "STEADY"
+    assert PressureTrendAnalyzer().get_trend() == ("INSUFFICIENT_DATA", 0)
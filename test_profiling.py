@@ -0,0 +1,23 @@
+import os
+import time
+import tracemalloc
+from collections import Counter
+
+from profiling import INTERVAL_FILES, Profiler
+
+
+def test_keeps_the_first_interval_and_the_last_few(tmp_path):
+    profiler = Profiler(str(tmp_path), keep=2)
+    try:
+        profiler._mark = (time.time(), time.process_time(), 0)
+        for i in range(6):
+            profiler.write(Counter(), (time.time(), time.process_time(), i * 100))
+    finally:
+        tracemalloc.stop()
+
+    for kind, extension in INTERVAL_FILES:
+        kept = sorted(name for name in os.listdir(tmp_path)
+                      if name.startswith(kind) and name.endswith('.' + extension))
+        assert kept == [f"{kind}-{index:04d}.{extension}" for index in (1, 5, 6)]
+    with open(tmp_path / 'summary.tsv', encoding='utf-8') as f:
+        assert len(f.readlines()) == 7
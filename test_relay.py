@@ -0,0 +1,177 @@
+import asyncio
+import json
+import socket
+
+from relay import Relay
+from replay import ReplayServer, synthetic_payloads
+from sources import RestSource
+
+MAC = '00:00:00:00:00:01'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def reading(dateutc, **fields):
+    return dict(synthetic_payloads(1)[0], macAddress=MAC, dateutc=dateutc, **fields)
+
+
+class StubSource:
+    """An upstream that plays a script of events once `go` is set, then idles"""
+
+    def __init__(self, script, delay=0.0):
+        self.script = script
+        self.delay = delay
+        self.go = asyncio.Event()
+
+    async def events(self):
+        await self.go.wait()
+        for event in self.script:
+            yield event
+            await asyncio.sleep(self.delay)
+        await asyncio.Event().wait()
+
+
+async def subscribe(path):
+    for _ in range(100):
+        try:
+            return await asyncio.open_unix_connection(path, limit=2 ** 20)
+        except OSError:
+            await asyncio.sleep(0.01)  # Not listening yet
+    raise TimeoutError(path)
+
+
+async def messages(reader, until, timeout=5):
+    """Messages from the relay until `until(messages)` holds, or EOF"""
+    received = []
+
+    async def read():
+        while not until(received):
+            raw = await reader.readline()
+            if not raw:
+                break
+            received.append(json.loads(raw))
+
+    await asyncio.wait_for(read(), timeout)
+    return received
+
+
+def data_events(received):
+    return [message['data']['dateutc'] for message in received if message['event'] == 'data']
+
+
+def stop(task):
+    task.cancel()
+    return asyncio.gather(task, return_exceptions=True)
+
+
+def test_fans_out_one_upstream_to_every_subscriber(tmp_path):
+    # Readings from the replay server's REST endpoints, relayed to three displays
+    async def run():
+        server = ReplayServer(synthetic_payloads(), rate=50, port=free_port())
+        await server.start()
+        source = RestSource(['key'], 'app', server.url + '/v1', interval=0.02, lag=0,
+                            min_delay=0.02)
+        relay = Relay(['key'], 'app', str(tmp_path / 'relay.sock'), source=source)
+        task = asyncio.create_task(relay.run())
+        clients = [await subscribe(relay.path) for _ in range(3)]
+        received = await asyncio.gather(*(messages(reader, lambda m: len(data_events(m)) >= 20)
+                                          for reader, _ in clients))
+        await stop(task)
+        await server.stop()
+        return received
+
+    received = asyncio.run(run())
+    streams = [data_events(messages) for messages in received]
+    for stream in streams:
+        assert stream == sorted(set(stream))
+    # Where they overlap, every subscriber saw the same readings
+    first = streams[0]
+    for stream in streams[1:]:
+        assert ([d for d in first if stream[0] <= d <= stream[-1]]
+                == [d for d in stream if first[0] <= d <= first[-1]])
+    assert all(messages[0]['event'] in ('subscribed', 'data') for messages in received)
+
+
+def test_drops_a_subscriber_that_falls_behind(tmp_path):
+    # Big readings, so the one that never reads fills its socket and then its queue
+    script = [('connect', None)] + [('data', reading(i, padding='x' * 4096)) for i in range(1, 501)]
+
+    async def run():
+        source = StubSource(script, delay=0.001)
+        relay = Relay([], '', str(tmp_path / 'relay.sock'), max_queue=8, source=source)
+        task = asyncio.create_task(relay.run())
+        fast = await subscribe(relay.path)
+        # A plain socket, unlike a StreamReader, doesn't read ahead on its own
+        loop = asyncio.get_running_loop()
+        slow = socket.socket(socket.AF_UNIX)
+        slow.setblocking(False)
+        await loop.sock_connect(slow, relay.path)
+        await asyncio.sleep(0.05)
+        assert len(relay.subscribers) == 2
+        source.go.set()
+        received = await messages(fast[0], lambda m: len(data_events(m)) == 500, timeout=10)
+        subscribers = len(relay.subscribers)
+        await stop(task)
+        # The slow one got what fitted in its socket, then EOF
+        leftover = b''
+        while chunk := await asyncio.wait_for(loop.sock_recv(slow, 65536), 5):
+            leftover += chunk
+        slow.close()
+        return received, subscribers, leftover
+
+    received, subscribers, leftover = asyncio.run(run())
+    assert data_events(received) == list(range(1, 501))
+    assert subscribers == 1
+    assert 0 < leftover.count(b'\n') < 500
+
+
+def test_relays_each_reading_once(tmp_path):
+    # The realtime API resends the latest reading after a reconnect
+    script = [('connect', None), ('subscribed', {'devices': [{'macAddress': MAC}]}),
+              ('data', reading(1000)), ('data', reading(1000)), ('data', reading(2000)),
+              ('disconnect', None), ('connect', None),
+              ('data', reading(2000)), ('data', reading(1500)), ('data', reading(3000))]
+
+    async def run():
+        source = StubSource(script)
+        relay = Relay([], '', str(tmp_path / 'relay.sock'), source=source)
+        task = asyncio.create_task(relay.run())
+        reader, _ = await subscribe(relay.path)
+        await asyncio.sleep(0.05)
+        source.go.set()
+        received = await messages(reader, lambda m: 3000 in data_events(m))
+        # A late subscriber is caught up with the state and the latest reading
+        late, _ = await subscribe(relay.path)
+        caught_up = await messages(late, lambda m: len(m) == 3)
+        await stop(task)
+        return received, caught_up
+
+    received, caught_up = asyncio.run(run())
+    assert data_events(received) == [1000, 2000, 3000]
+    assert [m['event'] for m in received] == ['connect', 'subscribed', 'data', 'data',
+                                              'disconnect', 'connect', 'data']
+    assert [m['event'] for m in caught_up] == ['connect', 'subscribed', 'data']
+    assert data_events(caught_up) == [3000]
+
+
+def test_stop_closes_subscribers_and_their_tasks(tmp_path):
+    async def run():
+        relay = Relay([], '', str(tmp_path / 'relay.sock'), source=StubSource([]))
+        task = asyncio.create_task(relay.run())
+        clients = [await subscribe(relay.path) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        handlers = set(relay.clients)
+        await stop(task)
+        eof = [await asyncio.wait_for(reader.read(), 5) for reader, _ in clients]
+        return relay, handlers, eof
+
+    relay, handlers, eof = asyncio.run(run())
+    assert len(handlers) == 3 and all(handler.done() for handler in handlers)
+    assert all(not handler.cancelled() for handler in handlers)
+    assert not relay.clients and not relay.subscribers
+    assert eof == [b''] * 3
+    assert not (tmp_path / 'relay.sock').exists()
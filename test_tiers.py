@@ -0,0 +1,31 @@
+from tiers import TieredHistory
+
+HOUR = 3600
+
+
+def fed(count, interval, start=1_000_000):
+    tiers = TieredHistory(fields=('tempf',))
+    for i in range(count):
+        tiers.append({'tempf': float(i)}, start + i * interval)
+    return tiers, start + (count - 1) * interval
+
+
+def test_raw_rows_cover_only_the_last_raw_seconds():
+    # At one reading every 5 seconds the raw buffer holds five hours of rows
+    tiers, newest = fed(2 * HOUR // 5, 5)
+    timestamps, mean, low, high, count = tiers.query('tempf', newest - HOUR)
+    assert len(timestamps) == HOUR // 5 + 1 and (count == 1).all()
+    assert timestamps[0] == newest - HOUR
+    # Further back than raw_seconds is the 1 minute tier's
+    timestamps, mean, low, high, count = tiers.query('tempf', newest - HOUR - 60)
+    assert (timestamps % 60 == 0).all() and count.max() == 12
+
+
+def test_fast_feed_falls_back_to_the_minute_tier():
+    # Twice a second fills the raw buffer with half an hour
+    tiers, newest = fed(2 * HOUR, 0.5)
+    timestamps, mean, low, high, count = tiers.query('tempf', newest - 20 * 60)
+    assert (count == 1).all() and timestamps[0] == newest - 20 * 60
+    timestamps, mean, low, high, count = tiers.query('tempf', newest - HOUR)
+    assert (timestamps % 60 == 0).all() and count.max() == 120
+    assert timestamps[0] <= newest - HOUR
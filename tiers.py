@@ -0,0 +1,250 @@
+import json
+import os
+from lazy import LazyModule
+from history import HISTORY_FIELDS, HistoryBuffer, reading_timestamp
+
+np = LazyModule('numpy')
+
+# (bucket seconds, seconds kept) for each aggregate tier, finest first
+TIERS = (
+    (60, 7 * 24 * 3600),
+    (600, 60 * 24 * 3600),
+    (3600, 2 * 365 * 24 * 3600),
+)
+
+# Seconds of raw rows kept, capped at one row a second (a faster feed's cover less)
+RAW_SECONDS = 3600
+
+
+def rollup(resolution, starts, counts, totals, lows, highs):
+    """Combine consecutive buckets (sorted by start) into `resolution` second buckets"""
+    if len(starts) == 0:
+        return starts, counts, totals, lows, highs
+    starts = starts - starts % resolution
+    first = np.flatnonzero(np.r_[True, np.diff(starts) != 0])
+    return (starts[first],
+            np.add.reduceat(counts, first),
+            np.add.reduceat(totals, first),
+            np.fmin.reduceat(lows, first),
+            np.fmax.reduceat(highs, first))
+
+
+class Tier:
+    """Fixed-size ring of min/max/sum/count buckets at one resolution.
+
+    The ring is addressed by time: a bucket starting at t lives in slot
+    (t // resolution) % capacity, so adding a sample is a single in-place
+    update, a range query is one gather, and a slot still holding an older
+    bucket is recognised by its start time and recycled.
+    """
+
+    def __init__(self, fields, resolution, retention):
+        self.resolution = resolution
+        self.retention = retention
+        self.capacity = retention // resolution
+        width = len(fields)
+        self.starts = np.full(self.capacity, np.nan)
+        self.counts = np.zeros((self.capacity, width), dtype=np.int32)
+        self.totals = np.zeros((self.capacity, width), dtype=np.float64)
+        self.lows = np.zeros((self.capacity, width), dtype=np.float32)
+        self.highs = np.zeros((self.capacity, width), dtype=np.float32)
+
+    def _slot(self, start):
+        slot = int(start // self.resolution) % self.capacity
+        if self.starts[slot] != start:
+            self.starts[slot] = start
+            self.counts[slot] = 0
+            self.totals[slot] = 0
+            self.lows[slot] = np.inf
+            self.highs[slot] = -np.inf
+        return slot
+
+    def add(self, timestamp, row):
+        """Merge one row of values (NaN where missing) into its bucket"""
+        slot = self._slot(timestamp - timestamp % self.resolution)
+        present = ~np.isnan(row)
+        self.counts[slot] += present
+        self.totals[slot] += np.where(present, row, 0)
+        np.fmin(self.lows[slot], row, out=self.lows[slot])
+        np.fmax(self.highs[slot], row, out=self.highs[slot])
+
+    def merge(self, starts, counts, totals, lows, highs):
+        """Merge finer buckets (or raw rows as one-sample buckets), oldest first.
+
+        Returns this tier's buckets for all of the input, whether or not
+        they're still within retention, for rolling up into the next tier.
+        """
+        buckets = rollup(self.resolution, starts, counts, totals, lows, highs)
+        starts, counts, totals, lows, highs = buckets
+        if len(starts) == 0:
+            return buckets
+        keep = starts > starts[-1] - self.retention
+        starts, counts, totals, lows, highs = (a[keep] for a in buckets)
+
+        # Within one retention period every bucket has a slot of its own
+        slots = (starts // self.resolution).astype(np.int64) % self.capacity
+        merge = self.starts[slots] == starts
+        fresh = slots[~merge]
+        self.starts[fresh] = starts[~merge]
+        self.counts[fresh] = counts[~merge]
+        self.totals[fresh] = totals[~merge]
+        self.lows[fresh] = lows[~merge]
+        self.highs[fresh] = highs[~merge]
+        if merge.any():
+            merged = slots[merge]
+            self.counts[merged] += counts[merge]
+            self.totals[merged] += totals[merge]
+            self.lows[merged] = np.fmin(self.lows[merged], lows[merge])
+            self.highs[merged] = np.fmax(self.highs[merged], highs[merge])
+        return buckets
+
+    def query(self, column, start, end):
+        """Return (bucket starts, mean, low, high, count) for buckets in [start, end)"""
+        first = start - start % self.resolution
+        count = min(int(np.ceil((end - first) / self.resolution)), self.capacity)
+        expected = first + np.arange(max(count, 0)) * self.resolution
+        slots = (expected // self.resolution).astype(np.int64) % self.capacity
+        counts = self.counts[slots, column]
+        live = (self.starts[slots] == expected) & (counts > 0)
+        slots, counts = slots[live], counts[live]
+        with np.errstate(invalid='ignore'):
+            mean = self.totals[slots, column] / counts
+        return expected[live], mean, self.lows[slots, column], self.highs[slots, column], counts
+
+
+class TieredHistory:
+    """Months of readings in fixed memory.
+
+    Raw rows are kept for the last `raw_seconds`, up to one a second: the
+    buffer holds `raw_seconds` rows, so a faster feed's cover less, and a
+    query they don't reach back far enough for is answered from the 1 minute
+    tier instead. Every reading is also merged into 1 minute, 10 minute and
+    hourly aggregate tiers (min, max, mean and count per field), each a
+    fixed-size ring covering its retention period, so older data survives as
+    progressively coarser summaries. That's about 12 MB for the default
+    tiers, and O(1) work per reading.
+
+    With `path`, the tiers are saved there on close() and loaded back at
+    startup. warm() fills in anything newer from a raw HistoryBuffer, e.g.
+    readings from the history file written since the last save.
+    """
+
+    def __init__(self, fields=HISTORY_FIELDS, raw_seconds=RAW_SECONDS, tiers=TIERS, path=None):
+        if any(coarse % fine for (fine, _), (coarse, _) in zip(tiers, tiers[1:])):
+            raise ValueError("each tier's resolution must be a multiple of the one before")
+        self.fields = tuple(fields)
+        self._index = {field: i for i, field in enumerate(self.fields)}
+        self.raw_seconds = raw_seconds
+        self.raw = HistoryBuffer(self.fields, capacity=raw_seconds)
+        self.tiers = [Tier(self.fields, resolution, retention) for resolution, retention in tiers]
+        self.path = path
+        self.last_timestamp = None
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def append(self, reading, timestamp=None):
+        """Add a lastData dict; returns False for duplicate or out-of-order readings"""
+        if timestamp is None:
+            timestamp = reading_timestamp(reading)
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return False
+        self.raw.append(reading, timestamp)
+        row = self.raw.values[-1]
+        for tier in self.tiers:
+            tier.add(timestamp, row)
+        self.last_timestamp = timestamp
+        return True
+
+    def warm(self, history):
+        """Merge rows from a HistoryBuffer newer than anything already here"""
+        # The raw rows aren't saved, so refill the last hour after a restart
+        self.raw.extend(*self._align(history, *history.window(self.raw_seconds)))
+        timestamps, values = history.window(since=self.last_timestamp)
+        if self.last_timestamp is not None:
+            newer = timestamps > self.last_timestamp
+            timestamps, values = timestamps[newer], values[newer]
+        if len(timestamps) == 0:
+            return 0
+        timestamps, values = self._align(history, timestamps, values)
+        # Each tier is rolled up from the one below, so only the finest
+        # looks at every row
+        present = ~np.isnan(values)
+        buckets = (timestamps, present.astype(np.int32),
+                   np.where(present, values, 0).astype(np.float64), values, values)
+        for tier in self.tiers:
+            buckets = tier.merge(*buckets)
+        self.last_timestamp = float(timestamps[-1])
+        return len(timestamps)
+
+    def _align(self, history, timestamps, values):
+        # Rearrange another buffer's columns into our field order
+        if history.fields == self.fields:
+            return timestamps, values
+        columns = [values[:, history.fields.index(field)] if field in history.fields
+                   else np.full(len(timestamps), np.nan, dtype=np.float32)
+                   for field in self.fields]
+        return timestamps, np.stack(columns, axis=1) if columns else values[:, :0]
+
+    def query(self, field, start, end=None, resolution=0):
+        """Return (timestamps, mean, low, high, count) arrays for one field.
+
+        Uses the coarsest tier no coarser than `resolution` seconds that
+        still reaches back to `start`; failing that, the finest tier that
+        does. Raw rows count as one-sample buckets.
+        """
+        if end is None:
+            end = (self.last_timestamp or start) + 1
+        newest = self.last_timestamp if self.last_timestamp is not None else end
+        column = self._index[field]
+
+        candidates = [tier for tier in self.tiers if newest - tier.retention <= start]
+        # Raw rows are capped by count, so a fast feed's may not reach back to start
+        if (resolution < self.tiers[0].resolution and newest - self.raw_seconds <= start
+                and (len(self.raw) < self.raw.capacity or self.raw.timestamps[0] <= start)):
+            timestamps, values = self.raw.series(field, since=start)
+            keep = (timestamps < end) & ~np.isnan(values)
+            timestamps, values = timestamps[keep], values[keep]
+            return timestamps, values, values, values, np.ones(len(values), dtype=np.int32)
+        fitting = [tier for tier in candidates if tier.resolution <= resolution]
+        if fitting:
+            tier = fitting[-1]
+        elif candidates:
+            tier = candidates[0]
+        else:
+            tier = self.tiers[-1]  # Nothing reaches back that far; return what there is
+        return tier.query(column, start, end)
+
+    def save(self, path=None):
+        path = path or self.path
+        arrays = {'fields': np.array(json.dumps(self.fields)),
+                  'last_timestamp': np.array(np.nan if self.last_timestamp is None
+                                             else self.last_timestamp)}
+        for tier in self.tiers:
+            for name in ('starts', 'counts', 'totals', 'lows', 'highs'):
+                arrays[f'{tier.resolution}_{name}'] = getattr(tier, name)
+        # Write beside the old file and swap it in, so a crash never leaves half a file
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        try:
+            with np.load(path) as saved:
+                if tuple(json.loads(str(saved['fields']))) != self.fields:
+                    return False
+                for tier in self.tiers:
+                    loaded = [saved[f'{tier.resolution}_{name}']
+                              for name in ('starts', 'counts', 'totals', 'lows', 'highs')]
+                    if len(loaded[0]) != tier.capacity:
+                        continue  # Retention changed; that tier starts afresh
+                    tier.starts, tier.counts, tier.totals, tier.lows, tier.highs = loaded
+                last = float(saved['last_timestamp'])
+        except (OSError, KeyError, ValueError):
+            return False  # Unreadable; start empty and let warm() refill
+        self.last_timestamp = None if np.isnan(last) else last
+        return True
+
+    def close(self):
+        if self.path is not None:
+            self.save()
@@ -0,0 +1,111 @@
+import curses
+from lazy import LazyModule
+from metrics import METRICS
+from screen import DIRECTIONS, line, wind_direction
+
+np = LazyModule('numpy')
+
+# Eighths for the wind rose bars
+BARS = ' ▁▂▃▄▅▆▇█'
+
+
+class WindAnalyzer:
+    """Rolling wind statistics over the last `window_seconds` of a HistoryBuffer.
+
+    Everything is computed in one vectorized pass over the history's column
+    views, and the result is cached against the newest timestamp, so a frame
+    that arrives without a new reading costs a dictionary lookup. Samples
+    slower than `calm` mph count as calm and stay out of the wind rose.
+    """
+
+    def __init__(self, history, window_seconds=3600, calm=0.5):
+        self.history = history
+        self.window_seconds = window_seconds
+        self.calm = calm
+        self._columns = [history.fields.index(field)
+                         for field in ('windspeedmph', 'windgustmph', 'winddir')]
+        self._key = None
+        self._stats = None
+
+    @METRICS.timed('wind_stats')
+    def get_stats(self):
+        """Return a dict of window statistics, or None without any wind readings"""
+        key = (self.history.last_timestamp(), len(self.history))
+        if key != self._key:
+            self._key = key
+            self._stats = self._compute()
+        return self._stats
+
+    def _compute(self):
+        _, values = self.history.window(self.window_seconds)
+        speeds, gusts, directions = values[:, self._columns].astype(np.float64).T
+
+        valid = np.isfinite(speeds) & np.isfinite(directions)
+        speeds = speeds[valid]
+        directions = directions[valid]
+        if speeds.size == 0:
+            return None
+
+        # Speed-weighted vector mean: strong winds count for more than light
+        # ones, and 350° and 10° average to north rather than south
+        radians = np.deg2rad(directions)
+        east = np.dot(speeds, np.sin(radians)) / speeds.size
+        north = np.dot(speeds, np.cos(radians)) / speeds.size
+        mean_speed = speeds.mean()
+        vector_speed = np.hypot(east, north)
+        mean_direction = float(np.degrees(np.arctan2(east, north)) % 360)
+        # 1.0 when the wind holds one direction, near 0 when it's all over
+        steadiness = float(vector_speed / mean_speed) if mean_speed > 0 else 0.0
+
+        windy = speeds >= self.calm
+        sectors = np.floor((directions[windy] + 11.25) / 22.5).astype(np.int64) % 16
+        rose = np.bincount(sectors, minlength=16) / speeds.size
+
+        gusts = gusts[np.isfinite(gusts)]
+        speed_p50, speed_p90 = np.percentile(speeds, (50, 90))
+        if gusts.size:
+            gust_p50, gust_p90 = np.percentile(gusts, (50, 90))
+            gust_max = gusts.max()
+        else:
+            gust_p50 = gust_p90 = gust_max = float('nan')
+
+        return {
+            'samples': int(speeds.size),
+            'mean_speed': float(mean_speed),
+            'mean_direction': mean_direction,
+            'steadiness': steadiness,
+            'speed_p50': float(speed_p50),
+            'speed_p90': float(speed_p90),
+            'gust_p50': float(gust_p50),
+            'gust_p90': float(gust_p90),
+            'gust_max': float(gust_max),
+            'rose': rose,
+            'calm': float(1 - windy.mean()),
+        }
+
+
+def wind_lines(stats, window_seconds):
+    """The wind panel rows for a get_stats() result"""
+    span = f"{window_seconds / 3600:g}h"
+    label = f"Wind {span}".ljust(12)
+    if stats is None:
+        return [line((f"{label}| collecting data...", curses.color_pair(3)))]
+
+    direction = stats['mean_direction']
+    rose = stats['rose']
+    # Scale bars to the busiest sector, so the shape reads at a glance
+    peak = rose.max()
+    levels = np.zeros(16, dtype=np.int64) if peak == 0 else np.ceil(rose / peak * 8).astype(np.int64)
+    bars = ''.join(BARS[level] for level in levels)
+    axis = ''.join(name if name in ('N', 'E', 'S', 'W') else ' ' for name in DIRECTIONS)
+
+    return [
+        line(f"{label}| {wind_direction(direction)} {direction:.0f}°"
+             f", steadiness {stats['steadiness']:.2f}"
+             f", mean {stats['mean_speed']:.1f} mph"),
+        line(f"Speed p50/90| {stats['speed_p50']:.1f} / {stats['speed_p90']:.1f} mph"
+             f", gust {stats['gust_p50']:.1f} / {stats['gust_p90']:.1f}"
+             f", max {stats['gust_max']:.1f}"),
+        line("Wind Rose   | ", (bars, curses.color_pair(1)), f" calm {stats['calm'] * 100:.0f}%"),
+        line(f"            | {axis}"),
+    ]